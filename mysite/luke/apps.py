@@ -3,3 +3,14 @@ from django.apps import AppConfig
 
 class LukeConfig(AppConfig):
     name = 'luke'
+
+    def ready(self):
+        from . import authentication, cache, dbhealth, images, pubsub, search, sqlite, tagindex
+        authentication.connect_signals()
+        cache.connect_signals()
+        dbhealth.connect_signals()
+        images.connect_signals()
+        pubsub.connect_signals()
+        search.connect_signals()
+        sqlite.connect_signals()
+        tagindex.connect_signals()
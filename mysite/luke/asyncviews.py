@@ -0,0 +1,131 @@
+"""
+Async versions of the read-heavy views, used under ASGI (see mysite/asgi.py
+and urls.py).
+
+Under ASGI, Django runs a sync view in the thread shared by all the sync code
+of the process, a slow query of one request holds up the others. These views
+serve what they can on the event loop:
+- api_root makes no query, it's rendered on the event loop;
+- the cached responses of the anonymous reads (see cache.py) are served on
+  the event loop, including 304 Not Modified, if the cache is in memory
+  (LocMemCache); a network cache (e.g., memcached) would block the loop, it's
+  read by sync_to_async() instead;
+- other requests (cache misses, writes, authenticated users) run the sync
+  DRF view by sync_to_async(), which also fills the cache. The reads (GET,
+  HEAD) run in the thread pool (thread_sensitive=False), concurrently, with
+  the connections of the pool's threads, which are closed or checked as
+  requests do. Writes stay in the shared thread.
+
+NOTE: Django 3.2 has no async ORM interface (QuerySet.aget() etc., 4.1+),
+the queries are made by sync_to_async() instead.
+"""
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections
+from django.http import HttpResponse
+
+from . import dbhealth, views
+from .cache import get_cache
+
+
+def has_credentials(request):
+    """
+    Whether the request may be authenticated, otherwise it's anonymous
+    without authenticating it (which may query the session or the user).
+    """
+    return ('HTTP_AUTHORIZATION' in request.META
+            or settings.SESSION_COOKIE_NAME in request.COOKIES)
+
+
+def is_local_cache():
+    """
+    Whether the response cache is read without I/O, on the event loop.
+    """
+    return isinstance(get_cache(), LocMemCache)
+
+
+def render(response):
+    """
+    Render a DRF response into a plain HttpResponse, otherwise Django renders
+    it by another sync_to_async().
+    """
+    if not hasattr(response, 'render'):
+        return response
+
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for name, value in response.items():
+        plain[name] = value
+    plain.cookies = response.cookies
+    return plain
+
+
+def _call_sync(view, request, *args, **kwargs):
+    return render(view(request, *args, **kwargs))
+
+
+def _call_sync_in_pool(view, request, *args, **kwargs):
+    """
+    _call_sync() in a thread of the pool, whose connections are not handled
+    by the request_started/finished signals of the request.
+    """
+    close_old_connections()
+    dbhealth.check_connections()
+    try:
+        return _call_sync(view, request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def call_sync(view, request, *args, **kwargs):
+    """
+    Return an awaitable of the response of the sync view.
+    """
+    if (request.method in ('GET', 'HEAD')
+            and not getattr(settings, 'LUKE_ASYNC_THREAD_SENSITIVE', False)):
+        return sync_to_async(_call_sync_in_pool, thread_sensitive=False)(
+            view, request, *args, **kwargs)
+    return sync_to_async(_call_sync)(view, request, *args, **kwargs)
+
+
+async def api_root(request, format=None):
+    if has_credentials(request):
+        return await call_sync(views.api_root, request, format=format)
+    return render(views.api_root(request, format=format))
+
+
+def cached_async_view(view_class):
+    """
+    Return the async view of a view with CachedResponseMixin.
+    """
+    sync_view = view_class.as_view()
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET' and not has_credentials(request):
+            instance = view_class()
+            instance.setup(request, *args, **kwargs)
+            if is_local_cache():
+                response = instance.get_cached_response(request)
+            else:
+                response = await sync_to_async(instance.get_cached_response,
+                                               thread_sensitive=False)(request)
+            if response is not None:
+                # As APIView.finalize_response() does.
+                for name, value in instance.default_response_headers.items():
+                    response[name] = value
+                return response
+
+        return await call_sync(sync_view, request, *args, **kwargs)
+
+    view.view_class = view_class
+    # As APIView.as_view() does, DRF enforces CSRF for session authentication.
+    view.csrf_exempt = True
+    return view
+
+
+post_detail = cached_async_view(views.PostDetail)
+post_photo_list = cached_async_view(views.PostPhotoList)
+tag_list = cached_async_view(views.TagList)
@@ -0,0 +1,146 @@
+"""
+Token authentication with expiry and a cache of the tokens.
+
+Basic authentication hashes the password (PBKDF2, hundreds of thousands of
+iterations) on every request, and TokenAuthentication of DRF queries the
+token and its user on every request. Here a token (with its user) is cached
+for settings.LUKE_TOKEN_CACHE_TIMEOUT seconds, so most requests make no
+query (see the bench_auth command). The fields of the user are cached but
+the password hash, which is deferred (loaded by a query if ever used).
+
+A token expires settings.LUKE_TOKEN_EXPIRY seconds after it was created
+(None for never), then obtain_auth_token (see views.py) gives a new one:
+    $ http POST :8000/api-token-auth/ username=adam password=123456
+    $ http :8000/feed/ 'Authorization: Token <token>'
+
+A cached token is deleted once the deletion of the token, or a save of its
+user (e.g., deactivated or its password changed), is committed. The tokens
+are cached in settings.LUKE_TOKEN_CACHE, which must be shared by the worker
+processes (e.g., memcached, see the settings) for the deletion to reach all
+of them. NOTE: With a per-process cache, the other workers keep accepting a
+revoked token for up to LUKE_TOKEN_CACHE_TIMEOUT seconds, which is kept
+short (5 seconds) then.
+
+Tokens are looked up from the primary database, a token just obtained may
+not be on the replica yet (see routers.py).
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils import timezone
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+CACHE_KEY_FORMAT = 'auth_token_%s'
+
+# Fields of the user which are not cached.
+UNCACHED_USER_FIELDS = ('password',)
+
+
+def get_cache():
+    return caches[getattr(settings, 'LUKE_TOKEN_CACHE', 'default')]
+
+
+def is_expired(token, now=None):
+    expiry = getattr(settings, 'LUKE_TOKEN_EXPIRY', None)
+    if expiry is None:
+        return False
+    return token.created <= (now or timezone.now()) - timedelta(seconds=expiry)
+
+
+def cache_token(token):
+    timeout = getattr(settings, 'LUKE_TOKEN_CACHE_TIMEOUT', 300)
+    expiry = getattr(settings, 'LUKE_TOKEN_EXPIRY', None)
+    if expiry is not None:
+        # Not cached beyond its expiry.
+        remaining = token.created + timedelta(seconds=expiry) - timezone.now()
+        timeout = min(timeout, int(remaining.total_seconds()))
+    if timeout > 0:
+        user = token.user
+        names = [field.attname for field in user._meta.concrete_fields
+                 if field.attname not in UNCACHED_USER_FIELDS]
+        value = (token.created, names, [getattr(user, name) for name in names])
+        get_cache().set(CACHE_KEY_FORMAT % token.key, value, timeout)
+
+
+def get_cached_token(key):
+    """
+    Return the cached token with its user, or None.
+    """
+    cached = get_cache().get(CACHE_KEY_FORMAT % key)
+    if cached is None:
+        return None
+
+    created, names, values = cached
+    User = get_user_model()
+    # The other fields are deferred, save() only writes the loaded ones.
+    user = User.from_db(router.db_for_write(User), names, values)
+    return Token(key=key, user=user, created=created)
+
+
+def uncache_tokens(keys):
+    get_cache().delete_many([CACHE_KEY_FORMAT % key for key in keys])
+
+
+def uncache_tokens_on_commit(keys, using=None):
+    """
+    Otherwise a concurrent request could cache the old token again.
+    """
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: uncache_tokens(keys), using=using)
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication with expiry, by the cached tokens.
+    """
+
+    def authenticate_credentials(self, key):
+        token = get_cached_token(key)
+        if token is None:
+            try:
+                token = (Token.objects.using(router.db_for_write(Token))
+                         .select_related('user').get(key=key))
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            cache_token(token)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        if is_expired(token):
+            raise exceptions.AuthenticationFailed('Token has expired.')
+
+        return (token.user, token)
+
+
+################################################################################
+# Signals
+################################################################################
+
+
+def token_deleted(sender, instance, using, **kwargs):
+    uncache_tokens_on_commit([instance.key], using)
+
+
+def user_saved(sender, instance, created, using, update_fields=None, **kwargs):
+    # NOTE: Logging in only updates last_login.
+    if created or update_fields == frozenset(['last_login']):
+        return
+    keys = Token.objects.using(using).filter(user=instance).values_list('key', flat=True)
+    uncache_tokens_on_commit(keys, using)
+
+
+def connect_signals():
+    from django.contrib.auth import get_user_model
+    from django.db.models.signals import post_save, post_delete
+
+    post_delete.connect(token_deleted, sender=Token, dispatch_uid='luke-auth-token-delete')
+    post_save.connect(user_saved, sender=get_user_model(), dispatch_uid='luke-auth-user-save')
@@ -0,0 +1,170 @@
+"""
+Scalable Bloom filter of integer keys, e.g., the ids of the posts a user has
+seen (see visits.get_seen_filter()).
+
+A Bloom filter answers "maybe in the set" or "surely not in the set" with a
+bit array and k hash functions, at about 1.44 * log2(1 / p) bits per key for
+a false positive rate p. It can't grow, so a scalable filter adds slices of
+growing capacity (and tightening error rates, so the total rate is bounded
+by error_rate) as keys are added. Keys can't be removed.
+
+See: Almeida et al., Scalable Bloom Filters, 2007.
+"""
+
+import hashlib
+import math
+import struct
+
+
+def _hashes(key):
+    """
+    Return two 64-bit hashes of an integer key, for double hashing.
+    """
+    digest = hashlib.blake2b(str(key).encode('ascii'), digest_size=16).digest()
+    return struct.unpack('>QQ', digest)
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate, count=0, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+
+        # Optimal number of bits and hashes for the capacity and the rate.
+        self.m = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+
+        self.bits = bits if bits is not None else bytearray((self.m + 7) // 8)
+
+    def _positions(self, hashes):
+        h1, h2 = hashes
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def __contains__(self, key):
+        return self.contains_hashes(_hashes(key))
+
+    def add(self, key):
+        self.add_hashes(_hashes(key))
+
+    # The hashes of a key are shared by the slices of a scalable filter.
+
+    def contains_hashes(self, hashes):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(hashes))
+
+    def add_hashes(self, hashes):
+        bits = self.bits
+        for p in self._positions(hashes):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter(object):
+
+    # Magic, version, number of slices, initial capacity, growth, error rate,
+    # tightening ratio.
+    HEADER = struct.Struct('>2sBHIBdd')
+    # Capacity, count, error rate.
+    SLICE = struct.Struct('>IId')
+
+    MAGIC = b'SB'
+    VERSION = 1
+
+    def __init__(self, initial_capacity=1000, error_rate=0.01, growth=2, tightening=0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.slices = []
+
+    def __contains__(self, key):
+        hashes = _hashes(key)
+        return any(s.contains_hashes(hashes) for s in self.slices)
+
+    def __len__(self):
+        return sum(s.count for s in self.slices)
+
+    def add(self, key):
+        """
+        Add the key, return False if it may be there already.
+        """
+        hashes = _hashes(key)
+        if any(s.contains_hashes(hashes) for s in self.slices):
+            return False
+
+        if not self.slices or self.slices[-1].is_full:
+            i = len(self.slices)
+            # The rates sum up to at most error_rate.
+            self.slices.append(BloomFilter(
+                self.initial_capacity * self.growth ** i,
+                self.error_rate * (1 - self.tightening) * self.tightening ** i))
+
+        self.slices[-1].add_hashes(hashes)
+        return True
+
+    def update(self, keys):
+        """
+        Add the keys, return the number of the new ones.
+        """
+        return sum(1 for key in keys if self.add(key))
+
+    def union(self, other):
+        """
+        Add the keys of another filter of the same parameters, by OR of the
+        bits of their slices.
+        """
+        params = (self.initial_capacity, self.error_rate, self.growth, self.tightening)
+        if params != (other.initial_capacity, other.error_rate, other.growth, other.tightening):
+            raise ValueError('The filters have different parameters.')
+
+        for i, theirs in enumerate(other.slices):
+            if i == len(self.slices):
+                self.slices.append(BloomFilter(theirs.capacity, theirs.error_rate,
+                                               theirs.count, bytearray(theirs.bits)))
+                continue
+            mine = self.slices[i]
+            n = len(mine.bits)
+            mine.bits = bytearray((int.from_bytes(mine.bits, 'big')
+                                   | int.from_bytes(theirs.bits, 'big')).to_bytes(n, 'big'))
+            # The keys in both are counted twice, which may only fill the
+            # slice early.
+            mine.count = min(mine.count + theirs.count, mine.capacity)
+
+    @property
+    def nbytes(self):
+        return sum(len(s.bits) for s in self.slices)
+
+    def to_bytes(self):
+        parts = [self.HEADER.pack(self.MAGIC, self.VERSION, len(self.slices),
+                                  self.initial_capacity, self.growth,
+                                  self.error_rate, self.tightening)]
+        for s in self.slices:
+            parts.append(self.SLICE.pack(s.capacity, s.count, s.error_rate))
+            parts.append(bytes(s.bits))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, version, n, initial_capacity, growth, error_rate, tightening = \
+            cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('Not a scalable Bloom filter.')
+
+        f = cls(initial_capacity, error_rate, growth, tightening)
+        offset = cls.HEADER.size
+        for _ in range(n):
+            capacity, count, slice_error_rate = cls.SLICE.unpack_from(data, offset)
+            offset += cls.SLICE.size
+            s = BloomFilter(capacity, slice_error_rate, count)
+            size = len(s.bits)
+            s.bits = bytearray(data[offset:offset + size])
+            offset += size
+            f.slices.append(s)
+        return f
@@ -0,0 +1,216 @@
+"""
+Response cache for the read endpoints which anyone can access.
+
+Only GET requests of anonymous users are cached, authenticated users always
+get fresh responses.
+
+A cached response is keyed by the scheme and host (the content has absolute
+links), the full path (including the format suffix and the query string),
+the Accept header and the generations of the cache tags of the view, e.g.,
+'post:1'. Invalidating a tag just bumps its generation, so
+all the responses keyed by the old generation (whatever their URLs or Accept
+headers are) become unreachable and expire later.
+
+The signal handlers at the bottom invalidate the tags when the models
+change. They are connected in LukeConfig.ready().
+"""
+
+import hashlib
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from rest_framework import status
+
+from .conditional import conditional_response
+
+
+CACHE_ALIAS = 'default'
+
+KEY_PREFIX = 'luke:response:'
+GENERATION_KEY_PREFIX = 'luke:generation:'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_generations(tags):
+    """
+    Return the current generations of the tags.
+    A missing generation (never set or evicted) is initialized to a new
+    random value, an old response can't come back this way.
+    """
+    cache = get_cache()
+    keys = [GENERATION_KEY_PREFIX + tag for tag in tags]
+
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            generations[key] = cache.get(key)
+
+    return [generations[key] for key in keys]
+
+
+def invalidate(*tags):
+    cache = get_cache()
+    cache.set_many({GENERATION_KEY_PREFIX + tag: uuid.uuid4().hex for tag in tags},
+                   timeout=None)
+
+
+def invalidate_on_commit(*tags):
+    """
+    Invalidate after the current transaction commits, otherwise a concurrent
+    request could cache the data which is not committed yet.
+    """
+    transaction.on_commit(lambda: invalidate(*tags))
+
+
+class CachedResponseMixin(object):
+    """
+    Cache the responses of GET requests by anonymous users.
+    Views specify the tags which invalidate their responses.
+    """
+
+    # In seconds. Also bounds the staleness of data without invalidation.
+    cache_timeout = 60 * 5
+
+    # Headers cached along with the content.
+    cache_headers = ('ETag',)
+
+    def get_cache_tags(self):
+        raise NotImplementedError('Views must specify the cache tags.')
+
+    def get_response_cache_key(self):
+        request = self.request
+
+        # The content has absolute links, which depend on the host and scheme.
+        parts = [request.scheme, request.get_host(), request.get_full_path(),
+                 request.META.get('HTTP_ACCEPT', '')]
+        parts.extend(get_generations(self.get_cache_tags()))
+
+        digest = hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+        return KEY_PREFIX + digest
+
+    def is_response_cacheable(self):
+        return self.request.method == 'GET' and not self.request.user.is_authenticated
+
+    def get(self, request, *args, **kwargs):
+        # Authentication has been performed by initial().
+        if not self.is_response_cacheable():
+            return super(CachedResponseMixin, self).get(request, *args, **kwargs)
+
+        response = self.get_cached_response(request)
+        if response is None:
+            return super(CachedResponseMixin, self).get(request, *args, **kwargs)
+        return response
+
+    def get_cached_response(self, request):
+        """
+        Return the cached response (or 304) of the request, or None.
+        Also used by the async views, see asyncviews.py.
+        """
+        self.response_cache_key = self.get_response_cache_key()
+
+        cached = get_cache().get(self.response_cache_key)
+        if cached is None:
+            return None
+
+        content, content_type, headers = cached
+
+        # The cached response may carry an ETag, see conditional.py.
+        if 'ETag' in headers:
+            response = conditional_response(request, headers['ETag'])
+            if response is not None:
+                return response
+
+        response = HttpResponse(content, content_type=content_type)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(CachedResponseMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+
+        key = getattr(self, 'response_cache_key', None)
+        renderer = getattr(response, 'accepted_renderer', None)
+
+        # The browsable API is not cached, it renders forms for the user.
+        if (key is not None and renderer is not None and renderer.format != 'api'
+                and response.status_code == status.HTTP_200_OK):
+            response.add_post_render_callback(
+                lambda r: self.cache_response(key, r))
+
+        return response
+
+    def cache_response(self, key, response):
+        headers = {name: response[name] for name in self.cache_headers
+                   if response.has_header(name)}
+        value = (response.content, response['Content-Type'], headers)
+        get_cache().set(key, value, self.cache_timeout)
+
+
+################################################################################
+# Invalidation
+################################################################################
+
+
+def post_changed(sender, instance, **kwargs):
+    invalidate_on_commit('post:{}'.format(instance.pk))
+
+
+def post_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        invalidate_on_commit('post:{}'.format(instance.pk))
+    elif pk_set:
+        # Posts added to or removed from a tag.
+        invalidate_on_commit(*['post:{}'.format(pk) for pk in pk_set])
+
+
+def tag_changed(sender, instance, **kwargs):
+    # Posts render the tag names when tags are expanded.
+    # NOTE: Collect the posts before the relations are deleted.
+    tags = ['tags', 'tag:{}'.format(instance.pk)]
+    if instance.pk is not None:
+        post_ids = instance.post_set.values_list('pk', flat=True)
+        tags.extend('post:{}'.format(pk) for pk in post_ids)
+    invalidate_on_commit(*tags)
+
+
+def tags_created(sender, tags, **kwargs):
+    invalidate_on_commit('tags')
+
+
+def post_child_changed(sender, instance, **kwargs):
+    """
+    For photos and visits, which are rendered by or counted into the post.
+    """
+    invalidate_on_commit('post:{}'.format(instance.post_id))
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+    from . import models
+    from .models import Post, Tag, Photo, Visit
+
+    post_save.connect(post_changed, sender=Post, dispatch_uid='luke-cache-post-save')
+    post_delete.connect(post_changed, sender=Post, dispatch_uid='luke-cache-post-delete')
+    m2m_changed.connect(post_tags_changed, sender=Post.tags.through,
+                        dispatch_uid='luke-cache-post-tags')
+
+    post_save.connect(tag_changed, sender=Tag, dispatch_uid='luke-cache-tag-save')
+    pre_delete.connect(tag_changed, sender=Tag, dispatch_uid='luke-cache-tag-delete')
+    models.tags_created.connect(tags_created, sender=Tag, dispatch_uid='luke-cache-tags-created')
+
+    for model in (Photo, Visit):
+        post_save.connect(post_child_changed, sender=model,
+                          dispatch_uid='luke-cache-{}-save'.format(model.__name__))
+        post_delete.connect(post_child_changed, sender=model,
+                            dispatch_uid='luke-cache-{}-delete'.format(model.__name__))
@@ -0,0 +1,91 @@
+"""
+Conditional GET support for posts.
+
+The validator is computed from the post rows only, so a client polling a
+post or a page of posts gets 304 Not Modified without any serialization.
+The ETag is a digest of the last_update_time and the visit counters of the
+posts, plus the representation (path, query and Accept header).
+
+NOTE: No Last-Modified, the counters are updated without touching
+last_update_time, so If-Modified-Since would get 304 with stale counters.
+"""
+
+import hashlib
+
+from django.utils.cache import get_conditional_response
+
+from rest_framework.response import Response
+
+
+def get_etag(request, posts):
+    """
+    Return the ETag of the posts.
+    """
+    h = hashlib.md5()
+    h.update(request.get_full_path().encode('utf-8'))
+    h.update(request.META.get('HTTP_ACCEPT', '').encode('utf-8'))
+
+    for post in posts:
+        h.update('|{}:{}:{}:{}:{}'.format(
+            post.pk, post.last_update_time.isoformat(),
+            post.like_count, post.dislike_count, post.visit_count).encode('utf-8'))
+
+    return '"{}"'.format(h.hexdigest())
+
+
+def set_etag(response, etag):
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+def conditional_response(request, etag):
+    """
+    Return 304 (or 412) response if the preconditions of the request say so,
+    or None.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_etag(response, etag)
+    return response
+
+
+class ConditionalRetrieveMixin(object):
+    """
+    Conditional GET for RetrieveModelMixin.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        etag = get_etag(request, [instance])
+        response = conditional_response(request, etag)
+        if response is not None:
+            return response
+
+        serializer = self.get_serializer(instance)
+        return set_etag(Response(serializer.data), etag)
+
+
+class ConditionalListMixin(object):
+    """
+    Conditional GET for ListModelMixin, validated by the current page.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        posts = page if page is not None else list(queryset)
+
+        etag = get_etag(request, posts)
+        response = conditional_response(request, etag)
+        if response is not None:
+            return response
+
+        serializer = self.get_serializer(posts, many=True)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        return set_etag(response, etag)
@@ -0,0 +1,33 @@
+"""
+Health checks of persistent database connections.
+
+With CONN_MAX_AGE, a connection is reused by the next requests of the
+worker, and may have been closed by the server meanwhile (e.g., restarted,
+or a failover of the replica), then the first query of a request fails.
+Django 4.1+ checks a connection before reusing it if CONN_HEALTH_CHECKS is
+set. Django 3.2 ignores the setting, so here the connections with it are
+checked at the start of each request (the request_started signal, connected
+in LukeConfig.ready()), and closed if unusable, a new one is opened on the
+next query.
+
+NOTE: That's a query (e.g., SELECT 1) per request and open connection,
+still much cheaper than a new connection per request.
+"""
+
+import django
+from django.db import connections
+
+
+def check_connections(**kwargs):
+    for connection in connections.all():
+        if (connection.connection is not None
+                and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.is_usable()):
+            connection.close()
+
+
+def connect_signals():
+    from django.core.signals import request_started
+
+    if django.VERSION < (4, 1):
+        request_started.connect(check_connections, dispatch_uid='luke-db-health-checks')
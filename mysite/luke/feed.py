@@ -0,0 +1,186 @@
+"""
+Personalized feed.
+
+A user's affinity is a sparse vector of features ('mode:happy', 'tag:3',
+...) of the posts the user voted on recently, a like counts +1, a dislike -1,
+normalized to unit length. A candidate post is scored by its hot score (see
+ranking.py) plus its affinity with the user:
+    score + AFFINITY_WEIGHT * (affinity . features of the post)
+and a boost by the mood of the user, e.g., happy posts for a user whose last
+post is sad.
+
+Candidates are the hottest recent posts, minus the posts the user wrote or
+visited (by the Bloom filter of the user, see visits.get_seen_filter()).
+The ranked ids of a user are kept in a bounded LRU cache of this process for
+max_age seconds, so scrolling pages the same list without recomputing it.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Post, Visit
+from .visits import get_seen_filter
+
+
+# The hottest posts of the last CANDIDATE_AGE are the candidates.
+CANDIDATE_AGE = timedelta(days=7)
+MAX_CANDIDATES = 500
+
+# The recent votes which make the affinity.
+MAX_VOTES = 200
+
+# How much a perfect affinity is worth, in units of the hot score, i.e.,
+# ranking.DECAY_SECONDS (12.5 hours) of freshness.
+AFFINITY_WEIGHT = 2.0
+
+# The mode of the user's last post (within MOOD_AGE) -> boosts of modes.
+MOOD_AGE = timedelta(hours=24)
+MOOD_BOOSTS = {
+    'sad': {'happy': 1.0},
+}
+
+
+def post_features(modes, tags):
+    """
+    Return post id -> set of features.
+    :param modes: Post id -> mode.
+    :param tags: Iterable of (post id, tag id).
+    """
+    features = {pk: {'mode:' + mode} for pk, mode in modes.items()}
+    for pk, tag_id in tags:
+        features[pk].add('tag:{}'.format(tag_id))
+    return features
+
+
+def get_tags(post_ids):
+    return (Post.tags.through.objects
+            .filter(post_id__in=post_ids)
+            .values_list('post_id', 'tag_id'))
+
+
+def get_affinity(user):
+    """
+    Return the affinity vector of the user, feature -> weight.
+    """
+    votes = list(Visit.objects
+                 .filter(user=user, state__in=(1, 2))
+                 .order_by('-timestamp')
+                 .values_list('post_id', 'state', 'post__mode')[:MAX_VOTES])
+    if not votes:
+        return {}
+
+    modes = {pk: mode for pk, _, mode in votes}
+    features = post_features(modes, get_tags(list(modes)))
+
+    affinity = {}
+    for pk, state, _ in votes:
+        sign = 1 if state == 1 else -1
+        for feature in features[pk]:
+            affinity[feature] = affinity.get(feature, 0) + sign
+
+    norm = math.sqrt(sum(weight * weight for weight in affinity.values()))
+    return {feature: weight / norm for feature, weight in affinity.items() if weight}
+
+
+def get_mood(user):
+    mode = (Post.objects
+            .filter(user=user, create_time__gte=timezone.now() - MOOD_AGE)
+            .order_by('-create_time', '-id')
+            .values_list('mode', flat=True)
+            .first())
+    return mode or ''
+
+
+def rank_candidates(user):
+    """
+    Return the ids of the candidate posts for the user, the best first.
+    """
+    candidates = list(Post.objects
+                      .filter(create_time__gte=timezone.now() - CANDIDATE_AGE)
+                      .exclude(user=user)
+                      .order_by('-score', '-id')
+                      .values_list('id', 'mode', 'score')[:MAX_CANDIDATES])
+
+    # Skipped in memory, whatever the history of the user is.
+    seen = get_seen_filter(user)
+    candidates = [c for c in candidates if c[0] not in seen]
+    if not candidates:
+        return []
+
+    affinity = get_affinity(user)
+    boosts = MOOD_BOOSTS.get(get_mood(user), {})
+
+    features = {}
+    if affinity:
+        features = post_features({pk: mode for pk, mode, _ in candidates},
+                                 get_tags([pk for pk, _, _ in candidates]))
+
+    scores = {}
+    for pk, mode, score in candidates:
+        dot = sum(affinity.get(feature, 0) for feature in features.get(pk, ()))
+        scores[pk] = score + AFFINITY_WEIGHT * dot + boosts.get(mode, 0)
+
+    return sorted(scores, key=lambda pk: (-scores[pk], -pk))
+
+
+class CandidateCache(object):
+    """
+    LRU cache of user id -> ranked post ids, thread safe.
+    """
+
+    def __init__(self, max_size=1000, max_age=300):
+        self.max_size = max_size
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        # User id -> (monotonic time, post ids), the least recently used first.
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.max_age:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, post_ids):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), post_ids)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# The cache of this process.
+candidate_cache = CandidateCache()
+
+
+def get_feed(user, refresh=False):
+    """
+    Return the ranked post ids of the feed of the user.
+    """
+    post_ids = None if refresh else candidate_cache.get(user.pk)
+    if post_ids is None:
+        post_ids = rank_candidates(user)
+        candidate_cache.set(user.pk, post_ids)
+    return post_ids
@@ -0,0 +1,125 @@
+"""
+Geohash and great-circle distance, for finding posts near a place without
+any spatial extension of the database.
+
+A geohash interleaves the bits of longitude and latitude and encodes them in
+base 32, points close to each other share a common prefix. The posts around
+a point are found by prefix (range) lookups of the cell of the point and its
+8 neighbors, then filtered by the exact distance.
+
+See: https://en.wikipedia.org/wiki/Geohash
+"""
+
+import math
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# The length of the geohash stored for a post, a cell is a few centimeters.
+PRECISION = 12
+
+# Mean radius of the earth in meters.
+EARTH_RADIUS = 6371000
+
+# Meters per degree of latitude.
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def encode(lat, lng, precision=PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+
+    chars = []
+    bits = 0
+    n = 0
+    even = True  # Longitude first.
+
+    while len(chars) < precision:
+        value, rng = (lng, lng_range) if even else (lat, lat_range)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+
+        n += 1
+        if n == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            n = 0
+
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    Return (lat degrees, lng degrees) of the cells of the precision.
+    """
+    bits = precision * 5
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def precision_for(radius, lat):
+    """
+    Return the max precision whose cells are at least radius (in meters)
+    high and wide at the latitude, so that the cell of a point and its 8
+    neighbors cover the circle around the point.
+    """
+    cos_lat = max(math.cos(math.radians(lat)), 0.01)
+
+    for precision in range(PRECISION, 0, -1):
+        lat_deg, lng_deg = cell_size(precision)
+        height = lat_deg * METERS_PER_DEGREE
+        width = lng_deg * METERS_PER_DEGREE * cos_lat
+        if min(height, width) >= radius:
+            return precision
+    return 0
+
+
+def neighbors(lat, lng, precision):
+    """
+    Return the geohash of the cell of the point and its 8 neighbors.
+    """
+    if precision == 0:
+        # The whole world.
+        return ['']
+
+    lat_deg, lng_deg = cell_size(precision)
+
+    cells = set()
+    for dlat in (-lat_deg, 0, lat_deg):
+        for dlng in (-lng_deg, 0, lng_deg):
+            # Clamp at the poles and wrap around the antimeridian.
+            cell_lat = min(max(lat + dlat, -90.0), 90.0 - 1e-9)
+            cell_lng = (lng + dlng + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat, cell_lng, precision))
+
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """
+    Return [start, stop) of the geohashes starting with the prefix.
+    A range can use the index where LIKE 'x%' may not (e.g., SQLite).
+    """
+    # '{' is right after 'z', the last char of BASE32.
+    return prefix, prefix + '{'
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Return the great-circle distance in meters.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+
+    a = (math.sin(dphi / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
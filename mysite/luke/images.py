@@ -0,0 +1,118 @@
+"""
+Resized variants of uploaded images.
+
+Each variant is stored next to the original under MEDIA_ROOT with the
+variant name inserted before the extension, e.g.,
+    post_photos/abc.jpg
+    post_photos/abc.thumb.webp
+    post_photos/abc.feed.webp
+    post_photos/abc.full.webp
+so the variant URLs can be derived from the name of the original without
+any extra column.
+"""
+
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+from PIL import Image, ImageOps, features
+
+
+# Name -> (width, height, crop).
+# A cropped variant fills the box exactly, others fit into the box.
+PHOTO_VARIANTS = {
+    'thumb': (240, 240, True),
+    'feed': (720, 720, False),
+    'full': (1600, 1600, False),
+}
+
+AVATAR_VARIANTS = {
+    'thumb': (96, 96, True),
+    'full': (480, 480, True),
+}
+
+# Fall back to JPEG if Pillow is built without WebP.
+if features.check('webp'):
+    FORMAT, EXTENSION = 'WEBP', 'webp'
+else:
+    FORMAT, EXTENSION = 'JPEG', 'jpg'
+
+QUALITY = 80
+
+
+def variant_name(name, variant):
+    root, _ = os.path.splitext(name)
+    return '{}.{}.{}'.format(root, variant, EXTENSION)
+
+
+def variant_urls(field_file, variants):
+    """
+    Return variant name -> URL (relative to the site) of an image field.
+    """
+    if not field_file:
+        return {}
+    storage = field_file.storage
+    return {variant: storage.url(variant_name(field_file.name, variant))
+            for variant in variants}
+
+
+def has_variants(field_file, variants):
+    storage = field_file.storage
+    return all(storage.exists(variant_name(field_file.name, variant))
+               for variant in variants)
+
+
+def resize(image, width, height, crop):
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+    image = image.copy()
+    # Never enlarge.
+    image.thumbnail((width, height), Image.LANCZOS)
+    return image
+
+
+def make_variants(field_file, variants):
+    """
+    Decode the image of the field file, and store its resized variants.
+    Existing variants are replaced.
+    """
+    storage = field_file.storage
+
+    with storage.open(field_file.name, 'rb') as f:
+        image = Image.open(f)
+        # Apply the EXIF orientation of photos taken by phones.
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+
+    for variant, (width, height, crop) in variants.items():
+        output = BytesIO()
+        resize(image, width, height, crop).save(output, FORMAT, quality=QUALITY)
+
+        name = variant_name(field_file.name, variant)
+        # Otherwise the storage saves it under another available name.
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(output.getvalue()))
+
+
+################################################################################
+# Signals
+################################################################################
+
+
+def profile_saved(sender, instance, **kwargs):
+    """
+    Make the variants of a new avatar.
+    """
+    avatar = instance.avatar
+    if avatar and not has_variants(avatar, AVATAR_VARIANTS):
+        make_variants(avatar, AVATAR_VARIANTS)
+
+
+def connect_signals():
+    from django.db.models.signals import post_save
+    from .models import Profile
+
+    post_save.connect(profile_saved, sender=Profile, dispatch_uid='luke-images-profile-save')
@@ -0,0 +1,63 @@
+"""
+Database-backed queue of photo processing.
+
+A new photo is stored as is with state PENDING, the process_photos command
+claims the pending photos and makes their variants (see images.py) out of
+the request path. A claim is a conditional UPDATE, so any number of workers
+can drain the queue at the same time.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import images
+from .models import Photo
+
+
+logger = logging.getLogger('luke')
+
+
+def claim_photos(limit):
+    """
+    Claim up to limit pending photos, the oldest first.
+    """
+    pending = (Photo.objects.filter(state=Photo.PENDING)
+               .order_by('id')
+               .values_list('pk', flat=True)[:limit])
+
+    claimed = []
+    for pk in pending:
+        # Another worker may have claimed it in the meantime.
+        if Photo.objects.filter(pk=pk, state=Photo.PENDING).update(
+                state=Photo.PROCESSING, claim_time=timezone.now()):
+            claimed.append(pk)
+
+    return list(Photo.objects.filter(pk__in=claimed).order_by('id'))
+
+
+def process_photo(photo):
+    try:
+        images.make_variants(photo.image, images.PHOTO_VARIANTS)
+    except Exception:
+        logger.exception('Failed to process photo %s', photo.pk)
+        state = Photo.FAILED
+    else:
+        state = Photo.READY
+
+    # Saved by the model, the signals invalidate the cached responses of the
+    # post and touch its last_update_time (see cache.py and models.py).
+    photo.state = state
+    photo.save(update_fields=['state'])
+    return state
+
+
+def requeue_stale_photos(age):
+    """
+    Requeue the photos claimed more than age seconds ago, whose workers
+    have probably died.
+    """
+    deadline = timezone.now() - timedelta(seconds=age)
+    return (Photo.objects.filter(state=Photo.PROCESSING, claim_time__lt=deadline)
+            .update(state=Photo.PENDING, claim_time=None))
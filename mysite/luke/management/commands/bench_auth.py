@@ -0,0 +1,73 @@
+import time
+from base64 import b64encode
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from luke.authentication import ExpiringTokenAuthentication, uncache_tokens
+
+
+class Command(BaseCommand):
+    """
+    Measure the cost of authenticating a request, by Basic authentication (a
+    password hash per request), the tokens of DRF (a query per request) and
+    the cached tokens (see luke/authentication.py):
+
+        $ python3 manage.py bench_auth -n 1000
+
+    It runs against a throwaway test database, with the PASSWORD_HASHERS and
+    the cache of the settings.
+    """
+
+    help = 'Benchmark the authentication of a request.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=1000)
+        parser.add_argument('--basic-requests', type=int, default=10,
+                            help='Number of requests by Basic authentication, which are slow.')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.bench(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def bench(self, options):
+        user = User.objects.create_user('bench', password='123456')
+        token = Token.objects.create(user=user)
+        uncache_tokens([token.key])
+
+        factory = RequestFactory()
+        credentials = b64encode(b'bench:123456').decode('ascii')
+        basic = factory.get('/', HTTP_AUTHORIZATION='Basic ' + credentials)
+        bearer = factory.get('/', HTTP_AUTHORIZATION='Token ' + token.key)
+
+        def bench(authentication, request, n):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(n):
+                    assert authentication.authenticate(request)[0].pk == user.pk
+                elapsed = time.perf_counter() - start
+            return elapsed / n, len(queries) / n
+
+        # The first request caches the token.
+        ExpiringTokenAuthentication().authenticate(bearer)
+
+        n = options['requests']
+        for name, authentication, request, count in (
+                ('Basic', BasicAuthentication(), basic, options['basic_requests']),
+                ('Token', TokenAuthentication(), bearer, n),
+                ('Cached token', ExpiringTokenAuthentication(), bearer, n)):
+            seconds, queries = bench(authentication, request, count)
+            self.stdout.write('{:13} {:10.1f} us per request, {:.2f} queries'.format(
+                name + ':', seconds * 1e6, queries))
+
+        self.stdout.write(self.style.SUCCESS('Password hasher: {}'.format(
+            user.password.split('$')[0])))
@@ -0,0 +1,71 @@
+import random
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from luke.bloom import ScalableBloomFilter
+
+
+class Command(BaseCommand):
+    """
+    Measure the "seen" Bloom filter of a user with many visits: the stored
+    size per user, the false positive rate, and the time to add and look up.
+
+        $ python3 manage.py bench_bloom --visits 100000
+
+    Compared with a set of the post ids, as the seen posts would be held in
+    memory otherwise.
+    """
+
+    help = 'Benchmark the memory and false positive rate of the seen filters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visits', type=int, default=100000,
+                            help='Number of posts the user has visited.')
+        parser.add_argument('--probes', type=int, default=100000,
+                            help='Number of unseen posts looked up.')
+        parser.add_argument('--error-rate', type=float, default=0.01)
+        parser.add_argument('--initial-capacity', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        n = options['visits']
+
+        # Post ids are sparse among all posts.
+        ids = rng.sample(range(1, n * 20), n + options['probes'])
+        seen_ids, unseen_ids = ids[:n], ids[n:]
+
+        seen = ScalableBloomFilter(initial_capacity=options['initial_capacity'],
+                                   error_rate=options['error_rate'])
+
+        start = time.perf_counter()
+        seen.update(seen_ids)
+        add_time = time.perf_counter() - start
+
+        data = seen.to_bytes()
+        start = time.perf_counter()
+        seen = ScalableBloomFilter.from_bytes(data)
+        load_time = time.perf_counter() - start
+
+        missing = sum(1 for pk in seen_ids if pk not in seen)
+
+        start = time.perf_counter()
+        false_positives = sum(1 for pk in unseen_ids if pk in seen)
+        lookup_time = time.perf_counter() - start
+
+        id_set = set(seen_ids)
+        set_bytes = sys.getsizeof(id_set) + sum(sys.getsizeof(pk) for pk in id_set)
+
+        self.stdout.write('Visits:          {}'.format(n))
+        self.stdout.write('Slices:          {}'.format(len(seen.slices)))
+        self.stdout.write('Stored size:     {:.1f} KiB ({:.2f} bytes per visit)'.format(
+            len(data) / 1024, len(data) / n))
+        self.stdout.write('Set of ids:      {:.1f} KiB'.format(set_bytes / 1024))
+        self.stdout.write('False positives: {:.4%} (target {:.2%}), {} seen missed'.format(
+            false_positives / len(unseen_ids), options['error_rate'], missing))
+        self.stdout.write('Add:             {:.2f} us per visit'.format(add_time / n * 1e6))
+        self.stdout.write('Load:            {:.2f} ms'.format(load_time * 1e3))
+        self.stdout.write('Lookup:          {:.2f} us per post'.format(
+            lookup_time / len(unseen_ids) * 1e6))
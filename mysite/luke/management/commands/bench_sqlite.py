@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from luke.sqlite import apply_pragmas
+
+
+SCHEMA = '''
+CREATE TABLE post (id INTEGER PRIMARY KEY, content TEXT, create_time REAL);
+CREATE TABLE visit (id INTEGER PRIMARY KEY, user_id INTEGER, post_id INTEGER,
+                    state INTEGER, timestamp REAL);
+CREATE INDEX visit_timestamp ON visit (timestamp);
+'''
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ok = 0
+        self.locked = 0
+        self.max_latency = 0.0
+
+    def add(self, latency, locked=False):
+        with self.lock:
+            if locked:
+                self.locked += 1
+            else:
+                self.ok += 1
+            self.max_latency = max(self.max_latency, latency)
+
+
+class Command(BaseCommand):
+    """
+    Compare the read throughput of SQLite while writes are running, with the
+    default settings and with the pragmas of luke/sqlite.py.
+
+        $ python3 manage.py bench_sqlite --seconds 5 --readers 4 --writers 2
+
+    Runs on a temporary database file, with a schema like the one of posts
+    and visits: readers list the latest posts (as PostList does), writers
+    insert visits one transaction each (as VisitList does).
+    """
+
+    help = 'Benchmark concurrent reads and writes on SQLite.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5,
+                            help='Duration of each run.')
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--posts', type=int, default=10000,
+                            help='Number of posts to create.')
+        parser.add_argument('--timeout', type=float, default=5,
+                            help='Busy timeout in seconds of the default mode, '
+                                 'the one of Python sqlite3.')
+
+    def handle(self, *args, **options):
+        for tuned in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                self.setup(path, options['posts'])
+                reads, writes = self.run(path, tuned, options)
+
+            self.stdout.write('{:<8} reads: {:>8.0f}/s, {} locked, max {:.3f}s; '
+                              'writes: {:>6.0f}/s, {} locked, max {:.3f}s'.format(
+                                  'tuned' if tuned else 'default',
+                                  reads.ok / options['seconds'], reads.locked, reads.max_latency,
+                                  writes.ok / options['seconds'], writes.locked, writes.max_latency))
+
+    def setup(self, path, posts):
+        db = sqlite3.connect(path)
+        db.executescript(SCHEMA)
+        now = time.time()
+        db.executemany('INSERT INTO post (content, create_time) VALUES (?, ?)',
+                       (('x' * 200, now + i) for i in range(posts)))
+        db.commit()
+        db.close()
+
+    def connect(self, path, tuned, timeout):
+        db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        if tuned:
+            apply_pragmas(db.cursor())
+        return db
+
+    def run(self, path, tuned, options):
+        # Set WAL mode before the other connections are opened.
+        self.connect(path, tuned, options['timeout']).close()
+
+        reads = Stats()
+        writes = Stats()
+        stop = threading.Event()
+
+        def reader():
+            db = self.connect(path, tuned, options['timeout'])
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    db.execute('SELECT id, content, create_time FROM post '
+                               'ORDER BY create_time DESC LIMIT 20').fetchall()
+                    db.execute('SELECT COUNT(*) FROM visit').fetchone()
+                    reads.add(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    reads.add(time.perf_counter() - start, locked=True)
+            db.close()
+
+        def writer(user_id):
+            db = self.connect(path, tuned, options['timeout'])
+            post_id = 0
+            while not stop.is_set():
+                post_id = post_id % options['posts'] + 1
+                start = time.perf_counter()
+                try:
+                    with db:
+                        db.execute('INSERT INTO visit (user_id, post_id, state, timestamp) '
+                                   'VALUES (?, ?, 0, ?)', (user_id, post_id, time.time()))
+                    writes.add(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    writes.add(time.perf_counter() - start, locked=True)
+            db.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return reads, writes
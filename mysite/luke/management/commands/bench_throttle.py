@@ -0,0 +1,89 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.throttling import ScopedRateThrottle
+
+from luke.throttling import TokenBucketThrottle
+from luke.views import PostList
+
+
+class Command(BaseCommand):
+    """
+    Measure the cost of a throttle check of a write, by the token bucket (see
+    luke/throttling.py) and by the sliding window of DRF, compared with the
+    cheapest query to the database (an in-process SQLite has no network round
+    trip, so it's a lower bound):
+
+        $ python3 manage.py bench_throttle -n 100000
+
+    The checks run against the caches of the settings and must make no query,
+    run it with the shared cache of production (see LUKE_MEMCACHED).
+    """
+
+    help = 'Benchmark the throttle check of a write.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=100,
+                            help='Number of distinct users (buckets).')
+        parser.add_argument('--rate', default='100/s',
+                            help='Rate of the scope, e.g., "20/m".')
+
+    def handle(self, *args, **options):
+        n = options['requests']
+        rate = options['rate']
+
+        factory = RequestFactory()
+        requests = []
+        for i in range(options['users']):
+            request = factory.post('/posts/', REMOTE_ADDR='10.0.{}.{}'.format(i // 256, i % 256))
+            request.user = User(pk=i + 1, username='bench{}'.format(i))
+            requests.append(request)
+
+        view = PostList()
+
+        def bench(throttle_class):
+            class Throttle(throttle_class):
+                def get_rate(self):
+                    return rate
+
+            throttle = Throttle()
+            throttle.cache.delete_many([throttle.cache_format % {'scope': 'posts', 'ident': r.user.pk}
+                                        for r in requests])
+            allowed = 0
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for i in range(n):
+                    # As APIView.check_throttles() does, per request.
+                    if Throttle().allow_request(requests[i % len(requests)], view):
+                        allowed += 1
+                elapsed = time.perf_counter() - start
+            return elapsed / n, allowed, len(queries)
+
+        self.stdout.write('Rate:         {} per user, {} users, {} requests'.format(
+            rate, len(requests), n))
+        for name, throttle_class in (('Token bucket', TokenBucketThrottle),
+                                     ('DRF window', ScopedRateThrottle)):
+            seconds, allowed, queries = bench(throttle_class)
+            self.stdout.write('{:13} {:.2f} us per check, {} allowed, {} queries'.format(
+                name + ':', seconds * 1e6, allowed, queries))
+
+        # The cheapest query, a lower bound of a throttle in the database.
+        m = min(n, 1000)
+        with connection.cursor() as cursor:
+            start = time.perf_counter()
+            for _ in range(m):
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            elapsed = time.perf_counter() - start
+        self.stdout.write('{:13} {:.2f} us per query ({})'.format(
+            'SELECT 1:', elapsed / m * 1e6, connection.vendor))
+        alias = getattr(settings, 'LUKE_THROTTLE_CACHE', 'default')
+        self.stdout.write(self.style.SUCCESS('Cache backend: {} ({})'.format(
+            settings.CACHES[alias]['BACKEND'], alias)))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from luke.models import Discussion
+
+
+class Command(BaseCommand):
+    """
+    Delete the discussions which had no message for Discussion.LIFETIME.
+
+        $ python3 manage.py expire_discussions
+
+    Expired discussions are already hidden by the views, run this from cron
+    (e.g., every hour) to reclaim the space. Each batch is deleted by its own
+    transaction, so the locks are held briefly.
+    """
+
+    help = 'Delete the expired discussions and their messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of discussions deleted per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        deleted = 0
+
+        while True:
+            with transaction.atomic():
+                # Oldest first, served by index luke_discussion_activity_idx.
+                pks = list(Discussion.objects.expired(now)
+                           .order_by('last_activity', 'id')
+                           .values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                # Check again, a message may have come in since.
+                _, counts = Discussion.objects.expired(now).filter(pk__in=pks).delete()
+
+            deleted += counts.get(Discussion._meta.label, 0)
+            if len(pks) < batch_size:
+                break
+
+        self.stdout.write(self.style.SUCCESS('Deleted {} discussions.'.format(deleted)))
@@ -0,0 +1,139 @@
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def rss(pid):
+    """
+    Return the resident memory in KiB of a process (Linux), or None.
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Command(BaseCommand):
+    """
+    Load test a running deployment with concurrent clients, e.g., compare
+    uWSGI (WSGI) with uvicorn (ASGI, see mysite/asgi.py) at the same memory:
+
+        $ uwsgi --http :8000 --module mysite.wsgi --processes 4
+        $ python3 manage.py loadtest http://127.0.0.1:8000/posts/1/ -c 200 --pid <pids>
+
+        $ uvicorn mysite.asgi:application --port 8001 --workers 4
+        $ python3 manage.py loadtest http://127.0.0.1:8001/posts/1/ -c 200 --pid <pids>
+
+    Slow clients are simulated by --think, the seconds a client waits between
+    its requests while keeping the connection.
+    """
+
+    help = 'Load test an URL with concurrent clients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('-c', '--concurrency', type=int, default=50,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--seconds', type=float, default=10,
+                            help='Duration of the test.')
+        parser.add_argument('--think', type=float, default=0,
+                            help='Seconds each client waits between its requests.')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Timeout of a request in seconds.')
+        parser.add_argument('--header', action='append', default=[],
+                            help='Extra request header, e.g., "Accept: application/json".')
+        parser.add_argument('--pid', type=int, nargs='*', default=[],
+                            help='Server processes whose memory (RSS) is sampled.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https'):
+            raise CommandError('Only http and https URLs are supported.')
+
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        headers = {}
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+
+        connection_class = (http.client.HTTPSConnection if url.scheme == 'https'
+                            else http.client.HTTPConnection)
+
+        lock = threading.Lock()
+        latencies = []
+        statuses = {}
+        errors = [0]
+        stop = threading.Event()
+
+        def client():
+            connection = None
+            while not stop.is_set():
+                if connection is None:
+                    connection = connection_class(url.netloc, timeout=options['timeout'])
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = None
+                    with lock:
+                        errors[0] += 1
+                    continue
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency)
+                    statuses[status] = statuses.get(status, 0) + 1
+                if options['think']:
+                    stop.wait(options['think'])
+            if connection is not None:
+                connection.close()
+
+        threads = [threading.Thread(target=client, daemon=True)
+                   for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+
+        # Sample the memory of the server while the clients run.
+        peak = {}
+        deadline = time.monotonic() + options['seconds']
+        while time.monotonic() < deadline:
+            for pid in options['pid']:
+                kib = rss(pid)
+                if kib is not None:
+                    peak[pid] = max(peak.get(pid, 0), kib)
+            time.sleep(min(0.2, max(deadline - time.monotonic(), 0)))
+
+        stop.set()
+        for thread in threads:
+            thread.join(options['timeout'])
+
+        latencies.sort()
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+        self.stdout.write('Requests:    {} ({:.1f}/s), {} errors'.format(
+            len(latencies), len(latencies) / options['seconds'], errors[0]))
+        self.stdout.write('Statuses:    {}'.format(
+            ', '.join('{}: {}'.format(k, v) for k, v in sorted(statuses.items()))))
+        self.stdout.write('Latency:     p50 {:.3f}s, p95 {:.3f}s, p99 {:.3f}s, max {:.3f}s'.format(
+            percentile(0.5), percentile(0.95), percentile(0.99),
+            latencies[-1] if latencies else 0.0))
+        if peak:
+            self.stdout.write('Peak RSS:    {:.1f} MiB in {} processes'.format(
+                sum(peak.values()) / 1024, len(peak)))
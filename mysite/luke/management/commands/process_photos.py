@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from luke import jobs
+from luke.models import Photo
+
+
+class Command(BaseCommand):
+    """
+    Make the variants of the uploaded photos in the background.
+
+        $ python3 manage.py process_photos
+
+    Run as many as needed next to the web workers, see jobs.py.
+    """
+
+    help = 'Process the pending photos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty.')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Number of photos claimed at a time.')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--stale', type=int, default=600,
+                            help='Requeue the photos claimed more than these seconds ago.')
+
+    def handle(self, *args, **options):
+        processed = 0
+
+        while True:
+            jobs.requeue_stale_photos(options['stale'])
+
+            photos = jobs.claim_photos(options['batch_size'])
+            for photo in photos:
+                state = jobs.process_photo(photo)
+                processed += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write('Photo {}: {}'.format(
+                        photo.pk, dict(Photo.STATES)[state]))
+
+            if not photos:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Processed {} photos.'.format(processed)))
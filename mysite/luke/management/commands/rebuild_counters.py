@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from luke.models import Post, Visit
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the visit counters and the scores of all posts from scratch.
+
+        $ python3 manage.py rebuild_counters
+    """
+
+    help = 'Rebuild the like/dislike/visit counters and hot scores of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts whose scores are updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        def count(**filters):
+            visits = (Visit.objects
+                      .filter(post=OuterRef('pk'), **filters)
+                      .order_by()
+                      .values('post')
+                      .annotate(n=Count('pk'))
+                      .values('n'))
+            return Coalesce(Subquery(visits, output_field=IntegerField()), 0)
+
+        with transaction.atomic():
+            # One UPDATE for the counters of all posts.
+            Post.objects.update(like_count=count(state=1),
+                                dislike_count=count(state=2),
+                                visit_count=count())
+
+            posts = Post.objects.only('like_count', 'dislike_count', 'create_time')
+            batch = []
+            for post in posts.iterator(chunk_size=batch_size):
+                post.score = post.hot_score()
+                batch.append(post)
+                if len(batch) >= batch_size:
+                    Post.objects.bulk_update(batch, ['score'])
+                    batch = []
+            if batch:
+                Post.objects.bulk_update(batch, ['score'])
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt counters of {} posts.'.format(Post.objects.count())))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from luke import search
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the full-text index of posts from scratch, e.g., after posts
+    are changed by bulk updates, which send no signals.
+
+        $ python3 manage.py rebuild_search_index
+    """
+
+    help = 'Rebuild the full-text search index of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts indexed per query.')
+
+    def handle(self, *args, **options):
+        n = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed {} posts.'.format(n)))
@@ -1,8 +1,18 @@
-from django.db import models
+import uuid
+from datetime import timedelta
+
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import geo
+from .ranking import hot_score
 
 
-# from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import Signal
 
 
 # -------------------------------------------------------------------------------
@@ -88,23 +98,120 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 # -------------------------------------------------------------------------------
 
+def normalize_tag_name(name):
+    """
+    Tags are case-insensitive, e.g., 'Shanghai' and 'shanghai' are the same.
+    """
+    return name.strip().casefold()
+
+
+# Sent with the tags created by TagManager.get_or_create_all(), in place of
+# post_save, e.g., to invalidate the cached tag list (see cache.py).
+tags_created = Signal()
+
+
+class TagManager(models.Manager):
+
+    def get_or_create_all(self, names):
+        """
+        Return the tags of the names, create the missing ones.
+        Takes one query if all the tags exist, three otherwise, however many
+        names are given.
+        """
+        names = set(normalize_tag_name(name) for name in names)
+        names.discard('')
+        if not names:
+            return []
+
+        tags = list(self.filter(name__in=names))
+        missing = names.difference(tag.name for tag in tags)
+        if missing:
+            # NOTE: bulk_create() doesn't call save() or send post_save.
+            # Tags created by others in the meantime are ignored.
+            self.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+            created = list(self.filter(name__in=missing))
+            tags_created.send(sender=Tag, tags=created, using=self.db)
+            tags.extend(created)
+        return tags
+
+
 class Tag(models.Model):
     """
     TODO: ordering
     """
 
-    name = models.CharField(max_length=32)
+    # Normalized by normalize_tag_name().
+    # NOTE: unique implies an index.
+    name = models.CharField(max_length=32, unique=True)
+
+    objects = TagManager()
 
     def __str__(self):
         return 'Tag: {}'.format(self.name)
 
+    def save(self, *args, **kwargs):
+        self.name = normalize_tag_name(self.name)
+        super(Tag, self).save(*args, **kwargs)
+
 
 # -------------------------------------------------------------------------------
 
+class PostManager(models.Manager):
+
+    def update_counters(self, post_id, likes=0, dislikes=0, visits=0):
+        """
+        Atomically add the deltas to the counters of a post and update its
+        score if the votes changed.
+        """
+        self.update_counters_bulk({post_id: (likes, dislikes, visits)})
+
+    def update_counters_bulk(self, deltas):
+        """
+        Atomically add the deltas to the counters of posts and update the
+        scores of the posts whose votes changed.
+        :param deltas: Post id -> (likes, dislikes, visits).
+
+        Posts with the same deltas (e.g., a page of "seen" visits) are updated
+        by one query. The scores are computed from the committed counters
+        within the same transaction, so concurrent votes can't leave stale
+        scores behind.
+        """
+        groups = {}
+        for post_id, delta in deltas.items():
+            if any(delta):
+                groups.setdefault(tuple(delta), []).append(post_id)
+        if not groups:
+            return
+
+        with transaction.atomic():
+            voted = []
+            for (likes, dislikes, visits), post_ids in groups.items():
+                self.filter(pk__in=post_ids).update(
+                    like_count=F('like_count') + likes,
+                    dislike_count=F('dislike_count') + dislikes,
+                    visit_count=F('visit_count') + visits)
+                if likes != dislikes:
+                    voted.extend(post_ids)
+
+            if voted:
+                posts = list(self.select_for_update()
+                             .only('like_count', 'dislike_count', 'create_time')
+                             .filter(pk__in=voted))
+                for post in posts:
+                    post.score = post.hot_score()
+                self.bulk_update(posts, ['score'])
+
+
 class Post(models.Model):
     class Meta:
         ordering = ('create_time',)
 
+        indexes = [
+            # For keyset pagination, see pagination.py.
+            models.Index(fields=['-create_time', '-id'], name='luke_post_created_idx'),
+            models.Index(fields=['-score', '-id'], name='luke_post_score_idx'),
+        ]
+
     # Happy, Sad, etc.
     MODES = (
         ('', 'Normal'),
@@ -122,7 +229,9 @@ class Post(models.Model):
 
     create_time = models.DateTimeField(auto_now_add=True)
 
-    last_update_time = models.DateTimeField(auto_now_add=True)
+    # Updated on every save, and when the photos or tags change.
+    # Used as the validator of conditional requests, see conditional.py.
+    last_update_time = models.DateTimeField(auto_now=True)
 
     mode = models.CharField(max_length=16, choices=MODES, default='')
 
@@ -131,6 +240,17 @@ class Post(models.Model):
     # Rename to location
     address = models.CharField(max_length=256, default='')
 
+    # Optional location of the post.
+    latitude = models.FloatField(null=True, blank=True,
+                                 validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True,
+                                  validators=[MinValueValidator(-180), MaxValueValidator(180)])
+
+    # Geohash of the location, for looking up posts by place.
+    # Set on save, see geo.py.
+    geohash = models.CharField(max_length=geo.PRECISION, default='', blank=True,
+                               db_index=True, editable=False)
+
     # A post has multiple tags.
     # A tag belongs to multiple posts.
     tags = models.ManyToManyField(Tag)
@@ -139,14 +259,59 @@ class Post(models.Model):
     # The user may Like, Dislike or just Do Nothing about the post.
     visits = models.ManyToManyField(User, through='Visit')
 
+    # Denormalized counters of the visits, maintained by
+    # PostManager.update_counters() and the rebuild_counters command.
+    like_count = models.IntegerField(default=0)
+    dislike_count = models.IntegerField(default=0)
+    visit_count = models.IntegerField(default=0)
+
+    # Rank in the hot feed, see ranking.hot_score().
+    score = models.FloatField(default=0)
+
+    objects = PostManager()
+
     def __str__(self):
         # TODO
         return 'Post: {}'.format(self.content)
 
+    def hot_score(self):
+        # create_time is not set until the post is inserted, but the
+        # difference is negligible for ranking.
+        return hot_score(self.like_count - self.dislike_count,
+                         self.create_time or timezone.now())
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.score = self.hot_score()
+
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+
+        super(Post, self).save(*args, **kwargs)
+
 
 # -------------------------------------------------------------------------------
 
 class Photo(models.Model):
+    """
+    The variants of the image (see images.py) are made by the
+    process_photos command, state tells the progress.
+    """
+
+    PENDING = 0
+    PROCESSING = 1
+    READY = 2
+    FAILED = 3
+
+    STATES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
     # A post has multiple photos.
     post = models.ForeignKey(Post, related_name='photos', on_delete=models.CASCADE)
 
@@ -156,6 +321,39 @@ class Photo(models.Model):
     # For ordering: 1, 2, 3, etc.
     order = models.SmallIntegerField(default=0)
 
+    # The pending photos are the queue of the process_photos command.
+    state = models.SmallIntegerField(choices=STATES, default=PENDING, db_index=True)
+
+    # When the processing started, for requeuing photos of crashed workers.
+    claim_time = models.DateTimeField(null=True, blank=True)
+
+    # SHA-256 of the image file. Photos uploaded by chunks with the same
+    # content share the same file, see uploads.py.
+    sha256 = models.CharField(max_length=64, default='', blank=True, db_index=True)
+
+
+# -------------------------------------------------------------------------------
+
+class Upload(models.Model):
+    """
+    A resumable upload of a photo by chunks, see uploads.py.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    user = models.ForeignKey(User, related_name='uploads', on_delete=models.CASCADE)
+
+    # The original file name, for the extension.
+    filename = models.CharField(max_length=255)
+
+    # Total size in bytes.
+    size = models.BigIntegerField()
+
+    # Number of bytes received.
+    offset = models.BigIntegerField(default=0)
+
+    create_time = models.DateTimeField(auto_now_add=True)
+
 
 # -------------------------------------------------------------------------------
 
@@ -164,15 +362,146 @@ class Visit(models.Model):
     See this discussion: https://stackoverflow.com/q/21919422
     """
 
+    class Meta:
+        indexes = [
+            # For keyset pagination, see pagination.py.
+            models.Index(fields=['-timestamp', '-id'], name='luke_visit_timestamp_idx'),
+        ]
+
+        constraints = [
+            # A user visits a post once, the state changes afterwards.
+            # See visits.record_visits().
+            models.UniqueConstraint(fields=['user', 'post'], name='luke_visit_user_post'),
+        ]
+
     STATES = (
         (0, 'None'),
         (1, 'Like'),
         (2, 'Dislike'),
     )
 
+    # How each state counts to the (likes, dislikes) of the post.
+    VOTES = {
+        0: (0, 0),
+        1: (1, 0),
+        2: (0, 1),
+    }
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
 
     timestamp = models.DateTimeField(auto_now_add=True)
 
     state = models.SmallIntegerField(choices=STATES, default=0)
+
+
+# -------------------------------------------------------------------------------
+
+class SeenFilter(models.Model):
+    """
+    Bloom filter of the posts a user has visited, for skipping them in the
+    feed without querying the visits. See visits.get_seen_filter().
+    """
+
+    user = models.OneToOneField(User, primary_key=True, related_name='seen_filter',
+                                on_delete=models.CASCADE)
+
+    # bloom.ScalableBloomFilter.to_bytes(), empty until built.
+    data = models.BinaryField()
+
+    update_time = models.DateTimeField(auto_now=True)
+
+
+# -------------------------------------------------------------------------------
+
+class DiscussionManager(models.Manager):
+
+    def active(self, now=None):
+        """
+        The discussions which had a message within the lifetime.
+        """
+        now = now or timezone.now()
+        return self.filter(last_activity__gt=now - Discussion.LIFETIME)
+
+    def expired(self, now=None):
+        now = now or timezone.now()
+        return self.filter(last_activity__lte=now - Discussion.LIFETIME)
+
+
+class Discussion(models.Model):
+    """
+    A temporary discussion about a place or a topic. It dissolves if nobody
+    says anything for LIFETIME, expired discussions are hidden right away and
+    deleted by the expire_discussions command.
+    """
+
+    class Meta:
+        indexes = [
+            # For listing the active discussions and finding the expired ones.
+            models.Index(fields=['-last_activity', '-id'], name='luke_discussion_activity_idx'),
+        ]
+
+    LIFETIME = timedelta(hours=24)
+
+    # The user who started the discussion.
+    user = models.ForeignKey(User, related_name='discussions', on_delete=models.CASCADE)
+
+    topic = models.CharField(max_length=64)
+
+    # Optional
+    address = models.CharField(max_length=256, default='', blank=True)
+
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    # The time of the last message, or of the creation.
+    last_activity = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = DiscussionManager()
+
+    def __str__(self):
+        return 'Discussion: {}'.format(self.topic)
+
+
+class DiscussionMessage(models.Model):
+
+    class Meta:
+        ordering = ('id',)
+
+    discussion = models.ForeignKey(Discussion, related_name='messages', on_delete=models.CASCADE)
+
+    user = models.ForeignKey(User, related_name='discussion_messages', on_delete=models.CASCADE)
+
+    content = models.CharField(max_length=256)
+
+    create_time = models.DateTimeField(auto_now_add=True)
+
+
+# -------------------------------------------------------------------------------
+
+# Photos and tags are part of the post, update last_update_time of the post
+# when they change.
+# NOTE: Use update() to avoid the post_save signal of the post.
+
+def touch_post_of_photo(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(last_update_time=timezone.now())
+
+
+def touch_post_of_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        Post.objects.filter(pk=instance.pk).update(last_update_time=timezone.now())
+    elif pk_set:
+        Post.objects.filter(pk__in=pk_set).update(last_update_time=timezone.now())
+
+
+post_save.connect(touch_post_of_photo,
+                  sender=Photo,
+                  dispatch_uid="photo-save-touch-post")
+post_delete.connect(touch_post_of_photo,
+                    sender=Photo,
+                    dispatch_uid="photo-delete-touch-post")
+m2m_changed.connect(touch_post_of_tags,
+                    sender=Post.tags.through,
+                    dispatch_uid="post-tags-touch-post")
@@ -0,0 +1,337 @@
+"""
+Keyset (a.k.a. seek or cursor) pagination.
+
+Unlike PageNumberPagination or LimitOffsetPagination, which use OFFSET and
+COUNT(*), a page is located by the ordering values of the last row of the
+previous page, e.g.:
+    WHERE create_time < t OR (create_time = t AND id < i)
+    ORDER BY create_time DESC, id DESC
+    LIMIT 11
+With a composite index on the ordering fields, the cost of a page doesn't
+depend on how deep it is.
+
+DRF's CursorPagination is similar but it only seeks by the first ordering
+field and skips the ties by OFFSET.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Subclasses specify the ordering, which must end with a unique field
+    (normally the primary key) so that the rows are totally ordered.
+    """
+
+    # The ordering fields, prefixed with '-' for descending order.
+    ordering = ('-id',)
+
+    page_size = api_settings.PAGE_SIZE
+
+    # Allow the client to override the page size, e.g., ?page_size=20.
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-'))
+                       for name in self.ordering]
+
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self._reverse_order(name) for name in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(ordering, position))
+
+        # Fetch one more row to know if there is a following page.
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+
+        return self.page_size
+
+    def get_seek_filter(self, ordering, position):
+        """
+        Rows after position in the given ordering:
+            (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        """
+        seek = Q()
+        equal = {}
+
+        for name, value in zip(ordering, position):
+            field = name.lstrip('-')
+            lookup = '__lt' if name.startswith('-') else '__gt'
+            seek |= Q(**equal) & Q(**{field + lookup: value})
+            equal[field] = value
+
+        return seek
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Paged beyond the end, go back to the first page.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        """
+        Return (position, reverse), position is None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = data['p']
+            if len(values) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value)
+                        for field, value in zip(self.fields, values)]
+            # The ordering fields are not null.
+            if any(value is None for value in position):
+                raise ValueError
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, obj, reverse):
+        data = {'p': [field.value_to_string(obj) for field in self.fields]}
+        if reverse:
+            data['r'] = 1
+
+        encoded = urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        parameters = [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {
+                    'type': 'string',
+                },
+            }
+        ]
+        if self.page_size_query_param is not None:
+            parameters.append(
+                {
+                    'name': self.page_size_query_param,
+                    'required': False,
+                    'in': 'query',
+                    'description': 'Number of results to return per page.',
+                    'schema': {
+                        'type': 'integer',
+                    },
+                }
+            )
+        return parameters
+
+    @staticmethod
+    def _reverse_order(name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+
+class PostPagination(KeysetPagination):
+    # Newest first, served by index luke_post_created_idx.
+    ordering = ('-create_time', '-id')
+
+
+class HotPostPagination(KeysetPagination):
+    # Served by index luke_post_score_idx.
+    ordering = ('-score', '-id')
+
+
+class VisitPagination(KeysetPagination):
+    # Served by index luke_visit_timestamp_idx.
+    ordering = ('-timestamp', '-id')
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class DiscussionPagination(KeysetPagination):
+    # Most recently active first, served by index luke_discussion_activity_idx.
+    ordering = ('-last_activity', '-id')
+
+
+class SincePagination(BasePagination):
+    """
+    Incremental pagination for append-only lists, e.g., the messages of a
+    discussion. The client passes the id of the last row it has got:
+        GET /discussions/1/messages/?since=42
+    and gets the rows after it, oldest first. The response tells the since
+    of the next request, and links to it if more rows are already there:
+        {"since": 62, "next": ".../?since=62", "results": [...]}
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    since_query_param = 'since'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+
+        try:
+            self.since = _positive_int(request.query_params.get(self.since_query_param, 0))
+        except ValueError:
+            raise NotFound('Invalid since')
+
+        results = list(queryset.filter(pk__gt=self.since).order_by('pk')[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if results:
+            self.since = results[-1].pk
+        return results
+
+    get_page_size = KeysetPagination.get_page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.since_query_param, self.since)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('since', self.since),
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'since': {
+                    'type': 'integer',
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.since_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The id of the last result already received.',
+                'schema': {
+                    'type': 'integer',
+                },
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {
+                    'type': 'integer',
+                },
+            },
+        ]
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Pages of the ranked search results, see views.PostSearch.
+    Ranked results have no keyset, but they are bounded.
+    """
+
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 100
+
+
+class FeedPagination(SearchPagination):
+    """
+    Pages of the ranked feed, see feed.py.
+    """
@@ -0,0 +1,175 @@
+"""
+In-process publish/subscribe of the latest ids, for long polling.
+
+A channel (e.g., 'posts' or 'discussion:1') carries the id of the latest row.
+Signal handlers publish the ids of new rows once they are committed, the
+long-poll views (see views.py) wait on the channel until the id is beyond the
+client's cursor. Idle polls cost no serialization, and a query per channel
+per recheck_interval whatever their number (see below).
+
+Publishers are threads (WSGI workers, or the threads of sync_to_async),
+waiters are asyncio tasks, possibly of different event loops. Waiters are
+woken by loop.call_soon_threadsafe().
+
+Only rows saved by this process are published, but the rows are mostly
+saved by other processes (e.g., the polls are served by ASGI, the writes by
+uWSGI, see mysite_nginx.conf). So while there are waiters, the latest id of
+the channel is looked up from the database (the id of a row is the version of
+the channel shared by all the processes) every recheck_interval seconds, by
+one of the waiters of this process, which wakes up the others. The latest ids
+are also considered stale after max_age seconds, the views then look them up
+again.
+"""
+
+import asyncio
+import threading
+import time
+
+from django.db import transaction
+
+
+class Hub(object):
+
+    def __init__(self, max_age=30, recheck_interval=1.0):
+        self.max_age = max_age
+        self.recheck_interval = recheck_interval
+
+        self._lock = threading.Lock()
+        # Channel -> (latest id, monotonic time of the lookup).
+        self._latest = {}
+        # Channel -> set of (loop, future).
+        self._waiters = {}
+
+    def latest(self, channel):
+        """
+        Return the latest id of the channel, None if unknown or stale.
+        """
+        with self._lock:
+            latest, lookup_time = self._latest.get(channel, (None, None))
+        if latest is None or time.monotonic() - lookup_time > self.max_age:
+            return None
+        return latest
+
+    def seed(self, channel, latest):
+        """
+        Set the latest id looked up from the database, wake up the waiters
+        if it's new.
+        """
+        self.publish(channel, latest or 0, lookup=True)
+
+    def publish(self, channel, latest, lookup=False):
+        with self._lock:
+            old, lookup_time = self._latest.get(channel, (0, None))
+            if lookup or lookup_time is None:
+                lookup_time = time.monotonic()
+            self._latest[channel] = (max(old, latest), lookup_time)
+
+            if latest <= old:
+                return
+            waiters = self._waiters.pop(channel, ())
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_result, future, latest)
+            except RuntimeError:
+                # The loop is closed.
+                pass
+
+    async def wait(self, channel, since, timeout, lookup=None):
+        """
+        Wait up to timeout seconds for an id greater than since, return the
+        latest id or None on timeout.
+        :param lookup: Coroutine function returning the latest id from the
+            database, called every recheck_interval seconds while waiting.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+
+        with self._lock:
+            latest, _ = self._latest.get(channel, (0, None))
+            if latest > since:
+                return latest
+            self._waiters.setdefault(channel, set()).add(waiter)
+
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                interval = remaining if lookup is None else min(remaining, self.recheck_interval)
+                try:
+                    # Shielded, the future outlives the interval.
+                    return await asyncio.wait_for(asyncio.shield(future), interval)
+                except asyncio.TimeoutError:
+                    pass
+                if lookup is not None and self._claim_lookup(channel):
+                    # Wakes up the waiters, this one included, if it's new.
+                    self.seed(channel, await lookup())
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(channel)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[channel]
+
+    def _claim_lookup(self, channel):
+        """
+        Return whether the caller should look up the channel, i.e., it hasn't
+        been looked up for recheck_interval seconds (by another waiter).
+        """
+        with self._lock:
+            latest, lookup_time = self._latest.get(channel, (0, None))
+            now = time.monotonic()
+            if lookup_time is not None and now - lookup_time < self.recheck_interval:
+                return False
+            self._latest[channel] = (latest, now)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._latest.clear()
+
+
+def _set_result(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+# The hub of this process.
+hub = Hub()
+
+
+def discussion_channel(pk):
+    return 'discussion:{}'.format(pk)
+
+
+################################################################################
+# Signals
+################################################################################
+
+
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        _publish_on_commit('posts', instance.pk)
+
+
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        _publish_on_commit(discussion_channel(instance.discussion_id), instance.pk)
+
+
+def _publish_on_commit(channel, pk):
+    # Otherwise a woken up poll could miss the row which is not committed yet.
+    transaction.on_commit(lambda: hub.publish(channel, pk))
+
+
+def connect_signals():
+    from django.db.models.signals import post_save
+    from .models import Post, DiscussionMessage
+
+    post_save.connect(post_saved, sender=Post, dispatch_uid='luke-pubsub-post-save')
+    post_save.connect(message_saved, sender=DiscussionMessage,
+                      dispatch_uid='luke-pubsub-message-save')
@@ -0,0 +1,40 @@
+"""
+Ranking of posts for the hot feed.
+
+The score is the classic "hot" formula: the order of magnitude of the net
+votes (likes - dislikes) plus the age of the post measured from a fixed epoch.
+Because newer posts always get a bigger time term, older posts sink without
+ever having to recompute their scores - a score only changes when the votes
+of its post change.
+
+See: https://medium.com/hacking-and-gonzo/how-reddit-ranking-algorithms-work-ef111e33d0d9
+"""
+
+import math
+from datetime import datetime, timezone
+
+
+# Posts created after this time get a positive time term.
+EPOCH = datetime(2017, 1, 1, tzinfo=timezone.utc)
+
+# Every 12.5 hours, a post needs 10x net votes to keep the same rank.
+DECAY_SECONDS = 45000
+
+
+def hot_score(votes, create_time):
+    """
+    :param votes: Net votes, i.e., likes - dislikes.
+    :param create_time: An aware datetime.
+    """
+    order = math.log10(max(abs(votes), 1))
+
+    if votes > 0:
+        sign = 1
+    elif votes < 0:
+        sign = -1
+    else:
+        sign = 0
+
+    seconds = (create_time - EPOCH).total_seconds()
+
+    return round(sign * order + seconds / DECAY_SECONDS, 7)
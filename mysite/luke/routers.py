@@ -0,0 +1,88 @@
+"""
+Database router for a primary with a read replica.
+
+Reads made while serving GET and HEAD requests (i.e., the list and detail
+views) go to the 'replica' alias if settings.LUKE_DB_READ_REPLICA is set,
+everything else goes to 'default' (the primary). Reads made while serving other methods stay on the primary, so a
+write request always sees its own writes.
+
+ReplicaReadMiddleware tells the router what request is being served.
+
+NOTE: A replica may lag behind the primary, a client may not see its post in
+the list right after creating it.
+"""
+
+import asyncio
+import contextvars
+
+from django.conf import settings
+
+
+REPLICA = 'replica'
+
+# Whether the reads of the current request can go to the replica.
+# A context variable works for both threads (WSGI) and tasks (ASGI).
+_read_from_replica = contextvars.ContextVar('luke_read_from_replica', default=False)
+
+
+class read_from_replica(object):
+    """
+    Context manager to route the reads in the block to the replica (if
+    there is one).
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def __enter__(self):
+        self.token = _read_from_replica.set(self.enabled)
+
+    def __exit__(self, *exc_info):
+        _read_from_replica.reset(self.token)
+
+
+class ReplicaReadMiddleware(object):
+    """
+    Runs natively under both WSGI and ASGI, so the context variable is set in
+    the context of the view.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    READ_METHODS = ('GET', 'HEAD')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with read_from_replica(request.method in self.READ_METHODS):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with read_from_replica(request.method in self.READ_METHODS):
+            return await self.get_response(request)
+
+
+class PrimaryReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and getattr(settings, 'LUKE_DB_READ_REPLICA', False):
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The same data on both.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated by replication.
+        return db != REPLICA
@@ -0,0 +1,259 @@
+"""
+Full-text search of posts.
+
+The content of posts is mostly Chinese, which has no spaces between words, so
+the text is tokenized here rather than by the database: runs of CJK chars
+are split into single chars and overlapping bigrams, e.g.,
+    '深圳湾公园' -> 深 圳 湾 公 园 深圳 圳湾 湾公 公园
+other words are casefolded. A query is tokenized the same way (bigrams only
+for runs of 2+ CJK chars) and all its tokens must match.
+
+The tokens are stored in a shadow table, kept in sync by the signals of Post
+(connected in LukeConfig.ready()) and rebuilt by the rebuild_search_index
+command (e.g., after bulk updates, which send no signals):
+- SQLite: FTS5 virtual table, ranked by bm25();
+- PostgreSQL: tsvector column with a GIN index, ranked by ts_rank().
+The table is created after migrate. Other databases (or SQLite without FTS5,
+or a database where the table is missing) fall back to content__icontains,
+newest first.
+"""
+
+import re
+
+from django.db import connections, router, transaction, DatabaseError
+
+from .models import Post
+
+
+TABLE = 'luke_post_search'
+
+# Hiragana, Katakana, CJK Unified Ideographs (and Extension A), CJK
+# Compatibility Ideographs, Hangul Syllables.
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+
+WORD_RE = re.compile(r'\w+')
+RUN_RE = re.compile('([{cjk}]+)|([^{cjk}]+)'.format(cjk=CJK))
+
+
+def tokenize(text, query=False):
+    """
+    Return the tokens of the text, in order, possibly repeated.
+    For a query, runs of 2+ CJK chars give only bigrams.
+    """
+    tokens = []
+    for word in WORD_RE.findall(text.casefold()):
+        for cjk, other in RUN_RE.findall(word):
+            if other:
+                tokens.append(other)
+                continue
+            if len(cjk) == 1 or not query:
+                tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+################################################################################
+# Backends
+################################################################################
+
+
+class SqliteBackend(object):
+
+    def create(self, cursor):
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5("
+                       "tokens, tokenize='unicode61 remove_diacritics 0')".format(TABLE))
+
+    def index(self, cursor, rows):
+        cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(TABLE),
+                           [(pk,) for pk, _ in rows])
+        cursor.executemany('INSERT INTO {} (rowid, tokens) VALUES (%s, %s)'.format(TABLE),
+                           [(pk, ' '.join(tokens)) for pk, tokens in rows])
+
+    def remove(self, cursor, pk):
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(TABLE), [pk])
+
+    def clear(self, cursor):
+        cursor.execute('DELETE FROM {}'.format(TABLE))
+
+    def search(self, cursor, tokens, limit):
+        # Quoted as strings, a token can't be taken as an operator.
+        match = ' '.join('"{}"'.format(token.replace('"', '""')) for token in tokens)
+        cursor.execute('SELECT rowid FROM {t} WHERE {t} MATCH %s '
+                       'ORDER BY rank LIMIT %s'.format(t=TABLE), [match, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresBackend(object):
+
+    def create(self, cursor):
+        cursor.execute('CREATE TABLE IF NOT EXISTS {t} ('
+                       'post_id integer PRIMARY KEY REFERENCES {post} (id) '
+                       'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                       'tokens tsvector NOT NULL)'.format(t=TABLE, post=Post._meta.db_table))
+        cursor.execute('CREATE INDEX IF NOT EXISTS {t}_tokens_idx ON {t} '
+                       'USING GIN (tokens)'.format(t=TABLE))
+
+    def index(self, cursor, rows):
+        # array_to_tsvector() takes the tokens as they are, without the
+        # parser of a text search configuration.
+        cursor.executemany('INSERT INTO {} (post_id, tokens) '
+                           'VALUES (%s, array_to_tsvector(%s::text[])) '
+                           'ON CONFLICT (post_id) DO UPDATE SET tokens = EXCLUDED.tokens'.format(TABLE),
+                           [(pk, sorted(set(tokens))) for pk, tokens in rows])
+
+    def remove(self, cursor, pk):
+        # Deleted by the foreign key.
+        pass
+
+    def clear(self, cursor):
+        cursor.execute('DELETE FROM {}'.format(TABLE))
+
+    def search(self, cursor, tokens, limit):
+        # A tsquery literal, the lexemes are quoted and taken as they are.
+        query = ' & '.join("'{}'".format(token.replace('\\', '\\\\').replace("'", "''"))
+                           for token in set(tokens))
+        cursor.execute('SELECT post_id FROM {} WHERE tokens @@ CAST(%s AS tsquery) '
+                       'ORDER BY ts_rank(tokens, CAST(%s AS tsquery)) DESC, post_id DESC '
+                       'LIMIT %s'.format(TABLE),
+                       [query, query, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SqliteBackend(),
+    'postgresql': PostgresBackend(),
+}
+
+
+def has_table(connection):
+    """
+    Whether the shadow table exists, checked once per connection: it's created
+    by migrate, which runs in another process, and may be missing (e.g.,
+    SQLite without FTS5).
+    """
+    connection.ensure_connection()
+    checked = getattr(connection, 'luke_search_table', None)
+    if checked is None or checked[0] is not connection.connection:
+        with connection.cursor() as cursor:
+            exists = TABLE in connection.introspection.table_names(cursor)
+        checked = connection.luke_search_table = (connection.connection, exists)
+    return checked[1]
+
+
+def get_backend(using):
+    connection = connections[using]
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None or not has_table(connection):
+        return None
+    return backend
+
+
+def create_index(using='default'):
+    """
+    Create the shadow table if it doesn't exist, return False if the
+    database doesn't support it.
+    """
+    connection = connections[using]
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        return False
+
+    try:
+        with connection.cursor() as cursor:
+            backend.create(cursor)
+    except DatabaseError:
+        # E.g., "no such module: fts5".
+        return False
+    finally:
+        # Checked again on the next use.
+        connection.luke_search_table = None
+    return has_table(connection)
+
+
+def index_posts(posts, using=None):
+    """
+    Add or replace the tokens of the posts.
+    """
+    using = using or router.db_for_write(Post)
+    backend = get_backend(using)
+    if backend is not None:
+        rows = [(post.pk, tokenize(post.content)) for post in posts]
+        with connections[using].cursor() as cursor:
+            backend.index(cursor, rows)
+
+
+def rebuild_index(batch_size=1000, using=None):
+    """
+    Index all posts from scratch, return the number of posts.
+    """
+    using = using or router.db_for_write(Post)
+    if not create_index(using):
+        return 0
+
+    # Searches see the old index until the new one is complete.
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:
+            get_backend(using).clear(cursor)
+
+        n = 0
+        batch = []
+        for post in Post.objects.using(using).only('content').iterator(chunk_size=batch_size):
+            batch.append(post)
+            if len(batch) >= batch_size:
+                index_posts(batch, using)
+                n += len(batch)
+                batch = []
+        if batch:
+            index_posts(batch, using)
+            n += len(batch)
+    return n
+
+
+def search(q, limit):
+    """
+    Return the ids of up to limit posts matching the query, the best first.
+    """
+    tokens = tokenize(q, query=True)
+    if not tokens:
+        return []
+
+    using = router.db_for_read(Post)
+    backend = get_backend(using)
+    if backend is not None:
+        with connections[using].cursor() as cursor:
+            return backend.search(cursor, tokens, limit)
+
+    return list(Post.objects.filter(content__icontains=q.strip())
+                .order_by('-create_time', '-id')
+                .values_list('pk', flat=True)[:limit])
+
+
+################################################################################
+# Signals
+################################################################################
+
+
+def post_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'content' in update_fields:
+        index_posts([instance], kwargs.get('using'))
+
+
+def post_deleted(sender, instance, using, **kwargs):
+    backend = get_backend(using)
+    if backend is not None:
+        with connections[using].cursor() as cursor:
+            backend.remove(cursor, instance.pk)
+
+
+def luke_migrated(sender, using, **kwargs):
+    create_index(using)
+
+
+def connect_signals():
+    from django.apps import apps
+    from django.db.models.signals import post_save, post_delete, post_migrate
+
+    post_save.connect(post_saved, sender=Post, dispatch_uid='luke-search-post-save')
+    post_delete.connect(post_deleted, sender=Post, dispatch_uid='luke-search-post-delete')
+    post_migrate.connect(luke_migrated, sender=apps.get_app_config('luke'),
+                         dispatch_uid='luke-search-migrate')
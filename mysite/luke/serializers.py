@@ -1,8 +1,50 @@
 from django.contrib.auth.models import User
 
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 
-from .models import Profile, Post, Photo, Tag, Visit
+from . import images, uploads
+from .models import Profile, Post, Photo, Tag, Visit, Upload, normalize_tag_name
+from .models import Discussion, DiscussionMessage
+
+
+# Related objects which can be inlined into a post, e.g., ?expand=photos,tags
+# See PostSerializer.get_fields().
+EXPANDABLE = ('photos', 'tags', 'user', 'user.profile')
+
+
+def get_expand(request):
+    """
+    Parse the expand query parameter of the request into a set.
+    Unknown names are ignored. 'user.profile' implies 'user'.
+    """
+    if request is None:
+        return set()
+
+    names = request.query_params.get('expand', '').split(',')
+    expand = set(name.strip() for name in names) & set(EXPANDABLE)
+    if 'user.profile' in expand:
+        expand.add('user')
+    return expand
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    URLs of the resized variants of an image field, see images.py.
+    E.g.,
+        {"thumb": "http://.../abc.thumb.webp", "feed": ..., "full": ...}
+    """
+
+    def __init__(self, variants, **kwargs):
+        self.variants = variants
+        super(ImageVariantsField, self).__init__(**kwargs)
+
+    def to_representation(self, value):
+        urls = images.variant_urls(value, self.variants)
+        request = self.context.get('request')
+        if request is not None:
+            urls = {name: request.build_absolute_uri(url) for name, url in urls.items()}
+        return urls or None
 
 
 class ProfileSerializer(serializers.ModelSerializer):
@@ -11,11 +53,13 @@ class ProfileSerializer(serializers.ModelSerializer):
     HyperlinkedModelSerializer.
     """
 
+    avatar_variants = ImageVariantsField(images.AVATAR_VARIANTS, source='avatar')
+
     class Meta:
         model = Profile
 
         # TODO: id
-        fields = ('avatar', 'gender', 'birth_date', 'intro', 'city', 'country')
+        fields = ('avatar', 'avatar_variants', 'gender', 'birth_date', 'intro', 'city', 'country')
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -82,13 +126,47 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         return user
 
 
+class TagNameField(serializers.CharField):
+    """
+    Normalize the tag name before it's validated (e.g., for uniqueness).
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_length', Tag._meta.get_field('name').max_length)
+        super(TagNameField, self).__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        return normalize_tag_name(super(TagNameField, self).to_internal_value(data))
+
+
 class TagSerializer(serializers.HyperlinkedModelSerializer):
 
+    name = TagNameField(validators=[UniqueValidator(queryset=Tag.objects.all())])
+
     class Meta:
         model = Tag
         fields = ('url', 'id', 'name')
 
 
+class PostUserSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    The user of an expanded post.
+    Without 'user.profile' in expand, the profile is left out.
+    """
+
+    profile = ProfileSerializer(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('url', 'id', 'username', 'profile')
+
+    def get_fields(self):
+        fields = super(PostUserSerializer, self).get_fields()
+        if 'user.profile' not in get_expand(self.context.get('request')):
+            del fields['profile']
+        return fields
+
+
 class PostSerializer(serializers.HyperlinkedModelSerializer):
 
     # TODO: user = UserSerializer(required=False)
@@ -96,6 +174,12 @@ class PostSerializer(serializers.HyperlinkedModelSerializer):
 
     photos = serializers.HyperlinkedIdentityField(view_name='postphoto-list', read_only=True)
 
+    # Tags are written by names, the missing tags are created.
+    # E.g.,
+    #   $ http -a <name>:<pw> POST :8000/posts/ content="..." tag_names:='["movie", "food"]'
+    tag_names = serializers.ListField(child=TagNameField(), write_only=True,
+                                      required=False, max_length=20)
+
     # TODO
     # Nest tags into post.
     #tags = TagSerializer(many=True, read_only=True)
@@ -107,14 +191,109 @@ class PostSerializer(serializers.HyperlinkedModelSerializer):
 
         fields = ('url', 'id', 'user',
                   'content', 'create_time', 'last_update_time',
-                  'mode', 'address', 'photos', 'tags')
+                  'mode', 'address', 'latitude', 'longitude',
+                  'photos', 'tags', 'tag_names',
+                  'like_count', 'dislike_count', 'visit_count')
+
+        # Counters are maintained by the visit views.
+        # Tags are written by tag_names.
+        read_only_fields = ('tags', 'like_count', 'dislike_count', 'visit_count')
+
+    def validate(self, data):
+        instance = self.instance
+        latitude = data.get('latitude', instance.latitude if instance else None)
+        longitude = data.get('longitude', instance.longitude if instance else None)
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError(
+                'latitude and longitude must be given together.')
+        return data
+
+    def create(self, validated_data):
+        tag_names = validated_data.pop('tag_names', None)
+        post = super(PostSerializer, self).create(validated_data)
+        if tag_names:
+            # The through rows are inserted by a single query.
+            post.tags.add(*Tag.objects.get_or_create_all(tag_names))
+        return post
+
+    def update(self, instance, validated_data):
+        tag_names = validated_data.pop('tag_names', None)
+        post = super(PostSerializer, self).update(instance, validated_data)
+        if tag_names is not None:
+            post.tags.set(Tag.objects.get_or_create_all(tag_names))
+        return post
+
+    def get_fields(self):
+        """
+        Replace the links to related objects with nested representations
+        if they are expanded. The view should prefetch them, see
+        views.PostExpandMixin.
+        """
+        fields = super(PostSerializer, self).get_fields()
+
+        expand = get_expand(self.context.get('request'))
+        if 'photos' in expand:
+            fields['photos'] = PhotoSerializer(many=True, read_only=True)
+        if 'tags' in expand:
+            fields['tags'] = TagSerializer(many=True, read_only=True)
+        if 'user' in expand:
+            fields['user'] = PostUserSerializer(read_only=True)
+
+        return fields
 
 
 class PhotoSerializer(serializers.HyperlinkedModelSerializer):
+
+    # Prefer the variants to the original image, which may be large.
+    # None until the photo is processed.
+    variants = ImageVariantsField(images.PHOTO_VARIANTS, source='image')
+
+    state = serializers.CharField(source='get_state_display', read_only=True)
+
     class Meta:
         model = Photo
 
-        fields = ('url', 'id', 'image', 'order')
+        fields = ('url', 'id', 'post', 'image', 'variants', 'state', 'order')
+
+    def to_representation(self, instance):
+        data = super(PhotoSerializer, self).to_representation(instance)
+        if instance.state != Photo.READY:
+            data['variants'] = None
+        return data
+
+    def validate_post(self, post):
+        if post.user != self.context['request'].user:
+            raise serializers.ValidationError('Photos can only be added to your own posts.')
+        return post
+
+
+class UploadSerializer(serializers.HyperlinkedModelSerializer):
+
+    size = serializers.IntegerField(min_value=1, max_value=uploads.MAX_SIZE)
+
+    class Meta:
+        model = Upload
+
+        fields = ('url', 'id', 'filename', 'size', 'offset', 'create_time')
+        read_only_fields = ('offset',)
+
+
+class UploadCompleteSerializer(serializers.Serializer):
+    """
+    Input of UploadComplete.
+    """
+
+    post = serializers.HyperlinkedRelatedField(view_name='post-detail',
+                                               queryset=Post.objects.all())
+    order = serializers.IntegerField(default=0)
+
+    def get_fields(self):
+        """
+        Only the posts of the user.
+        """
+        fields = super(UploadCompleteSerializer, self).get_fields()
+        fields['post'].queryset = Post.objects.filter(user=self.context['request'].user)
+        return fields
 
 
 class VisitSerializer(serializers.HyperlinkedModelSerializer):
@@ -124,4 +303,50 @@ class VisitSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Visit
 
-        fields = ('url', 'id', 'user', 'timestamp', 'state')
+        fields = ('url', 'id', 'user', 'post', 'timestamp', 'state')
+
+    def get_fields(self):
+        """
+        The post of a visit can't be changed, the counters of the posts are
+        updated by the state only (see views.VisitDetail).
+        """
+        fields = super(VisitSerializer, self).get_fields()
+        if self.instance is not None:
+            fields['post'] = serializers.HyperlinkedRelatedField(
+                view_name='post-detail', read_only=True)
+        return fields
+
+
+class VisitBatchItemSerializer(serializers.Serializer):
+    """
+    An entry of VisitBatch, the post is given by id.
+    """
+
+    post = serializers.IntegerField(min_value=1)
+    state = serializers.ChoiceField(choices=Visit.STATES, default=0)
+
+
+class DiscussionSerializer(serializers.HyperlinkedModelSerializer):
+
+    user = serializers.ReadOnlyField(source='user.username')
+
+    messages = serializers.HyperlinkedIdentityField(view_name='discussionmessage-list')
+
+    class Meta:
+        model = Discussion
+
+        fields = ('url', 'id', 'user', 'topic', 'address',
+                  'create_time', 'last_activity', 'messages')
+
+
+class DiscussionMessageSerializer(serializers.ModelSerializer):
+    """
+    Messages are only listed under their discussion, no URL.
+    """
+
+    user = serializers.ReadOnlyField(source='user.username')
+
+    class Meta:
+        model = DiscussionMessage
+
+        fields = ('id', 'user', 'content', 'create_time')
@@ -0,0 +1,67 @@
+"""
+Pragmas for running on SQLite with concurrent requests.
+
+By default SQLite uses a rollback journal, a writer locks out all readers
+while committing, and a reader waiting for the lock fails with "database is
+locked". In WAL mode readers never block a writer nor a writer readers,
+only writers wait for each other (up to the busy timeout).
+
+Opt in with the setting LUKE_SQLITE_TUNING = True, the pragmas are applied to
+every new connection by the connection_created signal (connected in
+LukeConfig.ready()).
+
+See: https://www.sqlite.org/wal.html
+"""
+
+from django.conf import settings
+
+
+# Applied in order, journal_mode is persistent in the database file, the
+# others are per connection.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    # Safe in WAL mode, a commit may only be lost on power failure.
+    ('synchronous', 'NORMAL'),
+    # Milliseconds to wait for a lock before failing.
+    ('busy_timeout', 5000),
+    ('mmap_size', 256 * 1024 * 1024),
+    # Negative for KiB rather than pages, i.e., 64 MiB.
+    ('cache_size', -64 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+
+def apply_pragmas(cursor, pragmas=PRAGMAS):
+    """
+    Apply the pragmas with a DB-API cursor of a SQLite connection.
+    """
+    for name, value in pragmas:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_enabled():
+    return getattr(settings, 'LUKE_SQLITE_TUNING', False)
+
+
+################################################################################
+# Signals
+################################################################################
+
+
+def connection_created(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not is_enabled():
+        return
+
+    # NOTE: Use the raw connection, a Django cursor would be logged (and
+    # counted by assertNumQueries).
+    cursor = connection.connection.cursor()
+    try:
+        apply_pragmas(cursor)
+    finally:
+        cursor.close()
+
+
+def connect_signals():
+    from django.db.backends.signals import connection_created as signal
+
+    signal.connect(connection_created, dispatch_uid='luke-sqlite-connection-created')
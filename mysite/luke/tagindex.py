@@ -0,0 +1,214 @@
+"""
+In-memory prefix index of tags for autocompletion.
+
+Each worker process holds a sorted array of the normalized tag names, a
+prefix is looked up by binary search and the matches are ranked by how many
+posts use the tags. No query is made to answer a completion.
+
+The index is built on first use, kept up to date by the signals of Tag, Post
+and Post.tags (connected in LukeConfig.ready()) once the changes are
+committed, and rebuilt after max_age seconds to pick up the changes made by
+other processes.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+
+from . import models
+from .models import Post, Tag, normalize_tag_name as normalize
+
+
+class TagPrefixIndex(object):
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+
+        self._lock = threading.RLock()
+        self._built_time = None
+
+        # Sorted (normalized name, tag id).
+        self._keys = []
+        # Tag id -> name.
+        self._names = {}
+        # Tag id -> number of posts.
+        self._counts = {}
+
+    def build(self):
+        rows = Tag.objects.annotate(n=Count('post')).values_list('id', 'name', 'n')
+
+        keys = []
+        names = {}
+        counts = {}
+        for tag_id, name, n in rows:
+            keys.append((normalize(name), tag_id))
+            names[tag_id] = name
+            counts[tag_id] = n
+        keys.sort()
+
+        with self._lock:
+            self._keys, self._names, self._counts = keys, names, counts
+            self._built_time = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._built_time = None
+
+    @property
+    def is_built(self):
+        return self._built_time is not None
+
+    def ensure_built(self):
+        built_time = self._built_time
+        if built_time is None or time.monotonic() - built_time > self.max_age:
+            self.build()
+
+    def complete(self, prefix, limit=10):
+        """
+        Return up to limit (tag id, name, count) whose names start with the
+        prefix, the most used first.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        self.ensure_built()
+
+        with self._lock:
+            lo = bisect_left(self._keys, (prefix,))
+            hi = bisect_left(self._keys, (prefix + '\U0010ffff',), lo)
+            counts = self._counts
+            matches = heapq.nsmallest(limit, self._keys[lo:hi],
+                                      key=lambda key: (-counts[key[1]], key[0]))
+            return [(tag_id, self._names[tag_id], counts[tag_id])
+                    for _, tag_id in matches]
+
+    def add(self, tag_id, name):
+        with self._lock:
+            if self._built_time is None:
+                return
+            self.remove(tag_id)
+            insort(self._keys, (normalize(name), tag_id))
+            self._names[tag_id] = name
+            self._counts.setdefault(tag_id, 0)
+
+    def remove(self, tag_id):
+        with self._lock:
+            name = self._names.pop(tag_id, None)
+            if name is None:
+                return
+            key = (normalize(name), tag_id)
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+            self._counts.pop(tag_id, None)
+
+    def count(self, tag_ids, delta):
+        """
+        Return the ids of the tags not in the index (e.g., tags created by
+        other processes), if the index is built.
+        """
+        missing = []
+        with self._lock:
+            for tag_id in tag_ids:
+                if tag_id in self._counts:
+                    self._counts[tag_id] = max(self._counts[tag_id] + delta, 0)
+                else:
+                    missing.append(tag_id)
+            return missing if self._built_time is not None else []
+
+
+# The index of this process.
+tag_index = TagPrefixIndex()
+
+
+################################################################################
+# Signals
+################################################################################
+
+
+# NOTE: The index is updated once the transaction commits, a rolled back
+# change never reaches it. The queries for the changes are made before.
+
+
+def _on_commit(func, *args, using=None):
+    transaction.on_commit(lambda: func(*args), using=using)
+
+
+def tag_saved(sender, instance, using, **kwargs):
+    _on_commit(tag_index.add, instance.pk, instance.name, using=using)
+
+
+def tag_deleted(sender, instance, using, **kwargs):
+    _on_commit(tag_index.remove, instance.pk, using=using)
+
+
+def tags_created(sender, tags, using, **kwargs):
+    for tag in tags:
+        _on_commit(tag_index.add, tag.pk, tag.name, using=using)
+
+
+def post_deleting(sender, instance, using, **kwargs):
+    # The relations are deleted by cascade, without m2m_changed.
+    if tag_index.is_built:
+        instance._tag_index_deleted = list(
+            Post.tags.through.objects.using(using)
+            .filter(post_id=instance.pk).values_list('tag_id', flat=True))
+
+
+def post_deleted(sender, instance, using, **kwargs):
+    tag_ids = getattr(instance, '_tag_index_deleted', None)
+    if tag_ids:
+        _on_commit(tag_index.count, tag_ids, -1, using=using)
+
+
+def _count_added(tag_ids):
+    missing = tag_index.count(tag_ids, 1)
+    if missing:
+        # E.g., tags created by another process.
+        for tag_id, name in Tag.objects.filter(pk__in=missing).values_list('id', 'name'):
+            tag_index.add(tag_id, name)
+        tag_index.count(missing, 1)
+
+
+def post_tags_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """
+    Count the posts of the tags.
+    """
+    if action == 'pre_clear':
+        # pk_set is None for clear, remember the tags before they are gone.
+        if not tag_index.is_built:
+            instance._tag_index_cleared = {}
+        elif reverse:
+            instance._tag_index_cleared = {instance.pk: instance.post_set.count()}
+        else:
+            instance._tag_index_cleared = dict.fromkeys(
+                instance.tags.values_list('pk', flat=True), 1)
+    elif action == 'post_clear':
+        for tag_id, n in getattr(instance, '_tag_index_cleared', {}).items():
+            _on_commit(tag_index.count, [tag_id], -n, using=using)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        delta = 1 if action == 'post_add' else -1
+        if reverse:
+            # Posts added to or removed from a tag.
+            _on_commit(tag_index.count, [instance.pk], delta * len(pk_set), using=using)
+        elif delta > 0:
+            _on_commit(_count_added, list(pk_set), using=using)
+        else:
+            _on_commit(tag_index.count, list(pk_set), -1, using=using)
+
+
+def connect_signals():
+    post_save.connect(tag_saved, sender=Tag, dispatch_uid='luke-tagindex-tag-save')
+    post_delete.connect(tag_deleted, sender=Tag, dispatch_uid='luke-tagindex-tag-delete')
+    models.tags_created.connect(tags_created, sender=Tag,
+                                dispatch_uid='luke-tagindex-tags-created')
+    m2m_changed.connect(post_tags_changed, sender=Post.tags.through,
+                        dispatch_uid='luke-tagindex-post-tags')
+    pre_delete.connect(post_deleting, sender=Post, dispatch_uid='luke-tagindex-post-pre-delete')
+    post_delete.connect(post_deleted, sender=Post, dispatch_uid='luke-tagindex-post-delete')
@@ -1,3 +1,1735 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from base64 import b64encode, urlsafe_b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction, OperationalError
+from django.db.backends.signals import connection_created
+from asgiref.sync import async_to_sync
+
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+
+from PIL import Image
+
+from . import asyncviews, authentication, dbhealth, feed, geo, images, jobs, search, uploads, views
+from .models import Profile, Post, Photo, Tag, Upload, Visit, Discussion, DiscussionMessage
+from .models import SeenFilter
+from .bloom import ScalableBloomFilter
+from .visits import get_seen_filter
+from .ranking import EPOCH, DECAY_SECONDS, hot_score
+from .routers import PrimaryReplicaRouter, ReplicaReadMiddleware, read_from_replica
+from .tagindex import tag_index
+from .throttling import TokenBucketThrottle
+from .authentication import ExpiringTokenAuthentication
+from .pubsub import Hub, hub
+from . import visitbuffer
+from .visitbuffer import VisitBuffer, get_visit_buffer
+
+
+class QueryCountMixin(object):
+    """
+    Helper to catch N+1 queries in list views.
+    """
+
+    def assertConstantQueries(self, url, create_rows, sizes=(1, 5)):
+        """
+        Fail if the number of queries to GET url grows with the number of
+        rows.
+        :param create_rows: Called with n to create n more rows for url.
+        """
+        counts = []
+        created = 0
+        for size in sizes:
+            create_rows(size - created)
+            created = size
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+
+        self.assertEqual(len(set(counts)), 1,
+                         'Query count grows with rows: {}'.format(
+                             dict(zip(sizes, counts))))
+
+
+class HotScoreTests(TestCase):
+
+    def test_votes_order_of_magnitude(self):
+        t = EPOCH
+        self.assertEqual(hot_score(0, t), 0)
+        self.assertEqual(hot_score(1, t), 0)
+        self.assertEqual(hot_score(10, t), 1)
+        self.assertEqual(hot_score(-100, t), -2)
+
+    def test_time_decay(self):
+        # A newer post needs fewer votes to rank as high as an older one.
+        old = hot_score(10, EPOCH)
+        new = hot_score(1, EPOCH + timedelta(seconds=DECAY_SECONDS))
+        self.assertEqual(old, new)
+
+
+class PostHotListTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, content):
+        return Post.objects.create(user=self.user, content=content)
+
+    def visit(self, post, state):
+        response = self.client.post('/visits/', {
+            'post': 'http://testserver/posts/{}/'.format(post.pk),
+            'state': state,
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def test_votes_follow_visits(self):
+        post = self.create_post('a')
+
+        visit_id = self.visit(post, 1)
+        self.assertCounters(post, 1, 0, 1)
+
+        self.client.patch('/visits/{}/'.format(visit_id), {'state': 2})
+        self.assertCounters(post, 0, 1, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.score, hot_score(-1, post.create_time))
+
+        self.client.delete('/visits/{}/'.format(visit_id))
+        self.assertCounters(post, 0, 0, 0)
+
+    def test_post_of_visit_is_read_only(self):
+        post, other = self.create_post('a'), self.create_post('b')
+        visit_id = self.visit(post, 1)
+
+        response = self.client.patch('/visits/{}/'.format(visit_id), {
+            'post': 'http://testserver/posts/{}/'.format(other.pk), 'state': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Visit.objects.get(pk=visit_id).post_id, post.pk)
+        self.assertCounters(post, 0, 1, 1)
+        self.assertCounters(other, 0, 0, 0)
+
+    def assertCounters(self, post, likes, dislikes, visits):
+        response = self.client.get('/posts/{}/'.format(post.pk))
+        self.assertEqual((response.data['like_count'],
+                          response.data['dislike_count'],
+                          response.data['visit_count']),
+                         (likes, dislikes, visits))
+
+    def test_rebuild_counters(self):
+        post = self.create_post('a')
+        for i, state in enumerate([0, 1, 1, 2]):
+            user = User.objects.create_user('user{}'.format(i))
+            Visit.objects.create(user=user, post=post, state=state)
+
+        call_command('rebuild_counters', stdout=StringIO())
+
+        self.assertCounters(post, 2, 1, 4)
+        post.refresh_from_db()
+        self.assertEqual(post.score, hot_score(1, post.create_time))
+
+    def test_hot_order(self):
+        liked = self.create_post('liked')
+        normal = self.create_post('normal')
+        disliked = self.create_post('disliked')
+
+        for i in range(10):
+            user = User.objects.create_user('user{}'.format(i))
+            Visit.objects.create(user=user, post=liked, state=1)
+            Visit.objects.create(user=user, post=disliked, state=2)
+        Post.objects.update_counters(liked.pk, likes=10, visits=10)
+        Post.objects.update_counters(disliked.pk, dislikes=10, visits=10)
+
+        response = self.client.get('/posts/hot/')
+        self.assertEqual([p['id'] for p in response.data['results']],
+                         [liked.pk, normal.pk, disliked.pk])
+
+
+class QueryCountTests(QueryCountMixin, APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='123456')
+        self.client.force_authenticate(self.admin)
+        self.tags = [Tag.objects.create(name=name) for name in ('a', 'b')]
+        self.post = Post.objects.create(user=self.admin, content='post')
+
+    def create_posts(self, n):
+        for i in range(n):
+            user = User.objects.create_user('user{}'.format(User.objects.count()))
+            Profile.objects.create(user=user)
+            post = Post.objects.create(user=user, content=str(i))
+            post.tags.set(self.tags)
+            Photo.objects.create(post=post, image='post_photos/{}.jpg'.format(i))
+
+    def create_visits(self, n):
+        for i in range(n):
+            user = User.objects.create_user('user{}'.format(User.objects.count()))
+            Visit.objects.create(user=user, post=self.post)
+
+    def create_users(self, n):
+        for i in range(n):
+            user = User.objects.create_user('user{}'.format(User.objects.count()))
+            Profile.objects.create(user=user)
+
+    def test_post_list(self):
+        self.assertConstantQueries('/posts/', self.create_posts)
+
+    def test_hot_post_list(self):
+        self.assertConstantQueries('/posts/hot/', self.create_posts)
+
+    def test_expanded_post_list(self):
+        self.assertConstantQueries('/posts/?expand=photos,tags,user.profile',
+                                   self.create_posts)
+
+    def test_visit_list(self):
+        self.assertConstantQueries('/visits/', self.create_visits)
+
+    def test_user_list(self):
+        self.assertConstantQueries('/users/', self.create_users)
+
+
+class PostExpandTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        Profile.objects.create(user=self.user, city='Shanghai')
+        self.post = Post.objects.create(user=self.user, content='post')
+        self.post.tags.add(Tag.objects.create(name='a'))
+        Photo.objects.create(post=self.post, image='post_photos/2.jpg', order=2)
+        Photo.objects.create(post=self.post, image='post_photos/1.jpg', order=1)
+
+    def test_links_by_default(self):
+        response = self.client.get('/posts/{}/'.format(self.post.pk))
+        self.assertEqual(response.data['user'], 'adam')
+        self.assertEqual(response.data['photos'],
+                         'http://testserver/posts/{}/photos/'.format(self.post.pk))
+
+    def test_expand(self):
+        response = self.client.get('/posts/{}/?expand=photos,tags,user.profile'
+                                   .format(self.post.pk))
+        data = response.data
+        self.assertEqual([p['order'] for p in data['photos']], [1, 2])
+        self.assertEqual([t['name'] for t in data['tags']], ['a'])
+        self.assertEqual(data['user']['username'], 'adam')
+        self.assertEqual(data['user']['profile']['city'], 'Shanghai')
+
+    def test_expand_user_only(self):
+        response = self.client.get('/posts/{}/?expand=user'.format(self.post.pk))
+        self.assertNotIn('profile', response.data['user'])
+
+
+class KeysetPaginationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+
+        # All in the same create_time so that the ties are broken by id.
+        now = timezone.now()
+        posts = [Post(user=self.user, content=str(i)) for i in range(25)]
+        Post.objects.bulk_create(posts)
+        Post.objects.update(create_time=now)
+        Post.objects.filter(pk__in=[p.pk for p in Post.objects.all()[:5]]).update(
+            create_time=now - timedelta(days=1))
+        self.expected = list(Post.objects.order_by('-create_time', '-id')
+                             .values_list('id', flat=True))
+
+    def test_forward_and_backward(self):
+        pages = []
+        url = '/posts/'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([p['id'] for p in response.data['results']])
+            last = response.data
+            url = response.data['next']
+
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        # Go back from the last page.
+        response = self.client.get(last['previous'])
+        self.assertEqual([p['id'] for p in response.data['results']], pages[1])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([p['id'] for p in response.data['results']], pages[0])
+        self.assertIsNone(response.data['previous'])
+
+    def test_no_count(self):
+        response = self.client.get('/posts/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/posts/?cursor=xyz')
+        self.assertEqual(response.status_code, 404)
+
+        cursor = urlsafe_b64encode(b'{"p": [null, null]}').decode('ascii')
+        for url in ('/posts/', '/posts/hot/', '/visits/'):
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.post = Post.objects.create(user=self.user, content='post')
+        self.url = '/posts/{}/'.format(self.post.pk)
+
+    def get(self, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_anonymous_hit(self):
+        response, n = self.get(self.url)
+        self.assertGreater(n, 0)
+
+        cached, n = self.get(self.url)
+        self.assertEqual(n, 0)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+
+    def test_key_covers_format_and_accept(self):
+        self.get(self.url)
+        self.assertGreater(self.get(self.url + '?format=json')[1], 0)
+        self.assertGreater(self.get(self.url[:-1] + '.json')[1], 0)
+        self.assertGreater(self.get(self.url, HTTP_ACCEPT='text/html')[1], 0)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'example.com'])
+    def test_key_covers_host_and_scheme(self):
+        self.get(self.url)
+        response, n = self.get(self.url, HTTP_HOST='example.com')
+        self.assertGreater(n, 0)
+        self.assertTrue(response.data['url'].startswith('http://example.com/'))
+        response, n = self.get(self.url, secure=True)
+        self.assertGreater(n, 0)
+        self.assertTrue(response.data['url'].startswith('https://testserver/'))
+
+    def test_authenticated_not_cached(self):
+        self.get(self.url)
+        self.client.force_authenticate(self.user)
+        self.assertGreater(self.get(self.url)[1], 0)
+
+    def test_invalidation(self):
+        other = Post.objects.create(user=self.user, content='other')
+        other_url = '/posts/{}/'.format(other.pk)
+        self.get(self.url)
+        self.get(other_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Visit.objects.create(user=self.user, post=self.post, state=1)
+
+        self.assertGreater(self.get(self.url)[1], 0)
+        self.assertEqual(self.get(other_url)[1], 0)
+
+    def test_tag_invalidation(self):
+        tag = Tag.objects.create(name='a')
+        self.get('/tags/')
+        self.get('/posts/{}/?expand=tags'.format(self.post.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.tags.add(tag)
+        response, n = self.get('/posts/{}/?expand=tags'.format(self.post.pk))
+        self.assertEqual([t['name'] for t in response.data['tags']], ['a'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='b')
+        response, n = self.get('/tags/')
+        self.assertGreater(n, 0)
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(user=self.user, content='post')
+        self.url = '/posts/{}/'.format(self.post.pk)
+
+    def assertNotModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_detail(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertNotModified(self.url, etag)
+
+        # Counters change the ETag, but not last_update_time.
+        Post.objects.update_counters(self.post.pk, likes=1, visits=1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like_count'], 1)
+
+    def test_last_update_time(self):
+        old = self.post.last_update_time
+        self.client.patch(self.url, {'content': 'edited'})
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.last_update_time, old)
+
+        old = self.post.last_update_time
+        self.post.tags.add(Tag.objects.create(name='a'))
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.last_update_time, old)
+
+    def test_list(self):
+        response = self.client.get('/posts/')
+        etag = response['ETag']
+        self.assertNotModified('/posts/', etag)
+
+        Post.objects.create(user=self.user, content='new')
+        self.assertEqual(self.client.get('/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cached_response(self):
+        self.client.force_authenticate(None)
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertNotModified(self.url, etag)
+        self.assertEqual(len(queries), 0)
+
+
+class TagCompleteTests(APITestCase):
+
+    def setUp(self):
+        tag_index.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.tags = {name: Tag.objects.create(name=name)
+                     for name in ('shanghai', 'shenzhen', 'shop', 'beijing')}
+        for names in (['shop'], ['shop', 'shenzhen'], ['shop']):
+            post = Post.objects.create(user=self.user, content='post')
+            post.tags.set([self.tags[name] for name in names])
+
+    def complete(self, q, **params):
+        response = self.client.get('/tags/complete/', dict(q=q, **params))
+        self.assertEqual(response.status_code, 200)
+        return [(t['name'], t['post_count']) for t in response.data]
+
+    def test_rank_by_posts(self):
+        self.assertEqual(self.complete('sh'),
+                         [('shop', 3), ('shenzhen', 1), ('shanghai', 0)])
+        self.assertEqual(self.complete('SH', limit=1), [('shop', 3)])
+        self.assertEqual(self.complete('x'), [])
+        self.assertEqual(self.complete(''), [])
+
+    def test_no_queries(self):
+        self.complete('sh')
+        with self.assertNumQueries(0):
+            self.complete('sh')
+
+    def test_signals(self):
+        self.complete('sh')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='shenyang')
+            self.tags['shanghai'].post_set.add(*Post.objects.all())
+            self.tags['shop'].delete()
+        self.assertEqual(self.complete('sh'),
+                         [('shanghai', 3), ('shenzhen', 1), ('shenyang', 0)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tags['shenzhen'].post_set.get().delete()
+        self.assertEqual(self.complete('sh'),
+                         [('shanghai', 2), ('shenyang', 0), ('shenzhen', 0)])
+
+    def test_rollback(self):
+        self.complete('sh')
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    Tag.objects.create(name='shenyang')
+                    self.tags['shanghai'].post_set.add(*Post.objects.all())
+                    raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.complete('sh'),
+                         [('shop', 3), ('shenzhen', 1), ('shanghai', 0)])
+
+
+class TagNameTests(APITestCase):
+
+    def setUp(self):
+        tag_index.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, tag_names):
+        response = self.client.post('/posts/', {'content': 'post', 'tag_names': tag_names},
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Post.objects.get(pk=response.data['id'])
+
+    def test_normalized_and_unique(self):
+        Tag.objects.create(name=' Shanghai')
+        self.assertEqual(Tag.objects.get().name, 'shanghai')
+
+        response = self.client.post('/tags/', {'name': 'SHANGHAI'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_with_names(self):
+        Tag.objects.create(name='food')
+        post = self.create_post(['Food', 'movie', 'MOVIE'])
+        self.assertEqual(sorted(t.name for t in post.tags.all()), ['food', 'movie'])
+        self.assertEqual(Tag.objects.count(), 2)
+
+        response = self.client.patch('/posts/{}/'.format(post.pk), {'tag_names': ['travel']},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t.name for t in post.tags.all()], ['travel'])
+
+    def test_cached_tag_list(self):
+        cache.clear()
+        self.create_post(['food'])
+        self.client.force_authenticate(None)
+        self.assertEqual([t['name'] for t in self.client.get('/tags/').json()], ['food'])
+
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_post(['food', 'movie'])
+
+        self.client.force_authenticate(None)
+        names = [t['name'] for t in self.client.get('/tags/').json()]
+        self.assertEqual(sorted(names), ['food', 'movie'])
+        self.assertEqual(tag_index.complete('mo')[0][1], 'movie')
+
+    def test_constant_queries(self):
+        # Build the index so that its signal handlers are counted too.
+        tag_index.build()
+
+        counts = []
+        for n in (1, 5):
+            names = ['tag{}-{}'.format(n, i) for i in range(n)]
+            with self.captureOnCommitCallbacks(execute=True):
+                with CaptureQueriesContext(connection) as queries:
+                    self.create_post(names)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+        self.assertEqual(tag_index.complete('tag5'), [
+            (Tag.objects.get(name=name).pk, name, 1)
+            for name in ['tag5-{}'.format(i) for i in range(5)]])
+
+
+class GeoTests(TestCase):
+
+    def test_encode(self):
+        # From https://en.wikipedia.org/wiki/Geohash
+        self.assertEqual(geo.encode(42.6, -5.6, 5), 'ezs42')
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_haversine(self):
+        # Shanghai to Beijing, about 1068 km.
+        d = geo.haversine(31.2304, 121.4737, 39.9042, 116.4074)
+        self.assertAlmostEqual(d / 1000, 1068, delta=5)
+
+    def test_neighbors_cover_radius(self):
+        lat, lng, radius = 31.2304, 121.4737, 800
+        cells = geo.neighbors(lat, lng, geo.precision_for(radius, lat))
+        self.assertEqual(len(cells), 9)
+        # Points on the circle are in one of the cells.
+        for bearing in range(0, 360, 15):
+            dlat = radius * math.cos(math.radians(bearing)) / geo.METERS_PER_DEGREE
+            dlng = (radius * math.sin(math.radians(bearing))
+                    / (geo.METERS_PER_DEGREE * math.cos(math.radians(lat))))
+            code = geo.encode(lat + dlat, lng + dlng)
+            self.assertTrue(any(code.startswith(cell) for cell in cells))
+
+
+class PostNearbyTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, content, lat, lng):
+        response = self.client.post('/posts/', {'content': content,
+                                                'latitude': lat, 'longitude': lng})
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_nearby(self):
+        # People's Square, Shanghai.
+        lat, lng = 31.2304, 121.4737
+        self.create_post('here', lat, lng)
+        self.create_post('300m', lat + 0.0027, lng)
+        self.create_post('2km', lat, lng + 0.021)
+        self.create_post('beijing', 39.9042, 116.4074)
+        Post.objects.create(user=self.user, content='nowhere')
+
+        response = self.client.get('/posts/nearby/', {'lat': lat, 'lng': lng, 'radius': 500})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['content'] for p in response.data], ['here', '300m'])
+        self.assertAlmostEqual(response.data[1]['distance'], 300, delta=5)
+
+        response = self.client.get('/posts/nearby/', {'lat': lat, 'lng': lng, 'radius': 5000})
+        self.assertEqual([p['content'] for p in response.data], ['here', '300m', '2km'])
+
+    def test_validation(self):
+        response = self.client.post('/posts/', {'content': 'x', 'latitude': 10})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/posts/nearby/', {'lat': 91, 'lng': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+def make_image(width=2000, height=1500, name='test.jpg'):
+    output = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(output, 'JPEG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+
+class ImageVariantsTests(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(user=self.user, content='post')
+
+    def upload_photo(self):
+        response = self.client.post('/photos/', {
+            'post': 'http://testserver/posts/{}/'.format(self.post.pk),
+            'image': make_image(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def test_photo_variants(self):
+        response = self.upload_photo()
+        self.assertEqual(response.data['state'], 'Pending')
+        self.assertIsNone(response.data['variants'])
+
+        call_command('process_photos', '--once', stdout=StringIO())
+
+        photo = Photo.objects.get(pk=response.data['id'])
+        self.assertEqual(photo.state, Photo.READY)
+        response = self.client.get('/photos/{}/'.format(photo.pk))
+
+        sizes = {}
+        for variant, url in response.data['variants'].items():
+            self.assertTrue(url.startswith('http://testserver/media/post_photos/'))
+            with Image.open(default_storage.open(images.variant_name(photo.image.name, variant))) as image:
+                sizes[variant] = image.size
+        self.assertEqual(sizes, {'thumb': (240, 240), 'feed': (720, 540), 'full': (1600, 1200)})
+
+    def test_cached_photo_list(self):
+        cache.clear()
+        photo_id = self.upload_photo().data['id']
+        self.client.force_authenticate(None)
+
+        url = '/posts/{}/photos/'.format(self.post.pk)
+        detail_url = '/posts/{}/?expand=photos'.format(self.post.pk)
+        self.assertEqual(self.client.get(url).json()[0]['state'], 'Pending')
+        response = self.client.get(detail_url)
+        self.assertEqual(response.json()['photos'][0]['state'], 'Pending')
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.process_photo(Photo.objects.get(pk=photo_id))
+
+        photo = self.client.get(url).json()[0]
+        self.assertEqual(photo['state'], 'Ready')
+        self.assertIsNotNone(photo['variants'])
+
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['photos'][0]['state'], 'Ready')
+
+    def test_photo_of_other_post(self):
+        other = Post.objects.create(user=User.objects.create_user('eve'), content='post')
+        response = self.client.post('/photos/', {
+            'post': 'http://testserver/posts/{}/'.format(other.pk),
+            'image': make_image(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('post', response.data)
+        self.assertFalse(Photo.objects.exists())
+
+    def test_failed_and_stale(self):
+        response = self.upload_photo()
+        photo = Photo.objects.get(pk=response.data['id'])
+        default_storage.delete(photo.image.name)
+
+        stale = Photo.objects.create(post=self.post, image=photo.image.name,
+                                     state=Photo.PROCESSING,
+                                     claim_time=timezone.now() - timedelta(hours=1))
+
+        with self.assertLogs('luke', 'ERROR'):
+            call_command('process_photos', '--once', stdout=StringIO())
+
+        self.assertEqual(Photo.objects.get(pk=photo.pk).state, Photo.FAILED)
+        self.assertEqual(Photo.objects.get(pk=stale.pk).state, Photo.FAILED)
+
+    def test_avatar_variants(self):
+        profile = Profile.objects.create(user=self.user, avatar=make_image(name='me.jpg'))
+        self.assertTrue(images.has_variants(profile.avatar, images.AVATAR_VARIANTS))
+
+        response = self.client.get('/users/{}/'.format(self.user.pk))
+        self.assertEqual(set(response.data['profile']['avatar_variants']), {'thumb', 'full'})
+
+
+class ChunkedUploadTests(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(user=self.user, content='post')
+        self.content = make_image().read()
+
+    def put_chunk(self, upload_id, offset, chunk):
+        return self.client.put('/uploads/{}/'.format(upload_id), chunk,
+                               content_type='application/octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self, chunk_size=1000):
+        response = self.client.post('/uploads/', {'filename': 'a.png',
+                                                  'size': len(self.content)})
+        self.assertEqual(response.status_code, 201, response.data)
+        upload_id = response.data['id']
+
+        for offset in range(0, len(self.content), chunk_size):
+            response = self.put_chunk(upload_id, offset,
+                                      self.content[offset:offset + chunk_size])
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(response.data['offset'],
+                             min(offset + chunk_size, len(self.content)))
+
+        response = self.client.post('/uploads/{}/complete/'.format(upload_id), {
+            'post': 'http://testserver/posts/{}/'.format(self.post.pk), 'order': 1})
+        self.assertEqual(response.status_code, 201, response.data)
+        return Photo.objects.get(pk=response.data['id'])
+
+    def test_upload_and_dedup(self):
+        photo = self.upload()
+        self.assertEqual(photo.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertTrue(photo.image.name.endswith('.jpg'))
+        with default_storage.open(photo.image.name) as f:
+            self.assertEqual(f.read(), self.content)
+
+        other = self.upload(chunk_size=4096)
+        self.assertEqual(other.image.name, photo.image.name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'post_photos')),
+                         [os.path.basename(photo.image.name)])
+        self.assertFalse(Upload.objects.exists())
+
+    def test_offset_mismatch_and_resume(self):
+        response = self.client.post('/uploads/', {'filename': 'a.jpg',
+                                                  'size': len(self.content)})
+        upload_id = response.data['id']
+        self.put_chunk(upload_id, 0, self.content[:100])
+
+        response = self.put_chunk(upload_id, 0, self.content[:100])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 100)
+
+        # Resumed by another process, which rebuilds the hash from the file.
+        uploads._hashes.clear()
+        self.put_chunk(upload_id, 100, self.content[100:])
+        response = self.client.post('/uploads/{}/complete/'.format(upload_id), {
+            'post': 'http://testserver/posts/{}/'.format(self.post.pk)})
+        self.assertEqual(response.data['id'], Photo.objects.get(
+            sha256=hashlib.sha256(self.content).hexdigest()).pk)
+
+    def test_incomplete(self):
+        response = self.client.post('/uploads/', {'filename': 'a.jpg',
+                                                  'size': len(self.content)})
+        upload_id = response.data['id']
+        response = self.put_chunk(upload_id, 0, self.content + b'x')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/uploads/{}/complete/'.format(upload_id), {
+            'post': 'http://testserver/posts/{}/'.format(self.post.pk)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_complete_as_photo_of_other_post(self):
+        other = Post.objects.create(user=User.objects.create_user('eve'), content='post')
+        response = self.client.post('/uploads/', {'filename': 'a.jpg',
+                                                  'size': len(self.content)})
+        upload_id = response.data['id']
+        self.put_chunk(upload_id, 0, self.content)
+        response = self.client.post('/uploads/{}/complete/'.format(upload_id), {
+            'post': 'http://testserver/posts/{}/'.format(other.pk)})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('post', response.data)
+        self.assertFalse(Photo.objects.exists())
+        self.assertTrue(Upload.objects.filter(pk=upload_id).exists())
+
+
+class VisitBatchTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(user=self.user, content=str(i)) for i in range(10)]
+
+    def batch(self, entries):
+        return self.client.post('/visits/batch/', [{'post': post.pk, 'state': state}
+                                                   for post, state in entries], format='json')
+
+    def counters(self, post):
+        post.refresh_from_db()
+        return post.like_count, post.dislike_count, post.visit_count
+
+    def test_upsert(self):
+        response = self.batch([(self.posts[0], 0), (self.posts[1], 1), (self.posts[2], 2)])
+        self.assertEqual(response.data, {'created': 3, 'updated': 0, 'buffered': 0})
+
+        # Seen again, liked, disliked after liked.
+        response = self.batch([(self.posts[0], 0), (self.posts[0], 1), (self.posts[1], 0),
+                               (self.posts[2], 1), (self.posts[3], 0)])
+        self.assertEqual(response.data, {'created': 1, 'updated': 2, 'buffered': 0})
+
+        self.assertEqual(Visit.objects.count(), 4)
+        self.assertEqual(self.counters(self.posts[0]), (1, 0, 1))
+        self.assertEqual(self.counters(self.posts[1]), (1, 0, 1))
+        self.assertEqual(self.counters(self.posts[2]), (1, 0, 1))
+        self.assertEqual(self.posts[2].score, hot_score(1, self.posts[2].create_time))
+
+    def test_visit_list_upsert(self):
+        url = 'http://testserver/posts/{}/'.format(self.posts[0].pk)
+        first = self.client.post('/visits/', {'post': url, 'state': 1})
+        second = self.client.post('/visits/', {'post': url, 'state': 0})
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(second.data['state'], 1)
+        self.assertEqual(self.counters(self.posts[0]), (1, 0, 1))
+
+    def test_constant_queries(self):
+        counts = []
+        for posts in (self.posts[:1], self.posts[1:]):
+            with CaptureQueriesContext(connection) as queries:
+                self.batch([(post, 0) for post in posts])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unknown_post(self):
+        response = self.client.post('/visits/batch/', [{'post': self.posts[0].pk},
+                                                       {'post': 12345}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Visit.objects.exists())
+
+    def test_too_many(self):
+        # Rejected before the entries are validated.
+        with mock.patch.object(views.VisitBatchItemSerializer, 'run_validation') as validate:
+            response = self.batch([(self.posts[0], 0)] * 501)
+        self.assertEqual(response.status_code, 400)
+        validate.assert_not_called()
+        response = self.client.post('/visits/batch/', {'post': self.posts[0].pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Visit.objects.exists())
+
+
+@override_settings(LUKE_VISIT_BUFFER={'MAX_SIZE': 3, 'MAX_AGE': 60})
+class VisitBufferTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(user=self.user, content=str(i)) for i in range(5)]
+
+    def tearDown(self):
+        # Don't leave any visits to the exit hook.
+        buffer = get_visit_buffer()
+        buffer.flush()
+        visitbuffer._buffer = None
+
+    def test_seen_buffered(self):
+        url = 'http://testserver/posts/{}/'
+        response = self.client.post('/visits/', {'post': url.format(self.posts[0].pk)})
+        self.assertEqual(response.status_code, 202)
+        response = self.client.post('/visits/batch/', [{'post': self.posts[1].pk},
+                                                       {'post': self.posts[2].pk, 'state': 1}],
+                                    format='json')
+        self.assertEqual(response.data, {'created': 1, 'updated': 0, 'buffered': 1})
+
+        # Only the like is written.
+        self.assertEqual(list(Visit.objects.values_list('post', 'state')),
+                         [(self.posts[2].pk, 1)])
+
+        # Full, flushed.
+        self.client.post('/visits/batch/', [{'post': self.posts[2].pk}], format='json')
+        self.assertEqual(Visit.objects.count(), 3)
+        self.assertEqual(Visit.objects.get(post=self.posts[2]).state, 1)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].visit_count, 1)
+
+    def test_flushed_by_thread(self):
+        with mock.patch.object(visitbuffer, 'record_visits_bulk', return_value=(1, 0)) as record:
+            buffer = VisitBuffer(max_size=100, max_age=0.05)
+            buffer.add(self.user.pk, self.posts[0].pk)
+
+            # No other visit comes.
+            for _ in range(100):
+                if record.called:
+                    break
+                time.sleep(0.05)
+
+            self.assertEqual(list(record.call_args[0][0]), [(self.user.pk, self.posts[0].pk, 0)])
+            self.assertEqual(len(buffer), 0)
+
+    def test_failed_flush_retried(self):
+        buffer = VisitBuffer(max_size=100, max_age=60, max_pending=2)
+        buffer.add(self.user.pk, self.posts[0].pk)
+        buffer.add(self.user.pk, self.posts[1].pk)
+
+        error = OperationalError('database is locked')
+        with mock.patch.object(visitbuffer, 'record_visits_bulk', side_effect=error), \
+                self.assertLogs('luke', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(buffer), 2)
+        self.assertFalse(Visit.objects.exists())
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(Visit.objects.count(), 2)
+
+        # Beyond max_pending, the visits of a failed flush are dropped.
+        buffer.add(self.user.pk, self.posts[2].pk)
+        buffer.add(self.user.pk, self.posts[3].pk)
+        with mock.patch.object(visitbuffer, 'record_visits_bulk', side_effect=error), \
+                self.assertLogs('luke', 'ERROR') as logs:
+            buffer.add(self.user.pk, self.posts[4].pk)
+            buffer.flush()
+        self.assertEqual(len(buffer), 2)
+        self.assertIn('Dropped 1 visits', logs.output[-1])
+
+    def test_dedup_and_deleted_posts(self):
+        buffer = VisitBuffer(max_size=1, max_age=60)
+        self.posts[1].delete()
+        buffer.add(self.user.pk, self.posts[1].pk)
+        self.assertEqual(len(buffer), 0)
+
+        buffer.max_size = 100
+        buffer.add(self.user.pk, self.posts[0].pk)
+        buffer.add(self.user.pk, self.posts[0].pk)
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+
+
+@override_settings(LUKE_DB_READ_REPLICA=True)
+class PrimaryReplicaRouterTests(APITestCase):
+
+    # The replica mirrors the test database, see the settings.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+        # The mirror is another connection to the in-memory database, it sees
+        # the rows of the test's transaction (and doesn't lock the tables
+        # for it) with read_uncommitted.
+        replica = connections['replica']
+        if replica.vendor == 'sqlite':
+            with replica.cursor() as cursor:
+                cursor.execute('PRAGMA read_uncommitted = 1')
+
+    def route(self, method):
+        """
+        Return the databases for reading and writing a post while serving
+        the request.
+        """
+        routes = []
+
+        def get_response(request):
+            routes.append(self.router.db_for_read(Post))
+            routes.append(self.router.db_for_write(Post))
+
+        ReplicaReadMiddleware(get_response)(getattr(RequestFactory(), method)('/posts/'))
+        return routes
+
+    def request(self, method, path, data=None):
+        """
+        Return the response and the queries made by the primary and by the
+        replica.
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(path, data)
+        return response, primary.captured_queries, replica.captured_queries
+
+    def test_reads_of_get_to_replica(self):
+        self.assertEqual(self.route('get'), ['replica', 'default'])
+        self.assertEqual(self.route('head'), ['replica', 'default'])
+        self.assertEqual(self.route('post'), ['default', 'default'])
+        self.assertEqual(self.route('put'), ['default', 'default'])
+
+        # Outside of requests, e.g., management commands.
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Post), 'replica')
+
+    def test_requests(self):
+        cache.clear()
+        user = User.objects.create_user('adam')
+        post = Post.objects.create(user=user, content='hi')
+
+        response, primary, replica = self.request('get', '/posts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in response.data['results']], [post.pk])
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+        self.client.force_authenticate(user)
+        response, primary, replica = self.request('post', '/posts/', {'content': 'hello'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(replica, [])
+        self.assertTrue(any(q['sql'].startswith('INSERT INTO "luke_post"') for q in primary))
+
+    def test_migrate(self):
+        self.assertTrue(self.router.allow_migrate('default', 'luke'))
+        self.assertFalse(self.router.allow_migrate('replica', 'luke'))
+
+    @override_settings(LUKE_DB_READ_REPLICA=False)
+    def test_no_replica(self):
+        self.assertEqual(self.route('get'), ['default', 'default'])
+
+
+class HealthCheckTests(SimpleTestCase):
+
+    def test_close_unusable(self):
+        db = connection.copy()
+        db.settings_dict['CONN_HEALTH_CHECKS'] = True
+        db.ensure_connection()
+        self.addCleanup(db.close)
+        with mock.patch.object(dbhealth, 'connections', mock.Mock(all=lambda: [db])), \
+                mock.patch.object(db, 'close') as close:
+            dbhealth.check_connections()
+            close.assert_not_called()
+            with mock.patch.object(db, 'is_usable', return_value=False):
+                dbhealth.check_connections()
+            close.assert_called_once_with()
+
+
+class SqliteTuningTests(SimpleTestCase):
+
+    def pragmas(self):
+        """
+        Return the pragmas of a new connection.
+        """
+        db = connection.copy()
+        try:
+            with db.cursor() as cursor:
+                values = {}
+                for name in ('synchronous', 'busy_timeout', 'cache_size'):
+                    cursor.execute('PRAGMA {}'.format(name))
+                    values[name] = cursor.fetchone()[0]
+                return values
+        finally:
+            db.close()
+
+    @override_settings(LUKE_SQLITE_TUNING=True)
+    def test_enabled(self):
+        self.assertTrue(connection_created.has_listeners())
+        # NORMAL is 1.
+        self.assertEqual(self.pragmas(), {'synchronous': 1, 'busy_timeout': 5000,
+                                          'cache_size': -64 * 1024})
+
+    @override_settings(LUKE_SQLITE_TUNING=False)
+    def test_disabled(self):
+        self.assertNotEqual(self.pragmas()['synchronous'], 1)
+
+    def test_bench(self):
+        out = StringIO()
+        call_command('bench_sqlite', seconds=0.1, posts=10, stdout=out)
+        self.assertIn('tuned', out.getvalue())
+
+
+class DiscussionTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('adam', password='123456')
+        self.client.force_authenticate(self.user)
+
+    def expire(self, discussion):
+        Discussion.objects.filter(pk=discussion.pk).update(
+            last_activity=timezone.now() - Discussion.LIFETIME - timedelta(seconds=1))
+
+    def test_messages_since(self):
+        response = self.client.post('/discussions/', {'topic': 'Shenzhen'})
+        self.assertEqual(response.status_code, 201)
+        url = response.data['messages']
+
+        for i in range(5):
+            response = self.client.post(url, {'content': str(i)})
+            self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(url, {'page_size': 3})
+        self.assertEqual([m['content'] for m in response.data['results']], ['0', '1', '2'])
+        self.assertIsNotNone(response.data['next'])
+
+        since = response.data['since']
+        response = self.client.get(url, {'since': since, 'page_size': 3})
+        self.assertEqual([m['content'] for m in response.data['results']], ['3', '4'])
+        self.assertIsNone(response.data['next'])
+
+        # Nothing new, poll again with the same since.
+        since = response.data['since']
+        response = self.client.get(url, {'since': since})
+        self.assertEqual(response.data, {'since': since, 'next': None, 'results': []})
+
+    def test_expiry(self):
+        active = Discussion.objects.create(user=self.user, topic='active')
+        expired = Discussion.objects.create(user=self.user, topic='expired')
+        DiscussionMessage.objects.create(discussion=expired, user=self.user, content='Hi')
+        self.expire(expired)
+
+        response = self.client.get('/discussions/')
+        self.assertEqual([d['id'] for d in response.data['results']], [active.pk])
+        self.assertEqual(self.client.get('/discussions/{}/'.format(expired.pk)).status_code, 404)
+
+        url = '/discussions/{}/messages/'.format(expired.pk)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(url, {'content': 'Hello?'}).status_code, 404)
+
+        # A message keeps a discussion alive.
+        Discussion.objects.filter(pk=active.pk).update(
+            last_activity=timezone.now() - Discussion.LIFETIME + timedelta(minutes=1))
+        self.client.post('/discussions/{}/messages/'.format(active.pk), {'content': 'Hi'})
+        active.refresh_from_db()
+        self.assertGreater(active.last_activity, timezone.now() - timedelta(minutes=1))
+
+        for i in range(3):
+            self.expire(Discussion.objects.create(user=self.user, topic=str(i)))
+
+        out = StringIO()
+        call_command('expire_discussions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 4 discussions.', out.getvalue())
+        self.assertEqual(list(Discussion.objects.all()), [active])
+        self.assertEqual(DiscussionMessage.objects.filter(discussion=active).count(), 1)
+        self.assertEqual(DiscussionMessage.objects.count(), 1)
+
+
+class LongPollTests(APITestCase):
+
+    def setUp(self):
+        hub.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+
+    def test_hub(self):
+        hub = Hub()
+
+        async def wait(since):
+            return await hub.wait('posts', since, timeout=5)
+
+        # Published by another thread while waiting.
+        threading.Timer(0.05, hub.publish, ('posts', 3)).start()
+        self.assertEqual(asyncio.run(wait(0)), 3)
+        self.assertEqual(asyncio.run(wait(2)), 3)
+
+        self.assertIsNone(asyncio.run(hub.wait('posts', 3, timeout=0.01)))
+
+        hub.max_age = 0
+        self.assertIsNone(hub.latest('posts'))
+
+    def test_hub_recheck(self):
+        hub = Hub(recheck_interval=0.01)
+        lookups = []
+
+        async def lookup():
+            # Saved by another process after a few lookups.
+            lookups.append(1)
+            return 7 if len(lookups) >= 3 else 0
+
+        async def wait():
+            return await asyncio.gather(hub.wait('posts', 0, 5, lookup),
+                                        hub.wait('posts', 0, 5, lookup))
+
+        self.assertEqual(asyncio.run(wait()), [7, 7])
+        # Looked up by one of the waiters at a time.
+        self.assertLess(len(lookups), 6)
+
+    def test_poll_other_process(self):
+        since = self.client.get('/posts/poll/').json()['since']
+        # Not published, as if saved by another process.
+        Post.objects.create(user=self.user, content='new')
+
+        with mock.patch.object(hub, 'recheck_interval', 0.01):
+            response = self.client.get('/posts/poll/', {'since': since, 'timeout': 5})
+        self.assertEqual([post['content'] for post in response.json()['results']], ['new'])
+
+    def test_poll_posts(self):
+        Post.objects.create(user=self.user, content='old')
+
+        response = self.client.get('/posts/poll/')
+        since = response.json()['since']
+        self.assertEqual(response.json(), {'since': Post.objects.get().pk, 'results': []})
+
+        # Nothing new, no query.
+        with self.assertNumQueries(0):
+            response = self.client.get('/posts/poll/', {'since': since, 'timeout': 0})
+        self.assertEqual(response.json(), {'since': since, 'results': []})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(self.user)
+            self.client.post('/posts/', {'content': 'new'})
+
+        response = self.client.get('/posts/poll/', {'since': since, 'timeout': 5})
+        data = response.json()
+        self.assertEqual([post['content'] for post in data['results']], ['new'])
+        self.assertEqual(data['since'], data['results'][-1]['id'])
+
+        self.assertEqual(self.client.get('/posts/poll/', {'since': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/posts/poll/', {'timeout': 'nan'}).status_code, 400)
+
+    def test_poll_messages(self):
+        discussion = Discussion.objects.create(user=self.user, topic='Shenzhen')
+        url = '/discussions/{}/messages/poll/'.format(discussion.pk)
+
+        self.assertEqual(self.client.get(url).json(), {'since': 0, 'results': []})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DiscussionMessage.objects.create(discussion=discussion, user=self.user, content='Hi')
+
+        data = self.client.get(url, {'since': 0, 'timeout': 5}).json()
+        self.assertEqual([m['content'] for m in data['results']], ['Hi'])
+
+        self.assertEqual(self.client.get('/discussions/0/messages/poll/').status_code, 404)
+
+
+# The reads run in the thread of the test, in its transaction.
+@override_settings(LUKE_ASYNC_THREAD_SENSITIVE=True)
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # The views take any HttpRequest.
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.post = Post.objects.create(user=self.user, content='post')
+        self.url = '/posts/{}/'.format(self.post.pk)
+
+    def get(self, view, url, **kwargs):
+        """
+        Return the response and the number of queries.
+        """
+        extra = {'HTTP_ACCEPT': 'application/json'}
+        if kwargs.pop('authenticated', False):
+            credentials = b64encode(b'adam:123456').decode('ascii')
+            extra['HTTP_AUTHORIZATION'] = 'Basic ' + credentials
+        extra.update(kwargs.pop('extra', {}))
+
+        request = self.factory.get(url, **extra)
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(view)(request, **kwargs)
+        return response, len(queries)
+
+    def test_cached_on_event_loop(self):
+        response, n = self.get(asyncviews.post_detail, self.url, pk=str(self.post.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(n, 0)
+        self.assertEqual(response.content, self.client.get(self.url, HTTP_ACCEPT='application/json').content)
+
+        cached, n = self.get(asyncviews.post_detail, self.url, pk=str(self.post.pk))
+        self.assertEqual(n, 0)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Allow'], response['Allow'])
+
+        # 304 from the cache.
+        cached, n = self.get(asyncviews.post_detail, self.url, pk=str(self.post.pk),
+                             extra={'HTTP_IF_NONE_MATCH': response['ETag']})
+        self.assertEqual((cached.status_code, n), (304, 0))
+
+    def test_cached_off_event_loop(self):
+        response, _ = self.get(asyncviews.post_detail, self.url, pk=str(self.post.pk))
+
+        # E.g., memcached.
+        with mock.patch.object(asyncviews, 'is_local_cache', return_value=False), \
+                mock.patch.object(asyncviews, 'sync_to_async', wraps=asyncviews.sync_to_async) as wrapper:
+            cached, n = self.get(asyncviews.post_detail, self.url, pk=str(self.post.pk))
+        self.assertEqual((cached.content, n), (response.content, 0))
+        self.assertTrue(wrapper.called)
+
+    def test_authenticated_by_sync_view(self):
+        self.get(asyncviews.tag_list, '/tags/')
+        response, n = self.get(asyncviews.tag_list, '/tags/', authenticated=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(n, 0)
+
+        response, _ = self.get(asyncviews.post_photo_list, '/posts/0/photos/', pk='0',
+                               authenticated=True)
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_root(self):
+        response, n = self.get(asyncviews.api_root, '/')
+        self.assertEqual(n, 0)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/posts/', response.content)
+        self.assertNotIsInstance(response, Response)
+
+
+class AsyncViewThreadPoolTests(TransactionTestCase):
+
+    def test_reads_in_thread_pool(self):
+        cache.clear()
+        user = User.objects.create_user('adam', password='123456')
+        post = Post.objects.create(user=user, content='post')
+        self.addCleanup(post.delete)
+
+        threads = []
+        call_sync = asyncviews._call_sync
+
+        def call(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return call_sync(*args, **kwargs)
+
+        request = RequestFactory().get('/posts/{}/'.format(post.pk), HTTP_ACCEPT='application/json')
+        with mock.patch.object(asyncviews, '_call_sync', side_effect=call):
+            response = async_to_sync(asyncviews.post_detail)(request, pk=str(post.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'"content":"post"', response.content)
+        # Not the thread shared by the sync code, i.e., the main thread here.
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('adam', password='123456')
+
+    def post(self, content):
+        return Post.objects.create(user=self.user, content=content)
+
+    def search(self, q, **params):
+        response = self.client.get('/posts/search/', dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return [post['content'] for post in response.data['results']]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('深圳湾 Hello'),
+                         ['深', '圳', '湾', '深圳', '圳湾', 'hello'])
+        self.assertEqual(search.tokenize('深圳湾, 深', query=True), ['深圳', '圳湾', '深'])
+
+    def test_search(self):
+        self.post('今天去深圳湾公园跑步')
+        self.post('深圳的天气不错，深圳湾的日落很美')
+        self.post('上海外滩 Shanghai')
+        self.post('圳湾深')
+
+        # All the bigrams must match, the more matches the better.
+        self.assertEqual(self.search('深圳湾'), ['深圳的天气不错，深圳湾的日落很美',
+                                                 '今天去深圳湾公园跑步'])
+        self.assertEqual(self.search('SHANGHAI'), ['上海外滩 Shanghai'])
+        self.assertEqual(len(self.search('湾')), 3)
+        self.assertEqual(self.search('北京'), [])
+        self.assertEqual(self.client.get('/posts/search/').status_code, 400)
+
+        # Operators are taken as text.
+        self.assertEqual(self.search('"深圳 OR'), [])
+
+    def test_pagination(self):
+        for i in range(5):
+            self.post('深圳 {}'.format(i))
+
+        response = self.client.get('/posts/search/', {'q': '深圳', 'limit': 2})
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(len(self.search('深圳', limit=2, offset=4)), 1)
+
+    def test_sync(self):
+        post = self.post('深圳')
+        post.content = '上海'
+        post.save()
+        self.assertEqual(self.search('深圳'), [])
+        self.assertEqual(self.search('上海'), ['上海'])
+
+        post.delete()
+        self.assertEqual(self.search('上海'), [])
+
+        # Bulk changes need a rebuild.
+        Post.objects.bulk_create([Post(user=self.user, content='北京'),
+                                  Post(user=self.user, content='北京 天安门')])
+        self.assertEqual(self.search('北京'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 posts.', out.getvalue())
+        self.assertEqual(len(self.search('北京')), 2)
+
+    def test_missing_table(self):
+        # As in a worker of a database where the table couldn't be created.
+        self.addCleanup(setattr, connection, 'luke_search_table', None)
+        connection.luke_search_table = None
+        with mock.patch.object(search, 'TABLE', 'luke_post_search_missing'):
+            post = self.post('深圳湾')
+            self.assertEqual(self.search('深圳'), ['深圳湾'])
+            post.content = '上海'
+            post.save()
+            self.assertEqual(self.search('深圳'), [])
+            post.delete()
+            self.assertEqual(self.search('上海'), [])
+
+
+class FeedTests(APITestCase):
+
+    def setUp(self):
+        feed.candidate_cache.clear()
+        self.user = User.objects.create_user('adam', password='123456')
+        self.author = User.objects.create_user('eve', password='123456')
+        self.client.force_authenticate(self.user)
+
+    def post(self, mode='', tags=()):
+        post = Post.objects.create(user=self.author, content=mode, mode=mode)
+        post.tags.set(Tag.objects.get_or_create_all(tags))
+        return post
+
+    def feed(self, **params):
+        response = self.client.get('/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_affinity(self):
+        liked = self.post('happy', ['food'])
+        disliked = self.post('sad', ['work'])
+        Visit.objects.create(user=self.user, post=liked, state=1)
+        Visit.objects.create(user=self.user, post=disliked, state=2)
+
+        food = self.post('happy', ['food'])
+        work = self.post('', ['work'])
+        plain = self.post()
+        happy = self.post('happy')
+        seen = self.post('happy', ['food'])
+        Visit.objects.create(user=self.user, post=seen, state=0)
+        Post.objects.create(user=self.user, content='mine', mode='happy')
+
+        # Visited and own posts are skipped.
+        self.assertEqual(self.feed(), [food.pk, happy.pk, plain.pk, work.pk])
+
+    def test_mood(self):
+        sad = self.post('sad')
+        happy = self.post('happy')
+        self.assertEqual(self.feed(), [happy.pk, sad.pk])
+
+        Post.objects.create(user=self.user, content='...', mode='sad')
+        self.assertEqual(self.feed(refresh=1), [happy.pk, sad.pk])
+        self.assertEqual(self.client.get('/feed/', {'limit': 1}).data['count'], 2)
+
+    def test_cache(self):
+        posts = [self.post() for _ in range(3)]
+        self.assertEqual(len(self.feed(limit=2)), 2)
+
+        # Pages of the same ranking, new posts wait for a refresh.
+        self.post()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.feed(limit=2, offset=2), [posts[0].pk])
+        self.assertEqual(len(self.feed(refresh=1)), 4)
+
+        cache = feed.CandidateCache(max_size=2)
+        for user_id in (1, 2, 3):
+            cache.set(user_id, [user_id])
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), [2])
+
+        cache.max_age = 0
+        self.assertIsNone(cache.get(2))
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/feed/').status_code, 401)
+
+
+class SeenFilterTests(APITestCase):
+
+    def test_bloom(self):
+        seen = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+        # A false positive is not added again.
+        added = sum(seen.add(pk) for pk in range(0, 2000, 2))
+        self.assertGreater(added, 980)
+        self.assertFalse(seen.add(0))
+        self.assertEqual(len(seen), added)
+        self.assertGreater(len(seen.slices), 1)
+
+        seen = ScalableBloomFilter.from_bytes(seen.to_bytes())
+        self.assertTrue(all(pk in seen for pk in range(0, 2000, 2)))
+        false_positives = sum(1 for pk in range(1, 20000, 2) if pk in seen)
+        self.assertLess(false_positives, 10000 * 0.02)
+
+        with self.assertRaises(ValueError):
+            ScalableBloomFilter.from_bytes(b'XX' + seen.to_bytes()[2:])
+
+    def test_bloom_union(self):
+        a = ScalableBloomFilter(initial_capacity=100)
+        b = ScalableBloomFilter(initial_capacity=100)
+        # Less any false positive.
+        self.assertGreater(a.update(range(0, 300)), 290)
+        b.update(range(1000, 1050))
+        b.union(a)
+        self.assertTrue(all(pk in b for pk in range(0, 300)))
+        self.assertTrue(all(pk in b for pk in range(1000, 1050)))
+        self.assertEqual(len(b.slices), len(a.slices))
+
+        with self.assertRaises(ValueError):
+            b.union(ScalableBloomFilter(initial_capacity=10))
+
+    def test_visits(self):
+        user = User.objects.create_user('adam', password='123456')
+        posts = [Post.objects.create(user=user, content=str(i)) for i in range(4)]
+        Visit.objects.create(user=user, post=posts[0])
+
+        # Built from the visits.
+        self.assertIn(posts[0].pk, get_seen_filter(user))
+        self.assertNotIn(posts[1].pk, get_seen_filter(user))
+
+        # Updated by new visits, not by votes on existing ones.
+        self.client.force_authenticate(user)
+        self.client.post('/visits/batch/', [{'post': posts[1].pk}, {'post': posts[2].pk, 'state': 1},
+                                            {'post': posts[0].pk, 'state': 1}], format='json')
+        with self.assertNumQueries(1):
+            seen = get_seen_filter(user)
+        self.assertEqual(len(seen), 3)
+        self.assertIn(posts[2].pk, seen)
+        self.assertNotIn(posts[3].pk, seen)
+
+    def test_visits_before_built(self):
+        user = User.objects.create_user('adam', password='123456')
+        posts = [Post.objects.create(user=user, content=str(i)) for i in range(3)]
+
+        # Recording visits creates the row (the lock of a concurrent build),
+        # the filter is built on first use.
+        self.client.force_authenticate(user)
+        self.client.post('/visits/batch/', [{'post': posts[0].pk}], format='json')
+        self.assertEqual(bytes(SeenFilter.objects.get(user=user).data), b'')
+        self.assertIn(posts[0].pk, get_seen_filter(user))
+
+        self.client.post('/visits/batch/', [{'post': posts[1].pk}], format='json')
+        stored = ScalableBloomFilter.from_bytes(SeenFilter.objects.get(user=user).data)
+        self.assertEqual(len(stored), 2)
+
+    def test_built_concurrently(self):
+        user = User.objects.create_user('adam', password='123456')
+        posts = [Post.objects.create(user=user, content=str(i)) for i in range(2)]
+        Visit.objects.create(user=user, post=posts[0])
+
+        # Built by another request after this one has looked for it.
+        other = ScalableBloomFilter()
+        other.update([posts[0].pk, posts[1].pk])
+
+        def not_found(*args, **kwargs):
+            SeenFilter.objects.create(user=user, data=other.to_bytes())
+            return mock.Mock(first=lambda: None)
+
+        with mock.patch.object(SeenFilter.objects, 'filter', side_effect=not_found):
+            seen = get_seen_filter(user)
+
+        self.assertEqual(seen.to_bytes(), other.to_bytes())
+        self.assertEqual(bytes(SeenFilter.objects.get(user=user).data), other.to_bytes())
+
+    def test_bench(self):
+        out = StringIO()
+        call_command('bench_bloom', visits=1000, probes=1000, stdout=out)
+        self.assertIn('False positives', out.getvalue())
+
+
+@override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+    'signup': '1/h', 'login': '1/m', 'posts': '2/m', 'photos': '2/m', 'visits': '2/m',
+    'discussions': '2/m', 'messages': '2/m'}))
+class ThrottleTests(APITestCase):
+
+    def setUp(self):
+        TokenBucketThrottle().cache.clear()
+        self.adam = User.objects.create_user('adam', password='123456')
+        self.eve = User.objects.create_user('eve', password='123456')
+
+    def post(self, user, content='hi'):
+        self.client.force_authenticate(user)
+        return self.client.post('/posts/', {'content': content})
+
+    def test_per_user(self):
+        self.assertEqual(self.post(self.adam).status_code, 201)
+        self.assertEqual(self.post(self.adam).status_code, 201)
+        response = self.post(self.adam)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+        # Other users and reads are not throttled.
+        self.assertEqual(self.post(self.eve).status_code, 201)
+        self.assertEqual(self.client.get('/posts/').status_code, 200)
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_refill(self):
+        now = 1000000.0
+        with mock.patch.object(TokenBucketThrottle, 'timer', mock.Mock(return_value=now)):
+            self.post(self.adam)
+            self.post(self.adam)
+            self.assertEqual(self.post(self.adam).status_code, 429)
+        # A token per 30 seconds.
+        with mock.patch.object(TokenBucketThrottle, 'timer', mock.Mock(return_value=now + 30)):
+            self.assertEqual(self.post(self.adam).status_code, 201)
+            self.assertEqual(self.post(self.adam).status_code, 429)
+
+    def test_uploads_and_discussions(self):
+        self.client.force_authenticate(self.adam)
+        for _ in range(2):
+            self.client.post('/uploads/', {'filename': 'a.jpg', 'size': 10})
+        self.assertEqual(self.client.post('/uploads/', {'filename': 'a.jpg', 'size': 10}).status_code, 429)
+
+        for _ in range(2):
+            self.client.post('/discussions/', {'topic': 'Shenzhen'})
+        self.assertEqual(self.client.post('/discussions/', {'topic': 'Shenzhen'}).status_code, 429)
+
+    def test_signup_per_ip(self):
+        def signup(username, ip):
+            data = {'username': username, 'password': '123456', 'profile': {'gender': 'M'}}
+            return self.client.post('/users/', data, format='json', REMOTE_ADDR=ip)
+
+        self.assertEqual(signup('test', '10.0.0.1').status_code, 201)
+        self.assertEqual(signup('test2', '10.0.0.1').status_code, 429)
+        response = signup('test2', '10.0.0.2')
+        self.assertEqual(response.status_code, 201)
+
+    def test_spoofed_forwarded_for(self):
+        data = {'username': 'test', 'password': '123456', 'profile': {'gender': 'M'}}
+        self.assertEqual(self.client.post('/users/', data, format='json',
+                                          HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 201)
+        data['username'] = 'test2'
+        self.assertEqual(self.client.post('/users/', data, format='json',
+                                          HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 429)
+
+        data = {'username': 'adam', 'password': '123456'}
+        self.assertEqual(self.client.post('/api-token-auth/', data,
+                                          HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 200)
+        self.assertEqual(self.client.post('/api-token-auth/', data,
+                                          HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 429)
+
+    def test_no_query(self):
+        request = RequestFactory().post('/posts/')
+        request.user = self.adam
+        view = views.PostList()
+        with self.assertNumQueries(0):
+            self.assertTrue(TokenBucketThrottle().allow_request(request, view))
+
+    def test_bench(self):
+        out = StringIO()
+        call_command('bench_throttle', requests=100, stdout=out)
+        line = next(l for l in out.getvalue().splitlines() if l.startswith('Token bucket'))
+        self.assertTrue(line.endswith(' 0 queries'))
+
+
+class TokenAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        authentication.get_cache().clear()
+        self.user = User.objects.create_user('adam', password='123456')
+
+    def obtain_token(self):
+        response = self.client.post('/api-token-auth/', {'username': 'adam', 'password': '123456'})
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def authenticate(self, key):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Token ' + key)
+        return ExpiringTokenAuthentication().authenticate(request)
+
+    def test_cached(self):
+        key = self.obtain_token()
+        self.assertEqual(self.obtain_token(), key)
+
+        response = self.client.get('/feed/', HTTP_AUTHORIZATION='Token ' + key)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            user, token = self.authenticate(key)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.username, 'adam')
+        self.assertEqual(token.key, key)
+
+    def test_no_password_cached(self):
+        key = self.obtain_token()
+        self.authenticate(key)
+        cached = authentication.get_cache().get(authentication.CACHE_KEY_FORMAT % key)
+        self.assertNotIn(self.user.password, repr(cached))
+
+        # Deferred, a save doesn't overwrite it.
+        user, _ = self.authenticate(key)
+        user.first_name = 'Adam'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Adam')
+        self.assertTrue(self.user.check_password('123456'))
+
+    def test_expired(self):
+        key = self.obtain_token()
+        Token.objects.filter(key=key).update(created=timezone.now() - timedelta(days=31))
+        response = self.client.get('/feed/', HTTP_AUTHORIZATION='Token ' + key)
+        self.assertEqual(response.status_code, 401)
+
+        # A new one.
+        new_key = self.obtain_token()
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(self.authenticate(new_key)[0], self.user)
+
+    def test_expired_concurrently(self):
+        key = self.obtain_token()
+        Token.objects.filter(key=key).update(created=timezone.now() - timedelta(days=31))
+
+        # Replaced by a concurrent login after this one found it expired.
+        def replaced(token, now=None):
+            Token.objects.filter(key=token.key).delete()
+            self.concurrent = Token.objects.create(user=self.user)
+            return True
+
+        with mock.patch.object(views, 'is_expired', side_effect=replaced):
+            new_key = self.obtain_token()
+        self.assertEqual(new_key, self.concurrent.key)
+
+    def test_invalidated(self):
+        key = self.obtain_token()
+        self.authenticate(key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.get('/feed/', HTTP_AUTHORIZATION='Token ' + key)
+        self.assertEqual(response.status_code, 401)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = True
+            self.user.save()
+        self.authenticate(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(key=key).delete()
+        response = self.client.get('/feed/', HTTP_AUTHORIZATION='Token ' + key)
+        self.assertEqual(response.status_code, 401)
+
+    def test_read_from_primary(self):
+        key = self.obtain_token()
+        # Not replicated yet.
+        with mock.patch.object(PrimaryReplicaRouter, 'db_for_read', return_value='replica'):
+            self.assertEqual(self.authenticate(key)[0], self.user)
@@ -0,0 +1,85 @@
+"""
+Rate limiting of the writes by token buckets in the cache.
+
+A view is throttled by its throttle_scope, e.g., 'posts', at the rate of the
+scope in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], e.g., '20/m': a bucket
+holds up to 20 tokens and is refilled by 20 tokens per minute, a write takes
+a token. So a client may burst 20 writes, then 1 write per 3 seconds. The
+bucket is per user, or per IP for anonymous requests (e.g., sign up), which
+is REMOTE_ADDR unless REST_FRAMEWORK['NUM_PROXIES'] says otherwise.
+
+Unlike the throttles of DRF, which keep the timestamps of all the requests
+in the window, a bucket is 2 numbers: a check is a cache get and set, no
+query (see the bench_throttle command).
+
+The buckets are kept in the cache settings.LUKE_THROTTLE_CACHE, which must
+be shared by the worker processes (e.g., memcached, see the settings).
+NOTE: With a per-process cache (e.g., LocMemCache, the default in
+development), each worker has its own buckets, N workers allow N times the
+rate.
+
+NOTE: The get and set are not atomic, concurrent writes of a client by
+several processes may take the same token. A bucket evicted from the cache
+is full again. Both err on the side of allowing the request.
+"""
+
+import math
+
+from django.conf import settings
+from django.core.cache import caches
+
+from rest_framework import permissions
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle
+
+
+class TokenBucketThrottle(ScopedRateThrottle):
+    """
+    Throttle the unsafe methods of the views with a throttle_scope.
+    """
+
+    cache_format = 'throttle_bucket_%(scope)s_%(ident)s'
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'LUKE_THROTTLE_CACHE', 'default')]
+
+    def get_rate(self):
+        # Not THROTTLE_RATES, which is read once, so that the rates can be
+        # overridden (e.g., by tests).
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return super(TokenBucketThrottle, self).get_rate()
+        return rate
+
+    def allow_request(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+        capacity, duration = self.parse_rate(self.rate)
+        refill = capacity / duration
+
+        self.key = self.get_cache_key(request, view)
+        now = self.timer()
+        tokens, last = self.cache.get(self.key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * refill)
+
+        if tokens < 1:
+            # Seconds until the next token.
+            self.wait_time = (1 - tokens) / refill
+            return False
+
+        # Kept until the bucket is full again.
+        timeout = int(math.ceil((capacity - tokens + 1) / refill))
+        self.cache.set(self.key, (tokens - 1, now), timeout)
+        return True
+
+    def wait(self):
+        return self.wait_time
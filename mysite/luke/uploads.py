@@ -0,0 +1,173 @@
+"""
+Resumable photo uploads by chunks, deduplicated by content hash.
+
+1. Create an upload with the file name and size:
+    $ http -a <name>:<pw> POST :8000/uploads/ filename=test.jpg size:=5242880
+2. Send the chunks in order, each with the offset where it starts:
+    $ http -a <name>:<pw> PUT :8000/uploads/<id>/ Upload-Offset:0 < chunk0
+   An interrupted upload is resumed from the offset given by:
+    $ http -a <name>:<pw> :8000/uploads/<id>/
+3. Complete the upload as a photo of a post:
+    $ http -a <name>:<pw> POST :8000/uploads/<id>/complete/ post=<post url> order:=1
+
+The chunks are streamed to a part file and hashed while being written, a
+chunk is never held in memory as a whole. If the SHA-256 of the completed
+file matches an existing photo, the new photo reuses the stored file.
+"""
+
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from PIL import Image
+
+from .models import Photo
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# Where the part files are stored, under MEDIA_ROOT.
+UPLOAD_DIR = 'uploads'
+
+# Where the completed photos are stored, see Photo.image.
+PHOTO_DIR = Photo._meta.get_field('image').upload_to
+
+# Same as client_max_body_size of mysite_nginx.conf.
+MAX_SIZE = getattr(settings, 'LUKE_MAX_UPLOAD_SIZE', 75 * 1024 * 1024)
+
+BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super(OffsetMismatch, self).__init__('Upload offset mismatch, expected {}.'.format(offset))
+        self.offset = offset
+
+
+# Upload id -> (offset, hash) of the uploads in progress in this process.
+# A hash is restored from the part file if the previous chunk was received
+# by another process.
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def part_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, UPLOAD_DIR, '{}.part'.format(upload.pk))
+
+
+def _get_hash(upload, path):
+    with _hashes_lock:
+        offset, h = _hashes.pop(upload.pk, (None, None))
+
+    if offset == upload.offset:
+        return h
+
+    h = hashlib.sha256()
+    if upload.offset:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                h.update(block)
+    return h
+
+
+def append_chunk(upload, stream, offset):
+    """
+    Append the chunk read from stream at offset, return the new offset.
+    """
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'ab') as f:
+        # Serialize concurrent chunks of the same upload.
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+        upload.refresh_from_db(fields=['offset'])
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+
+        # Drop the bytes of a chunk which failed halfway.
+        f.truncate(upload.offset)
+
+        h = _get_hash(upload, path)
+
+        received = upload.offset
+        if stream is not None:
+            for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                received += len(block)
+                if received > upload.size:
+                    raise UploadError('Upload exceeds its size {}.'.format(upload.size))
+                f.write(block)
+                h.update(block)
+        f.flush()
+
+        type(upload).objects.filter(pk=upload.pk).update(offset=received)
+        upload.offset = received
+
+        with _hashes_lock:
+            _hashes[upload.pk] = (received, h)
+
+    return received
+
+
+def complete(upload, post, order=0):
+    """
+    Create the photo of the completed upload and delete the upload.
+    """
+    if upload.offset != upload.size:
+        raise UploadError('Upload is incomplete, {} of {} bytes received.'.format(
+            upload.offset, upload.size))
+
+    path = part_path(upload)
+    digest = _get_hash(upload, path).hexdigest()
+
+    existing = Photo.objects.filter(sha256=digest).exclude(image='').order_by('id').first()
+
+    if existing is not None:
+        # The same content, share the file and its variants.
+        if existing.state in (Photo.READY, Photo.FAILED):
+            state = existing.state
+        else:
+            state = Photo.PENDING
+        photo = Photo.objects.create(post=post, image=existing.image.name, order=order,
+                                     sha256=digest, state=state)
+    else:
+        try:
+            with Image.open(path) as image:
+                image.verify()
+                image_format = image.format
+        except Exception:
+            raise UploadError('Upload is not a valid image.')
+
+        # Trust the content rather than the file name.
+        ext = 'jpg' if image_format == 'JPEG' else image_format.lower()
+        name = '{}/{}.{}'.format(PHOTO_DIR, digest, ext)
+        with open(path, 'rb') as f:
+            name = default_storage.save(name, File(f))
+        photo = Photo.objects.create(post=post, image=name, order=order, sha256=digest)
+
+    discard(upload)
+    return photo
+
+
+def discard(upload):
+    with _hashes_lock:
+        _hashes.pop(upload.pk, None)
+
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+    upload.delete()
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.conf.urls import url
 
 from rest_framework.urlpatterns import format_suffix_patterns
@@ -5,23 +6,57 @@ from rest_framework.urlpatterns import format_suffix_patterns
 from . import views
 
 
+# The read-heavy views, async under ASGI, see asyncviews.py.
+if settings.LUKE_ASYNC_VIEWS:
+    from . import asyncviews
+    api_root = asyncviews.api_root
+    post_detail = asyncviews.post_detail
+    post_photo_list = asyncviews.post_photo_list
+    tag_list = asyncviews.tag_list
+else:
+    api_root = views.api_root
+    post_detail = views.PostDetail.as_view()
+    post_photo_list = views.PostPhotoList.as_view()
+    tag_list = views.TagList.as_view()
+
+
 urlpatterns = [
-    url(r'^$', views.api_root),
+    url(r'^$', api_root),
 
     url(r'^tags/(?P<pk>\d+)/$', views.TagDetail.as_view(), name='tag-detail'),
-    url(r'^tags/$', views.TagList.as_view(), name='tag-list'),
+    url(r'^tags/$', tag_list, name='tag-list'),
+    url(r'^tags/complete/$', views.TagComplete.as_view(), name='tag-complete'),
 
     url(r'^posts/$', views.PostList.as_view(), name='post-list'),
-    url(r'^posts/(?P<pk>\d+)/$', views.PostDetail.as_view(), name='post-detail'),
-    url(r'^posts/(?P<pk>\d+)/photos/$', views.PostPhotoList.as_view(), name='postphoto-list'),
+    url(r'^posts/poll/$', views.post_poll, name='post-poll'),
+    url(r'^posts/hot/$', views.PostHotList.as_view(), name='post-hot-list'),
+    url(r'^posts/search/$', views.PostSearch.as_view(), name='post-search'),
+    url(r'^posts/nearby/$', views.PostNearbyList.as_view(), name='post-nearby-list'),
+    url(r'^posts/(?P<pk>\d+)/$', post_detail, name='post-detail'),
+    url(r'^posts/(?P<pk>\d+)/photos/$', post_photo_list, name='postphoto-list'),
     url(r'^posts/(?P<pk>\d+)/tags/$', views.PostTagList.as_view(), name='posttag-list'),
 
+    url(r'^feed/$', views.Feed.as_view(), name='feed'),
+
     url(r'^photos/$', views.PhotoList.as_view(), name='photo-list'),
     url(r'^photos/(?P<pk>\d+)/$', views.PhotoDetail.as_view(), name='photo-detail'),
 
+    url(r'^uploads/$', views.UploadList.as_view(), name='upload-list'),
+    url(r'^uploads/(?P<pk>[0-9a-f-]+)/$', views.UploadDetail.as_view(), name='upload-detail'),
+    url(r'^uploads/(?P<pk>[0-9a-f-]+)/complete/$', views.UploadComplete.as_view(),
+        name='upload-complete'),
+
     url(r'^visits/$', views.VisitList.as_view(), name='visit-list'),
+    url(r'^visits/batch/$', views.VisitBatch.as_view(), name='visit-batch'),
     url(r'^visits/(?P<pk>[0-9]+)/$', views.VisitDetail.as_view(), name='visit-detail'),
 
+    url(r'^discussions/$', views.DiscussionList.as_view(), name='discussion-list'),
+    url(r'^discussions/(?P<pk>\d+)/$', views.DiscussionDetail.as_view(), name='discussion-detail'),
+    url(r'^discussions/(?P<pk>\d+)/messages/$', views.DiscussionMessageList.as_view(),
+        name='discussionmessage-list'),
+    url(r'^discussions/(?P<pk>\d+)/messages/poll/$', views.discussion_message_poll,
+        name='discussionmessage-poll'),
+
     url(r'^users/$', views.UserList.as_view(), name='user-list'),
     url(r'^users/(?P<pk>[0-9]+)/$', views.UserDetail.as_view(), name='user-detail'),
     # url(r'^profiles/$', views.UserProfileList.as_view(), name='userprofile-list'),
@@ -1,19 +1,46 @@
 import logging
+import math
+
+from asgiref.sync import sync_to_async
 
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max, Prefetch, Q
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from rest_framework import generics, views
+from rest_framework.authtoken import views as authtoken_views
+from rest_framework.authtoken.models import Token
 from rest_framework import permissions
+from rest_framework import serializers
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.decorators import api_view
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
 from rest_framework.parsers import FileUploadParser
 
-from .models import Profile, Tag, Post, Photo, Visit
+from . import feed, geo, search, uploads, visits
+from .models import Profile, Tag, Post, Photo, Visit, Upload, Discussion, DiscussionMessage
 from .serializers import TagSerializer, PostSerializer, PhotoSerializer, VisitSerializer
-from .serializers import UserSerializer, ProfileSerializer
+from .serializers import UserSerializer, ProfileSerializer, get_expand
+from .serializers import UploadSerializer, UploadCompleteSerializer
+from .serializers import VisitBatchItemSerializer
+from .serializers import DiscussionSerializer, DiscussionMessageSerializer
 from .permissions import IsOwnerOrReadOnly, IsThisUserOrReadOnly
+from .authentication import is_expired
+from .cache import CachedResponseMixin
+from .conditional import ConditionalRetrieveMixin, ConditionalListMixin
+from .tagindex import tag_index
+from .throttling import TokenBucketThrottle
+from .pubsub import hub, discussion_channel
+from .visitbuffer import get_visit_buffer
+from .pagination import PostPagination, HotPostPagination, VisitPagination, UserPagination
+from .pagination import DiscussionPagination, SincePagination, SearchPagination, FeedPagination
 
 
 logger = logging.getLogger('luke')
@@ -38,8 +65,11 @@ def api_root(request, format=None):
         'users': reverse('user-list', request=request, format=format),
         'tags': reverse('tag-list', request=request, format=format),
         'posts': reverse('post-list', request=request, format=format),
+        'hot posts': reverse('post-hot-list', request=request, format=format),
+        'feed': reverse('feed', request=request, format=format),
         'photos': reverse('photo-list', request=request, format=format),
-        'visits': reverse('visit-list', request=request, format=format)
+        'visits': reverse('visit-list', request=request, format=format),
+        'discussions': reverse('discussion-list', request=request, format=format)
     })
 
 
@@ -60,8 +90,12 @@ class UserList(generics.ListCreateAPIView):
     TODO: User creation should be restricted.
     """
 
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('profile')
     serializer_class = UserSerializer
+    pagination_class = UserPagination
+
+    # Sign up is throttled per IP, see throttling.py.
+    throttle_scope = 'signup'
 
     def get_permissions(self):
         """
@@ -90,7 +124,7 @@ class UserDetail(generics.RetrieveUpdateDestroyAPIView):
         $ http -a <admin>:<pw> DELETE http://127.0.0.1:8000/users/2/
     """
 
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('profile')
     serializer_class = UserSerializer
 
     def get_permissions(self):
@@ -105,6 +139,34 @@ class UserDetail(generics.RetrieveUpdateDestroyAPIView):
         serializer.save(user=self.request.user)
 
 
+class ObtainAuthToken(authtoken_views.ObtainAuthToken):
+    """
+    Obtain the token of a user, a new one if it has expired:
+        $ http POST :8000/api-token-auth/ username=adam password=123456
+    See authentication.py.
+    """
+
+    # Throttled per IP, it hashes the password.
+    throttle_classes = (TokenBucketThrottle,)
+    throttle_scope = 'login'
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+
+        token, created = Token.objects.get_or_create(user=user)
+        if not created and is_expired(token):
+            with transaction.atomic():
+                token.delete()
+                # Or the new token of a concurrent login.
+                token, _ = Token.objects.get_or_create(user=user)
+        return Response({'token': token.key})
+
+
+obtain_auth_token = ObtainAuthToken.as_view()
+
+
 # class UserProfileList(generics.ListCreateAPIView):
 #
 #     queryset = Profile.objects.all()
@@ -146,7 +208,7 @@ class UserDetail(generics.RetrieveUpdateDestroyAPIView):
 ################################################################################
 
 
-class TagList(generics.ListCreateAPIView):
+class TagList(CachedResponseMixin, generics.ListCreateAPIView):
     """
     List all tags, or create a new tag.
     """
@@ -157,8 +219,38 @@ class TagList(generics.ListCreateAPIView):
     # Any authenticated user can create new tags.
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def get_cache_tags(self):
+        return ['tags']
+
+
+class TagComplete(views.APIView):
+    """
+    Complete a tag name by prefix, the most used tags first.
+    Served from the in-memory index of this process, see tagindex.py.
 
-class TagDetail(generics.RetrieveAPIView):
+        $ http :8000/tags/complete/ q==sh limit==5
+    """
+
+    permission_classes = (permissions.AllowAny,)
+
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, format=None):
+        prefix = request.query_params.get('q', '')
+
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)),
+                        self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+
+        tags = tag_index.complete(prefix, limit=max(limit, 0))
+        return Response([{'id': tag_id, 'name': name, 'post_count': count}
+                         for tag_id, name, count in tags])
+
+
+class TagDetail(CachedResponseMixin, generics.RetrieveAPIView):
     """
     Retrieve a tag.
     No need to update or destroy a tag.
@@ -169,19 +261,45 @@ class TagDetail(generics.RetrieveAPIView):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
+    def get_cache_tags(self):
+        return ['tag:{}'.format(self.kwargs['pk'])]
+
 
 ################################################################################
 # Post Views
 ################################################################################
 
 
-class PostList(generics.ListCreateAPIView):
+class PostExpandMixin(object):
+    """
+    Prefetch the related objects expanded by the request, so that a page of
+    posts takes a fixed number of queries.
+    E.g.,
+        $ http :8000/posts/?expand=photos,tags,user.profile
+    """
+
+    def get_queryset(self):
+        queryset = super(PostExpandMixin, self).get_queryset()
+
+        expand = get_expand(self.request)
+        if 'photos' in expand:
+            photos = Photo.objects.order_by('order', 'id')
+            queryset = queryset.prefetch_related(Prefetch('photos', queryset=photos))
+        if 'user.profile' in expand:
+            queryset = queryset.select_related('user__profile')
+
+        return queryset
+
+
+class PostList(ConditionalListMixin, PostExpandMixin, generics.ListCreateAPIView):
     """
     List all posts, or create a new post.
     """
 
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
     serializer_class = PostSerializer
+    pagination_class = PostPagination
+    throttle_scope = 'posts'
 
     # TODO: Remove IsOwnerOrReadOnly
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
@@ -191,19 +309,154 @@ class PostList(generics.ListCreateAPIView):
         serializer.save(user=self.request.user)
 
 
-class PostDetail(generics.RetrieveUpdateDestroyAPIView):
+class PostHotList(ConditionalListMixin, PostExpandMixin, generics.ListAPIView):
+    """
+    List the hottest posts.
+    Posts with more likes keep being pushed while disliked ones sink, see
+    ranking.hot_score() for the details.
+    """
+
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
+    serializer_class = PostSerializer
+    pagination_class = HotPostPagination
+
+
+class NearbyQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of PostNearbyList.
+    """
+
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+
+    # In meters.
+    radius = serializers.FloatField(min_value=1, max_value=50000, default=1000)
+
+
+class PostNearbyList(PostExpandMixin, generics.GenericAPIView):
+    """
+    List the posts within radius (in meters, 1000 by default) of a place,
+    the nearest first.
+
+        $ http :8000/posts/nearby/ lat==31.23 lng==121.47 radius==500
+
+    Candidates are looked up by the geohash cells around the place, then
+    filtered by the exact distance, see geo.py.
+    """
+
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
+    serializer_class = PostSerializer
+
+    # Only the nearest posts are listed.
+    limit = 50
+
+    def get(self, request, format=None):
+        params = NearbyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        lat, lng, radius = (params.validated_data[name] for name in ('lat', 'lng', 'radius'))
+
+        precision = geo.precision_for(radius, lat)
+        cells = Q()
+        for cell in geo.neighbors(lat, lng, precision):
+            start, stop = geo.prefix_range(cell)
+            cells |= Q(geohash__gte=start, geohash__lt=stop)
+
+        # Locate the candidates first, only the nearest posts are loaded.
+        candidates = (Post.objects.filter(cells)
+                      .exclude(geohash='')
+                      .values_list('id', 'latitude', 'longitude'))
+
+        distances = {}
+        for post_id, post_lat, post_lng in candidates:
+            distance = geo.haversine(lat, lng, post_lat, post_lng)
+            if distance <= radius:
+                distances[post_id] = distance
+
+        nearest = sorted(distances, key=distances.get)[:self.limit]
+        posts = self.get_queryset().in_bulk(nearest)
+
+        serializer = self.get_serializer([posts[pk] for pk in nearest], many=True)
+        data = serializer.data
+        for item in data:
+            item['distance'] = round(distances[item['id']], 1)
+
+        return Response(data)
+
+
+class PostSearch(PostExpandMixin, generics.GenericAPIView):
+    """
+    Search posts by content, the best matches first.
+
+        $ http :8000/posts/search/ q==深圳 limit==10 offset==10
+
+    Served by the full-text index, see search.py.
+    """
+
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
+    serializer_class = PostSerializer
+    pagination_class = SearchPagination
+
+    # Only so many best matches can be paged through.
+    max_results = 1000
+
+    def get(self, request, format=None):
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            raise ValidationError({'q': 'This query parameter is required.'})
+
+        ids = self.paginate_queryset(search.search(q, limit=self.max_results))
+        posts = self.get_queryset().in_bulk(ids)
+
+        # A post may be deleted since it was found.
+        serializer = self.get_serializer([posts[pk] for pk in ids if pk in posts], many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class Feed(PostExpandMixin, generics.GenericAPIView):
+    """
+    The posts for the current user, by the modes and tags of the posts the
+    user liked, without the posts the user visited.
+
+        $ http -a <name>:<pw> :8000/feed/ limit==10 offset==10
+
+    The ranking is kept for a few minutes so the pages are stable, pass
+    refresh=1 to rank again. See feed.py.
+    """
+
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
+    serializer_class = PostSerializer
+    pagination_class = FeedPagination
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, format=None):
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        ids = self.paginate_queryset(feed.get_feed(request.user, refresh=refresh))
+        posts = self.get_queryset().in_bulk(ids)
+
+        serializer = self.get_serializer([posts[pk] for pk in ids if pk in posts], many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class PostDetail(CachedResponseMixin, ConditionalRetrieveMixin, PostExpandMixin,
+                 generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a post.
     """
 
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
     serializer_class = PostSerializer
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
 
+    def get_cache_tags(self):
+        # NOTE: The profile of an expanded user is not invalidated, it's
+        # bounded by the cache timeout.
+        return ['post:{}'.format(self.kwargs['pk'])]
 
-class PostPhotoList(generics.ListAPIView):
+
+class PostPhotoList(CachedResponseMixin, generics.ListAPIView):
     """
     List the photos of a post.
     """
@@ -216,6 +469,9 @@ class PostPhotoList(generics.ListAPIView):
         queryset = super(PostPhotoList, self).get_queryset()
         return queryset.filter(post__pk=self.kwargs.get('pk'))
 
+    def get_cache_tags(self):
+        return ['post:{}'.format(self.kwargs['pk'])]
+
 
 # TODO
 class PostTagList(generics.ListAPIView):
@@ -236,11 +492,14 @@ class PostTagList(generics.ListAPIView):
 class PhotoList(generics.ListCreateAPIView):
     """
     Create/upload a photo:
-    $ http -a username:password -f POST :8000/photos/ image@~/test.jpg
+    $ http -a username:password -f POST :8000/photos/ post=<post url> image@~/test.jpg
+    The photo is stored as is and returned in Pending state, its variants are
+    made by the process_photos command.
     """
 
     queryset = Photo.objects.all()
     serializer_class = PhotoSerializer
+    throttle_scope = 'photos'
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
@@ -290,6 +549,96 @@ class PhotoDetail(generics.RetrieveDestroyAPIView):
 #         return Response(status=204)
 
 
+################################################################################
+# Upload Views
+################################################################################
+
+
+class UploadList(generics.ListCreateAPIView):
+    """
+    List my uploads in progress, or start a new upload.
+    See uploads.py for the protocol.
+    """
+
+    serializer_class = UploadSerializer
+    # A chunked photo takes a token when started and when completed.
+    throttle_scope = 'photos'
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Upload.objects.filter(user=self.request.user).order_by('create_time')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class UploadDetail(generics.RetrieveDestroyAPIView):
+    """
+    Retrieve the offset of an upload, send a chunk of it, or cancel it.
+
+    Send a chunk (the raw bytes as body):
+        $ http -a <name>:<pw> PUT :8000/uploads/<id>/ Upload-Offset:<offset> < chunk
+    """
+
+    serializer_class = UploadSerializer
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Upload.objects.filter(user=self.request.user)
+
+    def put(self, request, *args, **kwargs):
+        upload = self.get_object()
+
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+        except ValueError:
+            raise ValidationError({'Upload-Offset': 'This header is required.'})
+
+        # NOTE: Never touch request.data, the body is streamed.
+        try:
+            uploads.append_chunk(upload, request.stream, offset)
+        except uploads.OffsetMismatch as e:
+            return Response({'detail': str(e), 'offset': e.offset},
+                            status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': str(e)})
+
+        return Response(self.get_serializer(upload).data)
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+
+
+class UploadComplete(generics.GenericAPIView):
+    """
+    Complete an upload as a photo of a post.
+    """
+
+    serializer_class = UploadCompleteSerializer
+    throttle_scope = 'photos'
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Upload.objects.filter(user=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        upload = self.get_object()
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            photo = uploads.complete(upload, **serializer.validated_data)
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': str(e)})
+
+        data = PhotoSerializer(photo, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
 ################################################################################
 # Visit Views
 ################################################################################
@@ -300,14 +649,79 @@ class VisitList(generics.ListCreateAPIView):
     List visits or create a new visit.
     """
 
-    queryset = Visit.objects.all()
+    queryset = Visit.objects.select_related('user')
     serializer_class = VisitSerializer
+    pagination_class = VisitPagination
+    throttle_scope = 'visits'
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # A "seen" visit may be buffered, see visitbuffer.py.
+        buffer = get_visit_buffer()
+        if buffer is not None and serializer.validated_data.get('state', 0) == 0:
+            buffer.add(request.user.pk, serializer.validated_data['post'].pk)
+            data = {'user': request.user.username,
+                    'post': serializer.initial_data.get('post'),
+                    'state': 0}
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # Upsert, see visits.py.
+        post = serializer.validated_data['post']
+        state = serializer.validated_data.get('state', 0)
+        visits.record_visits(self.request.user, [(post.pk, state)])
+
+        serializer.instance = self.get_queryset().get(user=self.request.user, post=post)
+
+
+class VisitBatch(generics.GenericAPIView):
+    """
+    Record visits of many posts at once, e.g., the impressions of a page of
+    the feed:
+        $ http -a <name>:<pw> POST :8000/visits/batch/ <<< '[{"post": 1}, {"post": 2, "state": 1}]'
+    A "seen" (state 0) never overrides a like or dislike, see visits.py.
+    """
+
+    serializer_class = VisitBatchItemSerializer
+    # A batch takes a token, as a single visit does.
+    throttle_scope = 'visits'
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    max_entries = 500
+
+    def post(self, request, format=None):
+        # The length is checked before the entries are validated.
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.max_entries)
+        serializer.is_valid(raise_exception=True)
+
+        entries = [(item['post'], item['state']) for item in serializer.validated_data]
+
+        # "Seen" visits may be buffered, see visitbuffer.py.
+        buffered = 0
+        buffer = get_visit_buffer()
+        if buffer is not None:
+            for post_id, state in entries:
+                if state == 0:
+                    buffer.add(request.user.pk, post_id)
+                    buffered += 1
+            entries = [(post_id, state) for post_id, state in entries if state != 0]
+
+        try:
+            created, updated = visits.record_visits(request.user, entries)
+        except visits.UnknownPosts as e:
+            raise ValidationError({'post': str(e)})
+
+        return Response({'created': created, 'updated': updated, 'buffered': buffered})
 
 
 class VisitDetail(generics.RetrieveUpdateDestroyAPIView):
@@ -315,8 +729,180 @@ class VisitDetail(generics.RetrieveUpdateDestroyAPIView):
     Retrieve, update or delete a visit.
     """
 
-    queryset = Visit.objects.all()
+    queryset = Visit.objects.select_related('user')
     serializer_class = VisitSerializer
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
+
+    def perform_update(self, serializer):
+        old_likes, old_dislikes = Visit.VOTES[serializer.instance.state]
+        with transaction.atomic():
+            visit = serializer.save()
+            likes, dislikes = Visit.VOTES[visit.state]
+            Post.objects.update_counters(visit.post_id,
+                                         likes=likes - old_likes,
+                                         dislikes=dislikes - old_dislikes)
+
+    def perform_destroy(self, instance):
+        likes, dislikes = Visit.VOTES[instance.state]
+        with transaction.atomic():
+            instance.delete()
+            Post.objects.update_counters(instance.post_id, likes=-likes,
+                                         dislikes=-dislikes, visits=-1)
+
+
+################################################################################
+# Discussion Views
+################################################################################
+
+
+class DiscussionList(generics.ListCreateAPIView):
+    """
+    List the active discussions, the most recently active first, or start a
+    new discussion.
+    """
+
+    serializer_class = DiscussionSerializer
+    pagination_class = DiscussionPagination
+    throttle_scope = 'discussions'
+
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get_queryset(self):
+        return Discussion.objects.active().select_related('user')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class DiscussionDetail(generics.RetrieveAPIView):
+    """
+    Retrieve an active discussion.
+    """
+
+    serializer_class = DiscussionSerializer
+
+    def get_queryset(self):
+        return Discussion.objects.active().select_related('user')
+
+
+class DiscussionMessageList(generics.ListCreateAPIView):
+    """
+    List the messages of an active discussion incrementally, or say something.
+        $ http :8000/discussions/<pk>/messages/?since=<id of the last message>
+        $ http -a <name>:<pw> POST :8000/discussions/<pk>/messages/ content=Hi
+    """
+
+    serializer_class = DiscussionMessageSerializer
+    pagination_class = SincePagination
+    throttle_scope = 'messages'
+
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get_queryset(self):
+        discussion = get_object_or_404(Discussion.objects.active(), pk=self.kwargs['pk'])
+        return discussion.messages.select_related('user')
+
+    def perform_create(self, serializer):
+        pk = self.kwargs['pk']
+        now = timezone.now()
+
+        # Extend the discussion only if it's still active, the row lock taken
+        # by the update keeps expire_discussions away until the message is in.
+        with transaction.atomic():
+            if not Discussion.objects.active(now).filter(pk=pk).update(last_activity=now):
+                raise NotFound()
+            serializer.save(user=self.request.user, discussion_id=pk)
+
+
+################################################################################
+# Long Poll Views
+################################################################################
+
+# NOTE: These are async views, serve them by ASGI (see mysite/asgi.py), where
+# a waiting poll costs a coroutine instead of a worker. Under WSGI they work
+# but hold a worker for the whole wait.
+
+POLL_TIMEOUT = 25
+MAX_POLL_TIMEOUT = 60
+POLL_PAGE_SIZE = 100
+
+
+def _poll_params(request):
+    """
+    Return (since, timeout) of the query, since is None if not given.
+    """
+    since = request.GET.get('since')
+    since = int(since) if since is not None else None
+    if since is not None and since < 0:
+        raise ValueError
+    timeout = float(request.GET.get('timeout', POLL_TIMEOUT))
+    if not math.isfinite(timeout):
+        raise ValueError
+    return since, min(max(timeout, 0), MAX_POLL_TIMEOUT)
+
+
+async def _long_poll(request, channel, queryset, serializer_class):
+    """
+    Wait until there are rows after the since cursor (an id) in the channel
+    (see pubsub.py), respond with them (at most a page, oldest first) and
+    the cursor for the next poll:
+        {"since": 42, "results": [...]}
+    On timeout the results are empty. Without since, respond at once with
+    the cursor of the latest row.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        since, timeout = _poll_params(request)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid since or timeout.')
+
+    # Rows saved by other processes are seen by the lookups.
+    lookup = sync_to_async(lambda: queryset.aggregate(latest=Max('pk'))['latest'] or 0)
+
+    latest = hub.latest(channel)
+    if latest is None:
+        latest = await lookup()
+        hub.seed(channel, latest)
+
+    if since is None:
+        return JsonResponse({'since': latest, 'results': []})
+
+    if latest <= since and await hub.wait(channel, since, timeout, lookup) is None:
+        return JsonResponse({'since': since, 'results': []})
+
+    def render():
+        rows = list(queryset.filter(pk__gt=since).order_by('pk')[:POLL_PAGE_SIZE])
+        context = {'request': Request(request)}
+        return {'since': rows[-1].pk if rows else since,
+                'results': serializer_class(rows, many=True, context=context).data}
+
+    return JsonResponse(await sync_to_async(render)())
+
+
+async def post_poll(request, format=None):
+    """
+    Long poll for new posts:
+        $ http :8000/posts/poll/
+        {"since": 42, "results": []}
+        $ http :8000/posts/poll/?since=42&timeout=25
+    """
+    queryset = Post.objects.select_related('user').prefetch_related('tags')
+    return await _long_poll(request, 'posts', queryset, PostSerializer)
+
+
+async def discussion_message_poll(request, pk, format=None):
+    """
+    Long poll for new messages of an active discussion, like post_poll.
+    """
+    channel = discussion_channel(pk)
+    if hub.latest(channel) is None:
+        exists = await sync_to_async(Discussion.objects.active().filter(pk=pk).exists)()
+        if not exists:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    queryset = DiscussionMessage.objects.filter(discussion_id=pk).select_related('user')
+    return await _long_poll(request, channel, queryset, DiscussionMessageSerializer)
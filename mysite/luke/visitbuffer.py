@@ -0,0 +1,185 @@
+"""
+Write-behind buffer of "seen" visits.
+
+Most visits are plain impressions (state 0), writing each of them in the
+request path makes the requests fight over the write lock of SQLite. When
+settings.LUKE_VISIT_BUFFER is set, they are collected in a per-process
+buffer and flushed by bulk queries (see visits.record_visits_bulk()) when
+the buffer has MAX_SIZE visits or its oldest visit is MAX_AGE seconds old
+(by a daemon thread of the buffer if no other visit comes), and when the
+process exits. Under uWSGI, the thread needs --enable-threads.
+
+Likes and dislikes are always written synchronously.
+
+The visits of a failed flush (e.g., "database is locked") are put back and
+retried by the next flush, up to MAX_PENDING visits, the rest are dropped.
+
+NOTE: The buffered visits of a killed process (e.g., SIGKILL) are lost,
+which is acceptable for impressions.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .visits import record_visits_bulk
+
+
+logger = logging.getLogger('luke')
+
+
+class VisitBuffer(object):
+
+    def __init__(self, max_size=500, max_age=5.0, max_pending=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        # Bound of the visits kept while flushes fail.
+        self.max_pending = max_pending or max_size * 10
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # (user id, post id), deduplicated.
+        self._visits = set()
+        self._first_time = None
+
+        # Set while there are visits, see _run().
+        self._pending = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._visits)
+
+    def add(self, user_id, post_id):
+        with self._lock:
+            if not self._visits:
+                self._first_time = time.monotonic()
+                self._pending.set()
+                self._start_thread()
+            self._visits.add((user_id, post_id))
+
+            full = (len(self._visits) >= self.max_size
+                    or time.monotonic() - self._first_time >= self.max_age)
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered visits, return the number of the created ones.
+        """
+        # One flush at a time, the others don't wait.
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+
+        try:
+            with self._lock:
+                visits, self._visits = self._visits, set()
+                self._first_time = None
+                self._pending.clear()
+
+            if not visits:
+                return 0
+
+            created, _ = record_visits_bulk(
+                ((user_id, post_id, 0) for user_id, post_id in visits),
+                ignore_unknown=True)
+            return created
+        except Exception:
+            logger.exception('Failed to flush %d visits', len(visits))
+            self._requeue(visits)
+            return 0
+        finally:
+            self._flush_lock.release()
+
+    def _requeue(self, visits):
+        """
+        Put back the visits of a failed flush, up to max_pending.
+        """
+        with self._lock:
+            visits = visits - self._visits
+            room = max(self.max_pending - len(self._visits), 0)
+            if len(visits) > room:
+                logger.error('Dropped %d visits, the buffer is full', len(visits) - room)
+                visits = set(list(visits)[:room])
+            if not visits:
+                return
+            if not self._visits:
+                # Retried max_age seconds later, or by the next add() when full.
+                self._first_time = time.monotonic()
+                self._pending.set()
+                self._start_thread()
+            self._visits |= visits
+
+    def _start_thread(self):
+        # Under self._lock.
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='visit-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """
+        Flush the visits max_age seconds after the first one, whether more
+        visits come or not.
+        """
+        while True:
+            self._pending.wait()
+            with self._lock:
+                first_time = self._first_time
+            if first_time is not None:
+                time.sleep(max(first_time + self.max_age - time.monotonic(), 0))
+                # Flushed by add() in the meantime if _first_time changed.
+                with self._lock:
+                    due = self._first_time == first_time
+                if due:
+                    self.flush()
+                    # The connections of this thread aren't closed by requests.
+                    connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_visit_buffer():
+    """
+    Return the buffer of this process, or None if write-behind is disabled.
+    """
+    global _buffer
+
+    options = getattr(settings, 'LUKE_VISIT_BUFFER', None)
+    if not options:
+        return None
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VisitBuffer(max_size=options.get('MAX_SIZE', 500),
+                                      max_age=options.get('MAX_AGE', 5.0),
+                                      max_pending=options.get('MAX_PENDING'))
+                _install_exit_hooks(_buffer)
+
+    return _buffer
+
+
+def _install_exit_hooks(buffer):
+    atexit.register(buffer.flush)
+
+    # uWSGI workers may not run atexit handlers.
+    try:
+        import uwsgi
+    except ImportError:
+        return
+
+    previous = getattr(uwsgi, 'atexit', None)
+
+    def flush():
+        buffer.flush()
+        if previous is not None:
+            previous()
+
+    uwsgi.atexit = flush
@@ -0,0 +1,214 @@
+"""
+Recording visits of posts in bulk.
+
+A user has at most one visit per post (see the constraint of Visit), so
+recording a visit is an upsert:
+- a new visit is inserted and counted;
+- an existing visit takes the new state if it is a like or dislike. A plain
+  "seen" (state 0) never overrides a like or dislike, it's just another
+  impression of the post. Use VisitDetail to undo a like or dislike.
+
+The visits are written by bulk queries and the counters of the posts are
+updated by PostManager.update_counters_bulk(), so a page of impressions
+costs a fixed number of queries.
+
+The new visits are also added to the "seen" Bloom filters of the users, see
+get_seen_filter().
+"""
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .bloom import ScalableBloomFilter
+from .cache import invalidate_on_commit
+from .models import Post, Visit, SeenFilter
+
+
+class UnknownPosts(ValueError):
+    def __init__(self, post_ids):
+        super(UnknownPosts, self).__init__(
+            'Unknown posts: {}'.format(', '.join(str(pk) for pk in sorted(post_ids))))
+        self.post_ids = post_ids
+
+
+def merge_entries(entries):
+    """
+    Merge the entries of the same post, the last like or dislike wins.
+    :param entries: Iterable of (post id, state).
+    :return: Post id -> state.
+    """
+    states = {}
+    for post_id, state in entries:
+        if state or post_id not in states:
+            states[post_id] = state
+    return states
+
+
+def record_visits(user, entries):
+    """
+    Upsert the visits of the user in one transaction.
+    :param entries: Iterable of (post id, state).
+    :return: Number of the created and the updated visits.
+    """
+    return record_visits_bulk((user.pk, post_id, state) for post_id, state in entries)
+
+
+def record_visits_bulk(entries, ignore_unknown=False):
+    """
+    Upsert the visits of any users in one transaction.
+    :param entries: Iterable of (user id, post id, state).
+    :param ignore_unknown: Skip the visits of unknown (e.g., deleted) posts
+        instead of raising UnknownPosts.
+    :return: Number of the created and the updated visits.
+    """
+    states = merge_entries(((user_id, post_id), state)
+                           for user_id, post_id, state in entries)
+    if not states:
+        return 0, 0
+
+    try:
+        return _record_visits(states, ignore_unknown)
+    except IntegrityError:
+        # A concurrent request inserted some of the visits, now they exist.
+        return _record_visits(states, ignore_unknown)
+
+
+def _record_visits(states, ignore_unknown):
+    """
+    :param states: (user id, post id) -> state.
+    """
+    user_ids = set(user_id for user_id, _ in states)
+    post_ids = set(post_id for _, post_id in states)
+
+    with transaction.atomic():
+        known = set(Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True))
+        unknown = post_ids - known
+        if unknown:
+            if not ignore_unknown:
+                raise UnknownPosts(unknown)
+            states = {key: state for key, state in states.items() if key[1] in known}
+
+        # A superset of the visits for many users, filtered by the keys.
+        existing = {}
+        rows = (Visit.objects.select_for_update()
+                .filter(user_id__in=user_ids, post_id__in=known))
+        for visit in rows:
+            existing[(visit.user_id, visit.post_id)] = visit
+
+        created = []
+        updated = []
+        deltas = {}
+
+        def add_delta(post_id, likes, dislikes, visits):
+            old = deltas.get(post_id, (0, 0, 0))
+            deltas[post_id] = (old[0] + likes, old[1] + dislikes, old[2] + visits)
+
+        for (user_id, post_id), state in states.items():
+            visit = existing.get((user_id, post_id))
+            likes, dislikes = Visit.VOTES[state]
+
+            if visit is None:
+                created.append(Visit(user_id=user_id, post_id=post_id, state=state))
+                add_delta(post_id, likes, dislikes, 1)
+            elif state and state != visit.state:
+                old_likes, old_dislikes = Visit.VOTES[visit.state]
+                visit.state = state
+                updated.append(visit)
+                add_delta(post_id, likes - old_likes, dislikes - old_dislikes, 0)
+
+        # NOTE: Bulk queries send no signals.
+        Visit.objects.bulk_create(created)
+        update_seen_filters((visit.user_id, visit.post_id) for visit in created)
+        if updated:
+            Visit.objects.bulk_update(updated, ['state'])
+
+        Post.objects.update_counters_bulk(deltas)
+
+        if deltas:
+            invalidate_on_commit(*['post:{}'.format(pk) for pk in deltas])
+
+    return len(created), len(updated)
+
+
+################################################################################
+# Seen Filters
+################################################################################
+
+
+def get_seen_filter(user):
+    """
+    Return the Bloom filter of the posts the user has visited. It's built
+    from the visits of the user the first time.
+    NOTE: A false positive hides a post the user has not seen, at the rate
+    of ScalableBloomFilter.error_rate.
+    """
+    row = SeenFilter.objects.filter(user=user).first()
+    if row is not None and row.data:
+        return ScalableBloomFilter.from_bytes(row.data)
+
+    # The visits are read under the lock of the row, which the transactions
+    # recording visits of the user also take (see update_seen_filters()), so
+    # a visit is either committed before or added to the built filter after.
+    with transaction.atomic():
+        ensure_seen_filters([user.pk])
+        row = SeenFilter.objects.select_for_update().get(user=user)
+        if row.data:
+            # Built by a concurrent request.
+            return ScalableBloomFilter.from_bytes(row.data)
+
+        seen = ScalableBloomFilter()
+        seen.update(Visit.objects.filter(user=user).values_list('post_id', flat=True).iterator())
+        row.data = seen.to_bytes()
+        row.save(update_fields=['data', 'update_time'])
+    return seen
+
+
+def ensure_seen_filters(user_ids):
+    """
+    Create the missing rows of the users, with empty data until the filters
+    are built.
+    """
+    SeenFilter.objects.bulk_create([SeenFilter(user_id=user_id, data=b'') for user_id in user_ids],
+                                   ignore_conflicts=True)
+
+
+def update_seen_filters(visits):
+    """
+    Add the new visits to the built filters of the users, the other filters
+    are built on first use.
+    :param visits: Iterable of (user id, post id).
+    """
+    post_ids = {}
+    for user_id, post_id in visits:
+        post_ids.setdefault(user_id, []).append(post_id)
+    if not post_ids:
+        return
+
+    # NOTE: The rows are locked until the end of the transaction, concurrent
+    # visits of a user wait rather than overwrite the bits of each other, and
+    # a filter built concurrently waits for the visits to be committed. The
+    # missing rows are created for that. (SQLite has no row locks, it
+    # serializes the write transactions.)
+    # NOTE: A change rewrites the whole filter, about 2.9 bytes per visit of
+    # the user (see bench_bloom), e.g., 284 KiB at 100k visits. Buffered
+    # visits (see visitbuffer.py) share the writes. Rows per slice would
+    # bound a write by the last slice.
+    with transaction.atomic():
+        ensure_seen_filters(post_ids)
+        rows = list(SeenFilter.objects.select_for_update().filter(user_id__in=post_ids))
+        now = timezone.now()
+        changed = []
+        for row in rows:
+            if not row.data:
+                # Not built yet.
+                continue
+            seen = ScalableBloomFilter.from_bytes(row.data)
+            # E.g., seen again after the visit was deleted.
+            if not seen.update(post_ids[row.user_id]):
+                continue
+            row.data = seen.to_bytes()
+            # Not set by bulk_update().
+            row.update_time = now
+            changed.append(row)
+        if changed:
+            SeenFilter.objects.bulk_update(changed, ['data', 'update_time'])
@@ -0,0 +1,21 @@
+"""
+ASGI config for mysite project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the long-poll endpoints and the read-heavy endpoints (which are
+routed to their async views, see luke/asyncviews.py) by it, e.g.,
+    $ pip install uvicorn
+    $ uvicorn mysite.asgi:application --port 8001
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+os.environ.setdefault("LUKE_ASYNC_VIEWS", "1")
+
+application = get_asgi_application()
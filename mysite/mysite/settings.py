@@ -21,6 +21,9 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Required by FileField and ImageField.
 MEDIA_ROOT = "/var/www/mysite/media/"
 
+# URL that handles the media served from MEDIA_ROOT (see mysite_nginx.conf).
+MEDIA_URL = "/media/"
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.11/howto/deployment/checklist/
 
@@ -60,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'luke.routers.ReplicaReadMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -82,25 +86,121 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
+# For the long-poll endpoints, see mysite/asgi.py.
+ASGI_APPLICATION = 'mysite.asgi.application'
+
+# Route the read-heavy endpoints to their async views, see luke/asyncviews.py.
+# Set by mysite/asgi.py, async views are slower under WSGI.
+LUKE_ASYNC_VIEWS = os.environ.get('LUKE_ASYNC_VIEWS') == '1'
+# Run the reads of the async views in the thread shared by the sync code
+# rather than in the thread pool, e.g., for tests in a transaction.
+LUKE_ASYNC_THREAD_SENSITIVE = False
+
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
-DATABASES = {
+# Sqlite3 by default. For production, set LUKE_DB_ENGINE=postgresql and:
+#   LUKE_DB_NAME, LUKE_DB_USER, LUKE_DB_PASSWORD, LUKE_DB_HOST, LUKE_DB_PORT
+# Optionally a read replica (see luke/routers.py):
+#   LUKE_DB_REPLICA_HOST, LUKE_DB_REPLICA_PORT
+# Connections are kept for LUKE_DB_CONN_MAX_AGE seconds (60 by default) and
+# checked before reuse (see luke/dbhealth.py).
+#   $ pip install psycopg2
+
+if os.environ.get('LUKE_DB_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('LUKE_DB_NAME', 'mysite'),
+            'USER': os.environ.get('LUKE_DB_USER', ''),
+            'PASSWORD': os.environ.get('LUKE_DB_PASSWORD', ''),
+            'HOST': os.environ.get('LUKE_DB_HOST', ''),  # Leave empty for connecting using UNIX domain sockets.
+            'PORT': os.environ.get('LUKE_DB_PORT', ''),
+            # Persistent connections, instead of one per request.
+            'CONN_MAX_AGE': int(os.environ.get('LUKE_DB_CONN_MAX_AGE', 60)),
+            # Check persistent connections before reuse, by Django 4.1+ or
+            # by luke/dbhealth.py.
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+
+# The replica, the primary itself unless LUKE_DB_REPLICA_HOST is set. The
+# reads are only sent to it with LUKE_DB_READ_REPLICA (and by the tests of
+# luke/routers.py).
+DATABASES['replica'] = dict(
+    DATABASES['default'],
+    HOST=os.environ.get('LUKE_DB_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+    PORT=os.environ.get('LUKE_DB_REPLICA_PORT', DATABASES['default'].get('PORT', '')),
+    # Tests see the replica as the primary.
+    TEST={'MIRROR': 'default'},
+)
+LUKE_DB_READ_REPLICA = bool(os.environ.get('LUKE_DB_REPLICA_HOST'))
+
+# Apply WAL mode and other pragmas to SQLite connections, see luke/sqlite.py.
+# Benchmark with:
+#   $ python3 manage.py bench_sqlite
+LUKE_SQLITE_TUNING = os.environ.get('LUKE_SQLITE_TUNING') == '1'
+
+# Send the reads of GET requests to the replica, if any.
+DATABASE_ROUTERS = ['luke.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Used by the response cache of luke (see luke/cache.py).
+# The local-memory cache is per process, switch to the file-based cache to
+# share it between the worker processes:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': '/var/tmp/mysite_cache',
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'luke',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
-    # 'default': {
-    #     'ENGINE': 'django.db.backends.postgresql',
-    #     'NAME': 'mysite',
-    #     'USER': 'adam',
-    #     'PASSWORD': '123456',
-    #     'HOST': '',  # Leave empty for connecting using UNIX domain sockets.
-    #     'PORT': ''
-    # }
 }
 
+# Used by the state which must be shared by the worker processes: the token
+# buckets of the throttles (see luke/throttling.py) and the cached tokens (see
+# luke/authentication.py). Set LUKE_MEMCACHED to
+# the address of memcached (e.g., 127.0.0.1:11211, needs pymemcache).
+# Otherwise it's per process, N workers allow N times the throttle rates and
+# a revoked token is accepted by the other workers until its cache timeout.
+if os.environ.get('LUKE_MEMCACHED'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.environ['LUKE_MEMCACHED'],
+    }
+else:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'luke-shared',
+    }
+
+LUKE_THROTTLE_CACHE = 'shared'
+LUKE_TOKEN_CACHE = 'shared'
+
+
+# Write-behind buffer of "seen" visits, see luke/visitbuffer.py.
+# None to write every visit synchronously.
+LUKE_VISIT_BUFFER = None
+# LUKE_VISIT_BUFFER = {
+#     'MAX_SIZE': 500,  # Flush when the buffer has so many visits,
+#     'MAX_AGE': 5,     # or its oldest visit is so many seconds old.
+#     'MAX_PENDING': 5000,  # Visits kept while flushes fail.
+# }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -129,19 +229,50 @@ REST_FRAMEWORK = {
     # See: http://www.django-rest-framework.org/api-guide/authentication/#how-authentication-is-determined
     'DEFAULT_AUTHENTICATION_CLASSES': (
 
-        # HTTP Basic Authentication, signed against a user's username and password.
-        # Basic authentication is generally only appropriate for testing.
-        'rest_framework.authentication.BasicAuthentication',
+        # Tokens of api-token-auth/, cached and expiring, see luke/authentication.py.
+        'luke.authentication.ExpiringTokenAuthentication',
 
         'rest_framework.authentication.SessionAuthentication',
 
-        'rest_framework.authentication.TokenAuthentication',
+        # HTTP Basic Authentication, signed against a user's username and password.
+        # Basic authentication is generally only appropriate for testing, it
+        # hashes the password on every request.
+        'rest_framework.authentication.BasicAuthentication',
     ),
 
+    # Rate limiting of the writes of the views with a throttle_scope, by
+    # token buckets, see luke/throttling.py.
+    'DEFAULT_THROTTLE_CLASSES': (
+        'luke.throttling.TokenBucketThrottle',
+    ),
+    # Scope -> bucket size/refill period, per user (or per IP if anonymous).
+    'DEFAULT_THROTTLE_RATES': {
+        'signup': '10/h',
+        'login': '10/m',
+        'posts': '20/m',
+        'photos': '60/m',
+        'visits': '300/m',
+        'discussions': '20/m',
+        'messages': '60/m',
+    },
+    # The IP of an anonymous client is REMOTE_ADDR, set by nginx (see
+    # mysite_nginx.conf), rather than X-Forwarded-For, which the client can
+    # set to get a new bucket per request. Set it to the number of proxies in
+    # front of nginx (e.g., a load balancer) which append to X-Forwarded-For.
+    'NUM_PROXIES': 0,
+
     # List pagination.
+    # Keyset pagination classes are set per view, see luke/pagination.py.
     'PAGE_SIZE': 10,
 }
 
+# Tokens expire after LUKE_TOKEN_EXPIRY seconds (None for never) and are
+# cached for LUKE_TOKEN_CACHE_TIMEOUT seconds, see luke/authentication.py.
+# Without a shared cache, that's how long the other workers may accept a
+# revoked token.
+LUKE_TOKEN_EXPIRY = 30 * 24 * 3600
+LUKE_TOKEN_CACHE_TIMEOUT = 300 if os.environ.get('LUKE_MEMCACHED') else 5
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
 
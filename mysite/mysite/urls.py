@@ -19,9 +19,10 @@ from django.conf.urls import include, url
 from django.contrib import admin
 from django.views.generic import TemplateView
 
-from rest_framework.authtoken import views
 from rest_framework.schemas import get_schema_view
 
+from luke.views import obtain_auth_token
+
 urlpatterns = [
     url(r'^', include('luke.urls')),
     url(r'^admin/', admin.site.urls),
@@ -30,7 +31,8 @@ urlpatterns = [
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 
     # for clients to obtain a token given the username and password.
-    url(r'^api-token-auth/', views.obtain_auth_token),
+    # Tokens expire, see luke/authentication.py.
+    url(r'^api-token-auth/', obtain_auth_token),
 
     # Use the `get_schema_view()` helper to add a `SchemaView` to project URLs.
     #   * `title` and `description` parameters are passed to `SchemaGenerator`.